@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""
+Benchmark recall@k against latency for the VectorDB index types.
+
+Builds each index over the same clustered synthetic embeddings, uses the
+flat index as ground truth and reports build time, index size, per-query
+latency and recall@k for a sweep of nprobe / efSearch settings. Every index
+type except ivfpq is also built at each reduced --precisions, and measured
+with and without exact reranking of --rerank-factor * k candidates.
+"""
+
+import argparse
+import itertools
+import time
+
+import faiss
+import numpy as np
+
+from src.autonomous_ta.vector_db import VectorDB
+
+
+def make_embeddings(n_chunks, dim, n_queries, n_clusters=200, seed=0):
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((n_clusters, dim)).astype("float32")
+    labels = rng.integers(0, n_clusters, n_chunks)
+    embeddings = centers[labels] + 0.3 * rng.standard_normal((n_chunks, dim))
+    picks = rng.choice(n_chunks, n_queries, replace=False)
+    queries = embeddings[picks] + 0.1 * rng.standard_normal((n_queries, dim))
+    return embeddings.astype("float32"), queries.astype("float32")
+
+
+def build(db, embeddings):
+    texts = [""] * len(embeddings)
+    metadata = [
+        {"chapter": "Synthetic", "page": 1, "book": "synthetic.pdf.jsonl"}
+    ] * len(embeddings)
+    start = time.perf_counter()
+    db.set_corpus(texts, metadata, embeddings)
+    return time.perf_counter() - start
+
+
+def measure(db, queries, truth, top_k):
+    start = time.perf_counter()
+    for q_vec in queries:
+        _, indices = db.search(q_vec[None, :], top_k)
+    latency = (time.perf_counter() - start) / len(queries) * 1000
+    _, indices = db.search(queries, top_k)
+    hits = sum(
+        len(set(found) & set(expected)) for found, expected in zip(indices, truth)
+    )
+    return latency, hits / truth.size
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument("--chunks", type=int, default=100_000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--top-k", type=int, default=5)
+    parser.add_argument("--nprobe", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--ef-search", type=int, nargs="+", default=[16, 64, 128])
+    parser.add_argument(
+        "--precisions", nargs="+", default=["float32", "float16", "int8"]
+    )
+    parser.add_argument("--rerank-factor", type=int, default=4)
+    args = parser.parse_args()
+
+    db = VectorDB(cache_embeddings=False)
+    dim = db.model.get_sentence_embedding_dimension()
+    embeddings, queries = make_embeddings(args.chunks, dim, args.queries)
+
+    build(db, embeddings)
+    _, truth = db.search(queries, args.top_k)
+
+    print(
+        f"{'index':<8} {'precision':<9} {'setting':<14} {'rerank':>6} "
+        f"{'build s':>8} {'size MB':>8} {'ms/query':>9} "
+        f"{'recall@' + str(args.top_k):>9}"
+    )
+    for index_type, knob, values in [
+        ("flat", None, [None]),
+        ("ivf", "nprobe", args.nprobe),
+        ("ivfpq", "nprobe", args.nprobe),
+        ("hnsw", "ef_search", args.ef_search),
+    ]:
+        for precision in args.precisions:
+            if index_type == "ivfpq" and precision != "float32":
+                continue
+            db.index_type = index_type
+            db.precision = precision
+            db.rerank_factor = 0
+            build_time = build(db, embeddings)
+            size = len(faiss.serialize_index(db.index)) / 1e6
+            reranks = [0] if precision == "float32" else [0, args.rerank_factor]
+            for value, rerank_factor in itertools.product(values, reranks):
+                if knob:
+                    setattr(db, knob, value)
+                db.rerank_factor = rerank_factor
+                latency, recall = measure(db, queries, truth, args.top_k)
+                setting = f"{knob}={value}" if knob else "exact"
+                print(
+                    f"{index_type:<8} {precision:<9} {setting:<14} "
+                    f"{rerank_factor or '-':>6} {build_time:>8.2f} "
+                    f"{size:>8.1f} {latency:>9.3f} {recall:>9.3f}"
+                )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""
+Benchmark chunk size distribution and throughput of the chunker.
+
+Chunks synthetic pages (or the pages of --pdf) with a range of max_tokens
+and overlap settings and reports the chunk count, token percentiles per
+chunk and pages per second. The previous character-count heuristic is
+included as a baseline.
+"""
+
+import argparse
+import random
+import time
+
+import numpy as np
+
+from src.autonomous_ta.load_data import get_toc, iter_chunks, iter_pages
+from src.autonomous_ta.tokens import count_tokens
+
+WORDS = (
+    "mean median variance sample population hypothesis test regression "
+    "probability distribution normal standard deviation interval estimate "
+    "the of a and to in is that for with as by data value"
+).split()
+
+
+def make_pages(n_pages, seed=0):
+    rng = random.Random(seed)
+    pages = []
+    for page_num in range(1, n_pages + 1):
+        paragraphs = []
+        for _ in range(rng.randint(2, 6)):
+            sentences = [
+                " ".join(rng.choices(WORDS, k=rng.randint(6, 30))).capitalize()
+                + "."
+                for _ in range(rng.randint(1, 8))
+            ]
+            paragraphs.append(" ".join(sentences))
+        pages.append({"page_num": page_num, "text": "\n\n".join(paragraphs)})
+    toc = [
+        {"level": 1, "title": f"Chapter {i + 1}", "page_num": page_num}
+        for i, page_num in enumerate(range(1, n_pages + 1, 20))
+    ]
+    return pages, toc
+
+
+def legacy_chunks(pages, toc, max_tokens=300):
+    # The character heuristic chunker this benchmark is compared against
+    chunks, current, chapter_index = [], " ", 0
+    for page in pages:
+        while (
+            chapter_index + 1 < len(toc)
+            and page["page_num"] >= toc[chapter_index + 1]["page_num"]
+        ):
+            chapter_index += 1
+        for para in page["text"].split("\n\n"):
+            para = para.strip()
+            if not para:
+                continue
+            if len(current) + len(para) < max_tokens * 4:
+                current += " " + para
+            else:
+                if current.strip():
+                    chunks.append({"chunk_text": current.strip()})
+                current = para
+    if current.strip():
+        chunks.append({"chunk_text": current.strip()})
+    return chunks
+
+
+def report(name, chunks, elapsed, n_pages):
+    sizes = np.array([count_tokens(chunk["chunk_text"]) for chunk in chunks])
+    p5, p50, p95 = np.percentile(sizes, [5, 50, 95])
+    print(
+        f"{name:>16} {len(chunks):>8} {p5:>6.0f} {p50:>6.0f} {p95:>6.0f} "
+        f"{sizes.max():>6} {n_pages / elapsed:>10.0f}"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument("--pages", type=int, default=2000)
+    parser.add_argument("--pdf", help="Chunk this PDF instead of synthetic pages")
+    parser.add_argument("--max-tokens", type=int, nargs="+", default=[200, 300])
+    parser.add_argument("--overlap", type=int, nargs="+", default=[0, 50])
+    args = parser.parse_args()
+
+    if args.pdf:
+        import fitz
+
+        with fitz.open(args.pdf) as doc:
+            pages, toc = list(iter_pages(doc)), get_toc(doc)
+    else:
+        pages, toc = make_pages(args.pages)
+
+    print(
+        f"{'chunker':>16} {'chunks':>8} {'p5':>6} {'p50':>6} {'p95':>6} "
+        f"{'max':>6} {'pages/s':>10}"
+    )
+    for max_tokens in args.max_tokens:
+        start = time.perf_counter()
+        chunks = legacy_chunks(pages, toc, max_tokens)
+        report(
+            f"legacy {max_tokens}", chunks, time.perf_counter() - start, len(pages)
+        )
+        for overlap in args.overlap:
+            start = time.perf_counter()
+            chunks = list(iter_chunks(pages, toc, max_tokens, overlap))
+            report(
+                f"tokens {max_tokens}/{overlap}",
+                chunks,
+                time.perf_counter() - start,
+                len(pages),
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+"""
+Benchmark chunk embedding throughput for different Embedder settings.
+
+Compares a single default model.encode call against the length-sorted,
+batched Embedder with various batch sizes, thread counts and worker
+processes on synthetic chunks with a textbook-like length distribution.
+"""
+
+import argparse
+import time
+
+import numpy as np
+
+from src.autonomous_ta.vector_db import Embedder, VectorDB
+
+
+WORDS = (
+    "the sample mean variance distribution regression hypothesis test "
+    "probability estimate standard error confidence interval data"
+).split()
+
+
+def make_texts(n_chunks, seed=0):
+    rng = np.random.default_rng(seed)
+    # Chunks are mostly full, with a tail of short end-of-section chunks
+    lengths = np.clip(rng.normal(200, 60, n_chunks), 5, 300).astype(int)
+    return [" ".join(rng.choice(WORDS, size=length)) for length in lengths]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument("--chunks", type=int, default=2000)
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[32, 64, 128])
+    parser.add_argument("--threads", type=int, nargs="+", default=[0])
+    parser.add_argument("--workers", type=int, nargs="+", default=[0])
+    args = parser.parse_args()
+
+    db = VectorDB()
+    texts = make_texts(args.chunks)
+
+    start = time.perf_counter()
+    db.model.encode(texts)
+    baseline = len(texts) / (time.perf_counter() - start)
+    print(f"{'baseline model.encode':<40} {baseline:>10.1f} chunks/s")
+
+    for workers in args.workers:
+        for threads in args.threads:
+            for batch_size in args.batch_sizes:
+                embedder = Embedder(
+                    db.model,
+                    batch_size=batch_size,
+                    num_threads=threads or None,
+                    num_workers=workers,
+                )
+                embedder.encode(texts)
+                embedder.close()
+                label = f"batch={batch_size} threads={threads} workers={workers}"
+                print(
+                    f"{label:<40} {embedder.last_throughput:>10.1f} chunks/s "
+                    f"({embedder.last_throughput / baseline:.2f}x)"
+                )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,48 @@
+#!/usr/bin/env python3
+"""
+Compare recall@k of dense-only and hybrid (dense + BM25) retrieval.
+
+Uses the books in data/raw/. Each question is a sentence taken from a
+randomly sampled chunk, and a hit means that chunk is among the top k
+results. Reports recall and per-query latency for both modes at each k.
+"""
+
+import argparse
+import random
+import time
+
+from src.autonomous_ta.vector_db import VectorDB
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument("--samples", type=int, default=200)
+    parser.add_argument("--top-k", type=int, nargs="+", default=[1, 3, 5, 10])
+    args = parser.parse_args()
+
+    db = VectorDB()
+    db.build_index()
+    rng = random.Random(0)
+    rows = rng.sample(range(len(db.texts)), min(args.samples, len(db.texts)))
+    questions = []
+    for row in rows:
+        sentences = [s for s in db.texts[row].split(". ") if s.strip()]
+        questions.append(rng.choice(sentences) if sentences else "")
+    q_vecs = db.embedder.encode(questions)
+
+    print(f"{'mode':>8} {'k':>4} {'recall':>8} {'ms/query':>10}")
+    for top_k in args.top_k:
+        for hybrid in (False, True):
+            db.hybrid = hybrid
+            hits = 0
+            start = time.perf_counter()
+            for row, question, q_vec in zip(rows, questions, q_vecs):
+                results = db.query(question, top_k=top_k, q_vec=q_vec[None, :])
+                hits += db.texts[row] in [r["chunk_text"] for r in results]
+            elapsed = (time.perf_counter() - start) / len(rows) * 1000
+            mode = "hybrid" if hybrid else "dense"
+            print(f"{mode:>8} {top_k:>4} {hits / len(rows):>8.1%} {elapsed:>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
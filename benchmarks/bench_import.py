@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""
+Measure import time of the package modules with python -X importtime.
+
+Each module is imported in a fresh interpreter, --runs times, and the best
+cumulative time is reported along with the slowest imports it pulls in and
+any heavy dependency (openai, torch, sentence_transformers, FAISS, PyMuPDF)
+that was loaded eagerly. Also times `cli.py --help` end to end. Exits with
+status 1 if a module exceeds --budget milliseconds.
+"""
+
+import argparse
+import subprocess
+import sys
+import time
+
+MODULES = [
+    "src.autonomous_ta.agent",
+    "src.autonomous_ta.vector_db",
+    "src.autonomous_ta.load_data",
+    "src.autonomous_ta.server",
+]
+HEAVY = ("openai", "torch", "sentence_transformers", "faiss.loader", "pymupdf")
+
+
+def import_times(module):
+    # [(name, self_us, cumulative_us)] for module and everything it imports,
+    # with module itself last; interpreter startup imports are left out
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    rows = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        nested = name[1:].startswith(" ")
+        rows.append((name.strip(), int(self_us), int(cumulative_us), nested))
+
+    # Nested imports are printed before the import that pulled them in
+    start = len(rows) - 1
+    while start > 0 and rows[start - 1][3]:
+        start -= 1
+    return [row[:3] for row in rows[start:]]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument("--modules", nargs="+", default=MODULES)
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--top", type=int, default=5)
+    parser.add_argument("--budget", type=float, default=1000.0)
+    args = parser.parse_args()
+
+    over_budget = False
+    for module in args.modules:
+        runs = [import_times(module) for _ in range(args.runs)]
+        rows = min(runs, key=lambda rows: rows[-1][2])
+        total_ms = rows[-1][2] / 1000
+        heavy = sorted({name for name, _, _ in rows if name in HEAVY})
+        status = "ok" if total_ms <= args.budget else "OVER BUDGET"
+        over_budget |= total_ms > args.budget
+        print(f"{module}: {total_ms:.1f} ms ({status})")
+        print(f"  eager heavy imports: {', '.join(heavy) or 'none'}")
+        for name, _, cumulative_us in sorted(
+            rows[:-1], key=lambda row: -row[2]
+        )[: args.top]:
+            print(f"  {cumulative_us / 1000:>8.1f} ms  {name}")
+
+    timings = []
+    for _ in range(args.runs):
+        start = time.perf_counter()
+        subprocess.run(
+            [sys.executable, "cli.py", "--help"],
+            capture_output=True,
+            check=True,
+        )
+        timings.append(time.perf_counter() - start)
+    print(f"cli.py --help: {min(timings) * 1000:.1f} ms")
+    sys.exit(1 if over_budget else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+"""
+Benchmark VectorDB.query latency as the corpus grows.
+
+The corpus is filled with random embeddings so the benchmark measures the
+search path only; the question itself is still encoded by the real model.
+Per-query latency should stay roughly flat across corpus sizes. The chunk
+store's memory per row (columns, offsets and text) is reported alongside.
+"""
+
+import argparse
+import time
+
+import numpy as np
+
+from src.autonomous_ta.vector_db import VectorDB
+
+
+def make_corpus(n_chunks, dim, n_chapters, seed=0):
+    rng = np.random.default_rng(seed)
+    embeddings = rng.standard_normal((n_chunks, dim)).astype("float32")
+    per_chapter = max(1, n_chunks // n_chapters)
+    texts = [f"synthetic chunk {i}" for i in range(n_chunks)]
+    metadata = [
+        {
+            "chapter": f"Chapter {i // per_chapter + 1}: Synthetic",
+            "page": i // 4 + 1,
+            "book": "synthetic.pdf.json",
+        }
+        for i in range(n_chunks)
+    ]
+    return texts, metadata, embeddings
+
+
+def time_queries(db, questions, chapter_keywords=None):
+    timings = []
+    for question in questions:
+        start = time.perf_counter()
+        db.query(question, top_k=5, chapter_keywords=chapter_keywords)
+        timings.append(time.perf_counter() - start)
+    return np.array(timings) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument(
+        "--sizes",
+        type=int,
+        nargs="+",
+        default=[1_000, 10_000, 100_000],
+        help="Corpus sizes (number of chunks) to benchmark",
+    )
+    parser.add_argument("--chapters", type=int, default=50)
+    parser.add_argument("--queries", type=int, default=50)
+    args = parser.parse_args()
+
+    db = VectorDB()
+    dim = db.model.get_sentence_embedding_dimension()
+    questions = [f"What is concept number {i}?" for i in range(args.queries)]
+
+    print(
+        f"{'chunks':>10} {'p50 ms':>10} {'p99 ms':>10} {'filtered p50':>14} "
+        f"{'bytes/row':>10}"
+    )
+    for size in args.sizes:
+        db.set_corpus(*make_corpus(size, dim, args.chapters))
+        db.query(questions[0])  # warm up
+        plain = time_queries(db, questions)
+        filtered = time_queries(db, questions, chapter_keywords=["Chapter 3:"])
+        print(
+            f"{size:>10} {np.percentile(plain, 50):>10.2f} "
+            f"{np.percentile(plain, 99):>10.2f} "
+            f"{np.percentile(filtered, 50):>14.2f} "
+            f"{db.chunks.bytes_per_row():>10.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+"""
+Compare local chapter routing against the LLM chapter selector.
+
+Uses the books in data/raw/. Questions come from a JSONL file of
+{"question": ..., "chapter": ...} records, where the chapter is a title or
+a "<title> [<book>]" label as listed by VectorDB.list_chapters; without
+one, the first sentence of randomly sampled chunks is used as the question
+and the chunk's chapter label as the expected answer. Reports hit rate
+(expected chapter among the picks) and per-question latency for the
+centroid router, the LLM selector (--llm, needs OPENAI_API_KEY) and the
+combined router with LLM fallback.
+"""
+
+import argparse
+import json
+import random
+import time
+
+import numpy as np
+
+from src.autonomous_ta.vector_db import VectorDB
+
+
+def sample_questions(db, n_questions, seed=0):
+    rng = random.Random(seed)
+    rows = rng.sample(range(len(db.texts)), min(n_questions, len(db.texts)))
+    questions = []
+    for row in rows:
+        sentence = db.texts[row].split(". ")[0].strip()
+        chapter = db.chapter_label(int(db.chunks.chapters[row]))
+        questions.append({"question": sentence, "chapter": chapter})
+    return questions
+
+
+def is_hit(expected, chapters):
+    # A bare title matches that title in any book
+    return any(
+        chapter == expected or chapter.rsplit(" [", 1)[0] == expected
+        for chapter in chapters
+    )
+
+
+def report(name, hits, timings, total):
+    timings = np.array(timings) * 1000
+    print(
+        f"{name:>12} {hits / total:>8.1%} {np.percentile(timings, 50):>10.3f} "
+        f"{np.percentile(timings, 99):>10.3f}"
+    )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument("--questions", help="JSONL file of labelled questions")
+    parser.add_argument("--samples", type=int, default=200)
+    parser.add_argument("--top-n", type=int, default=3)
+    parser.add_argument("--threshold", type=float, default=0.4)
+    parser.add_argument(
+        "--llm", action="store_true", help="Also time the LLM chapter selector"
+    )
+    args = parser.parse_args(argv)
+
+    db = VectorDB()
+    db.build_index()
+    if args.questions:
+        with open(args.questions, "r", encoding="utf-8") as f:
+            questions = [json.loads(line) for line in f if line.strip()]
+    else:
+        questions = sample_questions(db, args.samples)
+    q_vecs = db.embedder.encode([item["question"] for item in questions])
+
+    routed, local_timings, local_hits = [], [], 0
+    for item, q_vec in zip(questions, q_vecs):
+        start = time.perf_counter()
+        picks = db.route_chapters(q_vec, top_n=args.top_n)
+        local_timings.append(time.perf_counter() - start)
+        routed.append(picks)
+        chapters = [chapter for chapter, _ in picks]
+        local_hits += is_hit(item["chapter"], chapters)
+
+    print(f"{'selector':>12} {'hit rate':>8} {'p50 ms':>10} {'p99 ms':>10}")
+    report("router", local_hits, local_timings, len(questions))
+
+    confident = [
+        [chapter for chapter, score in picks if score >= args.threshold]
+        for picks in routed
+    ]
+    print(
+        f"{sum(map(bool, confident)) / len(questions):.1%} of questions clear "
+        f"the {args.threshold} threshold"
+    )
+    if not args.llm:
+        return
+
+    from src.autonomous_ta.agent import TextbookAgent
+
+    agent = TextbookAgent(db=db, cache=False)
+    available_chapters = db.list_chapters()
+    llm_timings, llm_hits, auto_timings, auto_hits = [], 0, [], 0
+    for item, picks, local_time in zip(questions, confident, local_timings):
+        start = time.perf_counter()
+        try:
+            chosen = agent.choose_chapters(item["question"], available_chapters)
+        except ValueError:
+            chosen = []
+        llm_timings.append(time.perf_counter() - start)
+        llm_hits += is_hit(item["chapter"], chosen)
+
+        # The combined mode only pays for the LLM call when unsure
+        if picks:
+            auto_timings.append(local_time)
+            auto_hits += is_hit(item["chapter"], picks)
+        else:
+            auto_timings.append(local_time + llm_timings[-1])
+            auto_hits += is_hit(item["chapter"], chosen)
+
+    report("llm", llm_hits, llm_timings, len(questions))
+    report("router+llm", auto_hits, auto_timings, len(questions))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,341 @@
+#!/usr/bin/env python3
+"""
+Reproducible retrieval and end-to-end benchmark suite.
+
+Measures chunking throughput on synthetic pages, then for each corpus size
+writes a synthetic textbook of that many chunks to a temporary data
+directory and measures cold and warm build_index time, resident memory,
+query p50/p99 latency with and without a chapter filter, and
+answer_question end to end against the fake chat-completions server in
+benchmarks/fake_llm.py. --fake-embeddings replaces the embedding model with
+seeded random vectors so corpora of up to 1M chunks build in minutes.
+Results are written as JSON; compare two runs with benchmarks/compare.py.
+"""
+
+from pathlib import Path
+
+import argparse
+import contextlib
+import datetime
+import gc
+import io
+import itertools
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import zlib
+
+import numpy as np
+
+from benchmarks.bench_chunk import WORDS
+from benchmarks.fake_llm import FakeChatServer
+from src.autonomous_ta.load_data import (
+    MAX_TOKENS,
+    chunk_text,
+    iter_chunks,
+    write_chunks,
+)
+
+import src.autonomous_ta.agent as agent_module
+import src.autonomous_ta.vector_db as vector_db
+
+PAGES_PER_CHAPTER = 20
+
+
+class SeededEmbedder:
+    # Stand-in for the embedding model: each text maps to a fixed random
+    # vector seeded by its CRC, so runs are repeatable and the search path
+    # is exercised without paying for the model
+    def __init__(self, dim=384):
+        self.dim = dim
+        self.last_throughput = None
+
+    def encode(self, texts, show_progress_bar=False):
+        texts = list(texts)
+        start = time.perf_counter()
+        embeddings = np.empty((len(texts), self.dim), dtype="float32")
+        for pos, text in enumerate(texts):
+            rng = np.random.default_rng(zlib.crc32(text.encode("utf-8")))
+            embeddings[pos] = rng.standard_normal(self.dim, dtype="float32")
+        elapsed = time.perf_counter() - start
+        self.last_throughput = len(texts) / elapsed if elapsed else None
+        return embeddings
+
+    def close(self):
+        pass
+
+
+def synthetic_pages(seed=0):
+    # Endless pages built from a fixed pool of sentences, so millions of
+    # chunks can be generated quickly and identically on every run
+    rng = random.Random(seed)
+    pool = [
+        " ".join(rng.choices(WORDS, k=rng.randint(6, 30))).capitalize() + "."
+        for _ in range(2000)
+    ]
+    for page_num in itertools.count(1):
+        paragraphs = [
+            " ".join(rng.choices(pool, k=rng.randint(1, 8)))
+            for _ in range(rng.randint(2, 6))
+        ]
+        yield {"page_num": page_num, "text": "\n\n".join(paragraphs)}
+
+
+def synthetic_toc(n_pages):
+    return [
+        {"level": 1, "title": f"Chapter {i + 1}", "page_num": page_num}
+        for i, page_num in enumerate(range(1, n_pages + 1, PAGES_PER_CHAPTER))
+    ]
+
+
+def write_corpus(data_dir, n_chunks, n_books, max_tokens, seed=0):
+    # A page yields at least one chunk, so n_chunks pages always suffice
+    toc = synthetic_toc(n_chunks)
+    per_book = -(-n_chunks // n_books)
+    for book in range(n_books):
+        count = min(per_book, n_chunks - book * per_book)
+        chunks = iter_chunks(synthetic_pages(seed + book), toc, max_tokens)
+        write_chunks(
+            itertools.islice(chunks, count),
+            data_dir / f"synthetic-{book}.pdf.jsonl",
+        )
+
+
+def rss_mb():
+    try:
+        with open("/proc/self/status", encoding="utf-8") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    import resource
+
+    # Peak rather than current on platforms without /proc
+    scale = 1 if sys.platform == "darwin" else 1024
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale / 2**20
+
+
+def percentiles(timings):
+    p50, p99 = np.percentile(np.array(timings) * 1000, [50, 99])
+    return float(p50), float(p99)
+
+
+def make_db(args):
+    db = vector_db.VectorDB(
+        index_type=args.index_type,
+        precision=args.precision,
+        rerank_factor=args.rerank_factor,
+    )
+    if args.fake_embeddings:
+        db.embedder = SeededEmbedder(args.dim)
+        db.model_name = f"seeded-{args.dim}"
+    return db
+
+
+def bench_chunking(args):
+    pages = list(
+        itertools.islice(synthetic_pages(args.seed), args.chunk_pages)
+    )
+    toc = synthetic_toc(len(pages))
+    start = time.perf_counter()
+    chunks = chunk_text(pages, toc, args.max_tokens)
+    elapsed = time.perf_counter() - start
+    return {
+        "pages": len(pages),
+        "chunks": len(chunks),
+        "pages_per_s": len(pages) / elapsed,
+        "chunks_per_s": len(chunks) / elapsed,
+    }
+
+
+def time_queries(db, questions, chapter_keywords=None):
+    timings = []
+    for question in questions:
+        start = time.perf_counter()
+        db.query(question, top_k=5, chapter_keywords=chapter_keywords)
+        timings.append(time.perf_counter() - start)
+    return percentiles(timings)
+
+
+def time_answers(db, questions, latency):
+    from openai import OpenAI
+
+    # The agent's shared client is swapped for one pointed at the fake
+    # server, and put back afterwards; the environment is left untouched
+    previous = agent_module.client
+    with FakeChatServer(latency=latency) as server:
+        agent_module.client = OpenAI(api_key="benchmark", base_url=server.url)
+        try:
+            agent = agent_module.TextbookAgent(db=db, cache=False)
+            # Keep connection setup out of the timings
+            agent.answer_question(questions[0])
+            requests = server.requests
+            timings = []
+            for question in questions:
+                start = time.perf_counter()
+                agent.answer_question(question)
+                timings.append(time.perf_counter() - start)
+        finally:
+            agent_module.client = previous
+        calls = (server.requests - requests) / len(questions)
+        return percentiles(timings), calls
+
+
+def bench_size(args, n_chunks):
+    quiet = contextlib.redirect_stdout(io.StringIO())
+    questions = [
+        f"What is the {WORDS[i % len(WORDS)]} of concept {i}?"
+        for i in range(args.queries)
+    ]
+    with tempfile.TemporaryDirectory() as tmp, quiet:
+        data_dir = Path(tmp)
+        start = time.perf_counter()
+        write_corpus(
+            data_dir, n_chunks, args.books, args.max_tokens, args.seed
+        )
+        generate = time.perf_counter() - start
+        vector_db.DATA_DIR = data_dir
+
+        gc.collect()
+        rss_before = rss_mb()
+        db = make_db(args)
+        start = time.perf_counter()
+        db.build_index()
+        build_cold = time.perf_counter() - start
+        del db
+        gc.collect()
+
+        db = make_db(args)
+        start = time.perf_counter()
+        db.build_index()
+        build_warm = time.perf_counter() - start
+        rss = rss_mb()
+
+        db.query(questions[0])
+        query_p50, query_p99 = time_queries(db, questions)
+        filtered_p50, filtered_p99 = time_queries(
+            db, questions, chapter_keywords=["Chapter 3"]
+        )
+        e2e = questions[: args.e2e_questions]
+        (answer_p50, answer_p99), llm_calls = time_answers(
+            db, e2e, args.llm_latency
+        )
+        result = {
+            "chunks": db.live_rows(),
+            "generate_s": generate,
+            "build_cold_s": build_cold,
+            "build_warm_s": build_warm,
+            "rss_mb": rss,
+            "rss_delta_mb": rss - rss_before,
+            "chunk_store_bytes_per_row": db.chunks.bytes_per_row(),
+            "query_p50_ms": query_p50,
+            "query_p99_ms": query_p99,
+            "filtered_query_p50_ms": filtered_p50,
+            "filtered_query_p99_ms": filtered_p99,
+            "answer_p50_ms": answer_p50,
+            "answer_p99_ms": answer_p99,
+            "llm_calls_per_answer": llm_calls,
+        }
+    return result
+
+
+def environment(args):
+    def git(*command):
+        try:
+            return subprocess.run(
+                ["git", *command], capture_output=True, text=True, check=True
+            ).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
+
+    return {
+        "commit": git("rev-parse", "HEAD"),
+        "dirty": bool(git("status", "--porcelain", "--untracked-files=no")),
+        "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "numpy": np.__version__,
+        "faiss": getattr(vector_db.faiss, "__version__", None),
+        "args": vars(args),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__.strip().split("\n")[0]
+    )
+    parser.add_argument(
+        "--sizes", type=int, nargs="+", default=[100, 1_000, 10_000]
+    )
+    parser.add_argument("--books", type=int, default=1)
+    parser.add_argument("--max-tokens", type=int, default=MAX_TOKENS)
+    parser.add_argument("--index-type", default="flat")
+    parser.add_argument(
+        "--precision", default="float32", choices=vector_db.PRECISIONS
+    )
+    parser.add_argument("--rerank-factor", type=int, default=0)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--e2e-questions", type=int, default=20)
+    parser.add_argument(
+        "--llm-latency",
+        type=float,
+        default=0.0,
+        help="Seconds the fake chat server waits per response",
+    )
+    parser.add_argument("--chunk-pages", type=int, default=2000)
+    parser.add_argument(
+        "--fake-embeddings",
+        action="store_true",
+        help="Use seeded random vectors instead of the embedding model",
+    )
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--output", type=Path, default=Path("bench_results.json")
+    )
+    args = parser.parse_args()
+
+    data_dir = vector_db.DATA_DIR
+    results = {"environment": environment(args)}
+    results["chunking"] = bench_chunking(args)
+    print(
+        f"chunking: {results['chunking']['pages_per_s']:.0f} pages/s, "
+        f"{results['chunking']['chunks_per_s']:.0f} chunks/s"
+    )
+
+    print(
+        f"{'chunks':>9} {'cold s':>8} {'warm s':>8} {'rss MB':>8} "
+        f"{'q p50':>7} {'q p99':>7} {'f p50':>7} {'f p99':>7} "
+        f"{'ans p50':>8} {'ans p99':>8}"
+    )
+    results["sizes"] = []
+    try:
+        for n_chunks in args.sizes:
+            result = bench_size(args, n_chunks)
+            results["sizes"].append(result)
+            print(
+                f"{result['chunks']:>9} {result['build_cold_s']:>8.2f} "
+                f"{result['build_warm_s']:>8.2f} {result['rss_mb']:>8.0f} "
+                f"{result['query_p50_ms']:>7.2f} "
+                f"{result['query_p99_ms']:>7.2f} "
+                f"{result['filtered_query_p50_ms']:>7.2f} "
+                f"{result['filtered_query_p99_ms']:>7.2f} "
+                f"{result['answer_p50_ms']:>8.2f} "
+                f"{result['answer_p99_ms']:>8.2f}"
+            )
+    finally:
+        vector_db.DATA_DIR = data_dir
+
+    args.output.write_text(json.dumps(results, indent=2, default=str) + "\n")
+    print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+"""
+Compare two bench_suite result files.
+
+Prints every metric present in both runs with its relative change, and
+marks changes beyond --threshold as regressions or improvements: metrics
+ending in _per_s are better when higher, all others (times, latencies,
+memory) when lower. Exits with status 1 if anything regressed.
+"""
+
+import argparse
+import json
+import sys
+
+# Reported for context but not compared
+SKIPPED = {"chunks", "pages", "generate_s", "llm_calls_per_answer"}
+
+
+def flatten(results):
+    metrics = {}
+    for name, value in results.get("chunking", {}).items():
+        metrics[f"chunking.{name}"] = value
+    for size in results.get("sizes", []):
+        for name, value in size.items():
+            metrics[f"{size['chunks']}.{name}"] = value
+    return {
+        key: value
+        for key, value in metrics.items()
+        if key.split(".", 1)[1] not in SKIPPED
+        and isinstance(value, (int, float))
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__.strip().split("\n")[0]
+    )
+    parser.add_argument("baseline")
+    parser.add_argument("candidate")
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.10,
+        help="Relative change that counts as a regression (default: 0.10)",
+    )
+    args = parser.parse_args()
+
+    with open(args.baseline, encoding="utf-8") as f:
+        baseline = json.load(f)
+    with open(args.candidate, encoding="utf-8") as f:
+        candidate = json.load(f)
+    for label, results in (("baseline", baseline), ("candidate", candidate)):
+        env = results.get("environment", {})
+        print(
+            f"{label}: {(env.get('commit') or 'unknown')[:12]}"
+            f"{' (dirty)' if env.get('dirty') else ''} "
+            f"{env.get('timestamp', '')}"
+        )
+
+    old, new = flatten(baseline), flatten(candidate)
+    regressions = 0
+    print(
+        f"\n{'metric':<36} {'baseline':>12} {'candidate':>12} {'change':>9}"
+    )
+    for key in [key for key in old if key in new]:
+        change = (new[key] - old[key]) / old[key] if old[key] else 0.0
+        better = change > 0 if key.endswith("_per_s") else change < 0
+        status = ""
+        if abs(change) > args.threshold:
+            status = "improved" if better else "REGRESSED"
+            regressions += not better
+        print(
+            f"{key:<36} {old[key]:>12.3f} {new[key]:>12.3f} "
+            f"{change:>+8.1%} {status}"
+        )
+    print(f"\n{regressions} regression(s) beyond {args.threshold:.0%}")
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+"""
+Deterministic local stand-in for the OpenAI chat-completions API.
+
+Answers chapter selection with the first available chapter, evaluation with
+YES and synthesis with a fixed answer, after an optional fixed latency, so
+end-to-end timings measure the pipeline rather than the network. Point a
+client at it with base_url, or OPENAI_BASE_URL for the default client.
+"""
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import argparse
+import ast
+import json
+import re
+import threading
+import time
+
+ANSWER = (
+    "The sample mean is the sum of the observations divided by their "
+    "number. It estimates the population mean, and its standard error "
+    "shrinks with the square root of the sample size."
+)
+
+
+def reply(prompt):
+    if "JSON array of chapter titles" in prompt:
+        match = re.search(
+            r"Available Chapters:\s*(\[.*?\])\n", prompt, re.DOTALL
+        )
+        chapters = ast.literal_eval(match.group(1)) if match else []
+        return json.dumps(chapters[:1])
+    if "ONLY ONE WORD" in prompt:
+        return "YES"
+    if "VERDICT: YES" in prompt:
+        return f"{ANSWER}\nVERDICT: YES"
+    return ANSWER
+
+
+class FakeChatHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        prompt = body["messages"][0]["content"]
+        content = reply(prompt)
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        with self.server.lock:
+            self.server.requests += 1
+        payload = json.dumps(
+            {
+                "id": "chatcmpl-fake",
+                "object": "chat.completion",
+                "created": 0,
+                "model": body["model"],
+                "choices": [
+                    {
+                        "index": 0,
+                        "message": {"role": "assistant", "content": content},
+                        "finish_reason": "stop",
+                    }
+                ],
+                "usage": {
+                    "prompt_tokens": len(prompt.split()),
+                    "completion_tokens": len(content.split()),
+                    "total_tokens": len(prompt.split()) + len(content.split()),
+                },
+            }
+        ).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FakeChatServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, host="127.0.0.1", port=0, latency=0.0):
+        super().__init__((host, port), FakeChatHandler)
+        self.latency = latency
+        self.requests = 0
+        self.lock = threading.Lock()
+        self.thread = None
+
+    @property
+    def url(self):
+        return f"http://{self.server_address[0]}:{self.server_address[1]}/v1"
+
+    def __enter__(self):
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.shutdown()
+        self.server_close()
+        return False
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__.strip().split("\n")[0]
+    )
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument(
+        "--latency", type=float, default=0.0, help="Seconds per response"
+    )
+    args = parser.parse_args()
+
+    server = FakeChatServer(args.host, args.port, args.latency)
+    print(f"Fake chat completions on {server.url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -4,10 +4,86 @@ Command-line interface for the Autonomous Teaching Assistant.
 """
 
 import argparse
+import asyncio
+import json
 import sys
+import urllib.request
 from pathlib import Path
 
-from src.autonomous_ta.agent import TextbookAgent
+
+def ask_server(url, question, top_k):
+    # Thin client: the server already holds the model and index, so this
+    # path never imports them
+    request = urllib.request.Request(
+        url.rstrip("/") + "/answer",
+        data=json.dumps({"question": question, "top_k": top_k}).encode("utf-8"),
+        headers={"Content-Type": "application/json"},
+    )
+    with urllib.request.urlopen(request) as response:
+        payload = json.loads(response.read())
+    return payload["answer"], payload["chunks"]
+
+
+def stream_mode(args):
+    from src.autonomous_ta.agent import TextbookAgent
+
+    print("Initializing agent...")
+    agent = TextbookAgent(model=args.model)
+    print("\nAnswering question...\n")
+
+    stream = agent.stream_answer(args.question, top_k=args.top_k)
+    started = False
+    for text in stream:
+        if not started:
+            print("\n" + "=" * 60)
+            print("ANSWER")
+            print("=" * 60)
+            started = True
+        print(text, end="", flush=True)
+    if started:
+        print()
+    print(f"\nSelf-evaluation: {stream.verdict}")
+    if stream.verdict != "YES":
+        return "", stream.chunks
+    return stream.answer, stream.chunks
+
+
+def print_chunks(chunks):
+    print("\n" + "=" * 60)
+    print("RETRIEVED CHUNKS")
+    print("=" * 60)
+    for i, chunk in enumerate(chunks, 1):
+        print(f"\n[{i}] Chapter: {chunk['chapter']}")
+        print(f"    Page: {chunk['page']}")
+        print(f"    Book: {chunk['book']}")
+        print(f"    Distance: {chunk.get('distance', 'N/A'):.4f}")
+        if "score" in chunk:
+            print(f"    Score: {chunk['score']:.4f}")
+        print(f"    Preview: {chunk['chunk_text'][:200]}...")
+
+
+def run_batch_mode(args):
+    from src.autonomous_ta.agent import AsyncTextbookAgent
+    from src.autonomous_ta.batch import run_batch
+
+    output = args.output or args.batch.with_name(
+        f"{args.batch.stem}.answers.jsonl"
+    )
+
+    async def run():
+        print("Initializing agent...")
+        agent = AsyncTextbookAgent(
+            model=args.model, max_concurrency=args.concurrency
+        )
+        try:
+            count = await run_batch(
+                agent, args.batch, output, top_k=args.top_k
+            )
+        finally:
+            await agent.close()
+        print(f"Answered {count} questions, results in {output}")
+
+    asyncio.run(run())
 
 
 def main():
@@ -17,13 +93,17 @@ def main():
     parser.add_argument(
         "question",
         type=str,
+        nargs="?",
         help="The question to answer",
     )
     parser.add_argument(
         "--model",
         type=str,
-        default="gpt-4o-mini",
-        help="OpenAI model to use (default: gpt-4o-mini)",
+        default=None,
+        help=(
+            "OpenAI model to use (default: gpt-4o-mini); with --server, "
+            "the server's own --model applies"
+        ),
     )
     parser.add_argument(
         "--top-k",
@@ -36,15 +116,134 @@ def main():
         action="store_true",
         help="Show verbose output including retrieved chunks",
     )
+    parser.add_argument(
+        "--max-rounds",
+        type=int,
+        default=1,
+        help="Retrieve from further chapters while the answer is judged "
+        "incomplete, up to this many rounds (default: 1)",
+    )
+    parser.add_argument(
+        "--time-budget",
+        type=float,
+        help="Start no new retrieval round after this many seconds",
+    )
+    parser.add_argument(
+        "--token-budget",
+        type=int,
+        help="Start no new retrieval round after this many tokens",
+    )
+    parser.add_argument(
+        "--stream",
+        action="store_true",
+        help="Print the answer as it is generated, with the self-evaluation "
+        "folded into the same request",
+    )
+
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="Print a per-stage breakdown of time, tokens and cache hits",
+    )
+    parser.add_argument(
+        "--trace",
+        type=Path,
+        help="Append a JSON line per pipeline stage span to this file",
+    )
+
+    parser.add_argument(
+        "--batch",
+        type=Path,
+        help="Answer every question in a JSONL or CSV file instead",
+    )
+    parser.add_argument(
+        "--output",
+        type=Path,
+        help="JSONL file for batch answers (default: <batch>.answers.jsonl); "
+        "an interrupted run resumes from it",
+    )
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=16,
+        help="Maximum concurrent OpenAI requests in batch mode (default: 16)",
+    )
+
+    parser.add_argument(
+        "--serve",
+        action="store_true",
+        help="Run a local HTTP server that keeps the model and index loaded",
+    )
+    parser.add_argument(
+        "--server",
+        type=str,
+        help="Send the question to a running server, e.g. http://127.0.0.1:8000",
+    )
+    parser.add_argument(
+        "--host",
+        type=str,
+        default="127.0.0.1",
+        help="Host to bind with --serve (default: 127.0.0.1)",
+    )
+    parser.add_argument(
+        "--port",
+        type=int,
+        default=8000,
+        help="Port to bind with --serve (default: 8000)",
+    )
 
     args = parser.parse_args()
+    if args.batch is None and args.question is None and not args.serve:
+        parser.error("a question, --batch FILE or --serve is required")
+    if args.stream and (args.batch or args.serve or args.server):
+        parser.error("--stream only applies to a single local question")
+    if args.server and args.model is not None:
+        parser.error(
+            "--model cannot be changed per request; start the server with "
+            "--serve --model instead"
+        )
+    if args.model is None:
+        args.model = "gpt-4o-mini"
+
+    if args.profile or args.trace:
+        from src.autonomous_ta.telemetry import telemetry
+
+        telemetry.enable(jsonl_path=args.trace)
 
     try:
-        print("Initializing agent...")
-        agent = TextbookAgent(model=args.model)
-        print("\nAnswering question...\n")
-        
-        answer, chunks = agent.answer_question(args.question, top_k=args.top_k, model=args.model)
+        if args.serve:
+            from src.autonomous_ta.server import serve
+
+            serve(args.host, args.port, args.model)
+            return
+        if args.batch is not None:
+            run_batch_mode(args)
+            return
+
+        if args.stream:
+            answer, chunks = stream_mode(args)
+            if not answer:
+                print("Unable to generate an answer for this question.")
+                sys.exit(1)
+            if args.verbose and chunks:
+                print_chunks(chunks)
+            return
+
+        if args.server:
+            answer, chunks = ask_server(args.server, args.question, args.top_k)
+        else:
+            from src.autonomous_ta.agent import TextbookAgent
+
+            print("Initializing agent...")
+            agent = TextbookAgent(
+                model=args.model,
+                max_rounds=args.max_rounds,
+                time_budget=args.time_budget,
+                token_budget=args.token_budget,
+            )
+            print("\nAnswering question...\n")
+
+            answer, chunks = agent.answer_question(args.question, top_k=args.top_k, model=args.model)
         
         if answer:
             print("\n" + "=" * 60)
@@ -53,16 +252,7 @@ def main():
             print(answer)
             
             if args.verbose and chunks:
-                print("\n" + "=" * 60)
-                print("RETRIEVED CHUNKS")
-                print("=" * 60)
-                for i, chunk in enumerate(chunks, 1):
-                    print(f"\n[{i}] Chapter: {chunk['chapter']}")
-                    print(f"    Page: {chunk['page']}")
-                    print(f"    Book: {chunk['book']}")
-                    print(f"    Distance: {chunk.get('distance', 'N/A'):.4f}")
-                    if args.verbose:
-                        print(f"    Preview: {chunk['chunk_text'][:200]}...")
+                print_chunks(chunks)
         else:
             print("Unable to generate an answer for this question.")
             sys.exit(1)
@@ -76,6 +266,12 @@ def main():
     except Exception as e:
         print(f"Error: {e}", file=sys.stderr)
         sys.exit(1)
+    finally:
+        if args.profile:
+            print("\n" + "=" * 60)
+            print("PROFILE")
+            print("=" * 60)
+            print(telemetry.report())
 
 
 if __name__ == "__main__":
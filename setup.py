@@ -33,6 +33,7 @@ setup(
     ],
     python_requires=">=3.8",
     install_requires=requirements,
+    extras_require={"tokens": ["tiktoken"]},
     entry_points={
         "console_scripts": [
             "autonomous-ta=cli:main",
@@ -1,24 +1,38 @@
 from dotenv import load_dotenv
-from openai import OpenAI
 
+from src.autonomous_ta.cache import MemoryCache, cache_key
+from src.autonomous_ta.context import ContextBuilder
+from src.autonomous_ta.telemetry import telemetry, traced
+from src.autonomous_ta.tokens import count_tokens
 from src.autonomous_ta.vector_db import VectorDB
 
+import asyncio
+import contextvars
+import functools
+import json
 import os
+import re
+import time
 
 
 load_dotenv()
 api_key = os.getenv("OPENAI_API_KEY")
-client = OpenAI(api_key=api_key)
+# Created by get_client on first use; importing openai alone takes most of
+# a second
+client = None
 
 
-class TextbookAgent:
-    def __init__(self, model="gpt-4o-mini"):
-        self.db = VectorDB()
-        self.db.build_index()
-        self.model = model
+def get_client():
+    global client
+    if client is None:
+        from openai import OpenAI
 
-    def choose_chapters(self, question, available_chapters):
-        prompt = f"""
+        client = OpenAI(api_key=api_key)
+    return client
+
+
+def chapters_prompt(question, available_chapters):
+    return f"""
         You are figuring out how to answer a question from a given list of
         chapters from a textbook.
 
@@ -29,36 +43,39 @@ class TextbookAgent:
         {available_chapters}
 
         Select the MOST relevant chapters to consult.
-        Return ONLY a JSON array of chapter titles to consult.
+        Return ONLY a JSON array of chapter titles to consult, copied
+        exactly as listed, including the book name in brackets.
         Do not include any explanation or extra text.
 
         Example:
-        ["1.2 Data, Sampling, and Variation in Data and Sampling"]
+        ["1.2 Data, Sampling, and Variation in Data and Sampling [statistics.pdf.jsonl]"]
         """
-        response = client.chat.completions.create(
-            model=self.model,
-            messages=[{"role": "user", "content": prompt}],
-            temperature=0,
-        )
-        import json
-        content = response.choices[0].message.content.strip()
-        # Try to parse as JSON first (safer than eval)
-        try:
-            return json.loads(content)
-        except json.JSONDecodeError:
-            # Fallback: if it's not valid JSON, try to extract JSON array from the response
-            import re
-            json_match = re.search(r'\[.*?\]', content, re.DOTALL)
-            if json_match:
-                return json.loads(json_match.group())
-            raise ValueError(f"Could not parse response as JSON: {content}")
 
-    def synthesize_answer(self, question, chunks):
-        context = ""
-        for chunk in chunks:
-            context += f"[Chapter: {chunk['chapter']}, "
-            context += f"Page: {chunk['page']}]\n{chunk['chunk_text']}\n\n"
-        prompt = f"""
+
+def parse_chapters(content):
+    content = content.strip()
+    # Try to parse as JSON first (safer than eval)
+    try:
+        return json.loads(content)
+    except json.JSONDecodeError:
+        # Fallback: if it's not valid JSON, try to extract JSON array from the response
+        json_match = re.search(r'\[.*?\]', content, re.DOTALL)
+        if json_match:
+            return json.loads(json_match.group())
+        raise ValueError(f"Could not parse response as JSON: {content}")
+
+
+def format_context(chunks):
+    return "".join(
+        f"[Chapter: {chunk['chapter']}, "
+        f"Page: {chunk['page']}]\n{chunk['chunk_text']}\n\n"
+        for chunk in chunks
+    )
+
+
+def synthesis_prompt(question, chunks):
+    context = format_context(chunks)
+    return f"""
         You are a helpful teaching assistant. Use the following textbook
         content to answer the question below.
         Answer only based on the textbook content, but do your best even if
@@ -72,30 +89,33 @@ class TextbookAgent:
 
         Answer:
         """  # noqa: E501
-        completion = client.chat.completions.create(
-            model=self.model,  # fmt: off
-            messages=[{"role": "user", "content": prompt}],
-            temperature=0,
-        )
-        answer = completion.choices[0].message.content
-        return answer
 
-    def find_chapters(self, question, available_chapters, consulted_chapters):
-        chapters = self.choose_chapters(question, available_chapters)
-        new_chapters = [
-            chapter
-            for chapter in chapters  # fmt: off
-            if chapter not in consulted_chapters
-        ]
-        if not new_chapters:
-            print("No new chapters to consult.")
-            return [], consulted_chapters
-        consulted_chapters.update(new_chapters)
-        print(f"Consulting Chapters - {new_chapters}")
-        return new_chapters, consulted_chapters
 
-    def evaluate_answer(self, question, answer):
-        prompt = f"""
+def verdict_synthesis_prompt(question, chunks):
+    # Synthesis and self-evaluation in one call, for streaming
+    context = format_context(chunks)
+    return f"""
+        You are a helpful teaching assistant. Use the following textbook
+        content to answer the question below.
+        Answer only based on the textbook content, but do your best even if
+        the answer is not explicitly stated.
+
+        After the answer, end with one last line that reads "VERDICT: YES"
+        if the answer is COMPLETE and WELL-SUPPORTED by the textbook content,
+        or "VERDICT: NO" otherwise.
+
+        Textbook content:
+        {context}
+
+        Question:
+        {question}
+
+        Answer:
+        """  # noqa: E501
+
+
+def evaluation_prompt(question, answer):
+    return f"""
         Evaluate the following answer to the question
 
         Question:
@@ -108,38 +128,754 @@ class TextbookAgent:
         textbook?
         Respond with ONLY ONE WORD: YES or NO.
         """
-        response = client.chat.completions.create(
+
+
+def record_usage(prompt, response, content):
+    # Token counts for the stage span the completion was made in, from the
+    # API's usage report when it has one
+    span = telemetry.current()
+    usage = getattr(response, "usage", None)
+    if usage is not None:
+        span.set(
+            prompt_tokens=usage.prompt_tokens,
+            completion_tokens=usage.completion_tokens,
+        )
+    else:
+        span.set(
+            prompt_tokens=count_tokens(prompt),
+            completion_tokens=count_tokens(content or ""),
+        )
+
+
+def chunk_key(chunk):
+    return chunk.get("row", (chunk["book"], chunk["page"], chunk["chunk_text"]))
+
+
+VERDICT_MARKER = "VERDICT:"
+
+
+class VerdictSplitter:
+    # Separates streamed answer text from the trailing verdict line. Text
+    # that could be the start of the marker is held back until the next
+    # piece shows whether it is
+    def __init__(self):
+        self.pending = ""
+        self.parts = []
+        self.verdict_text = None
+
+    def feed(self, text):
+        if self.verdict_text is not None:
+            self.verdict_text += text
+            return ""
+        self.pending += text
+        pos = self.pending.find(VERDICT_MARKER)
+        if pos != -1:
+            out = self.pending[:pos]
+            self.verdict_text = self.pending[pos + len(VERDICT_MARKER):]
+            self.pending = ""
+        else:
+            hold = 0
+            longest = min(len(VERDICT_MARKER) - 1, len(self.pending))
+            for size in range(longest, 0, -1):
+                if VERDICT_MARKER.startswith(self.pending[-size:]):
+                    hold = size
+                    break
+            split = len(self.pending) - hold
+            out, self.pending = self.pending[:split], self.pending[split:]
+        self.parts.append(out)
+        return out
+
+    def close(self):
+        out, self.pending = self.pending, ""
+        self.parts.append(out)
+        return out
+
+    @property
+    def answer(self):
+        return "".join(self.parts).strip()
+
+    @property
+    def verdict(self):
+        # "" when the model left the verdict out
+        if self.verdict_text is None:
+            return ""
+        match = re.search(r"\b(YES|NO)\b", self.verdict_text.upper())
+        return match.group(1) if match else ""
+
+
+class AnswerStream:
+    # Iterates over answer text as it arrives, synchronously or with async
+    # for depending on the agent. Once exhausted, answer, verdict and chunks
+    # hold what answer_question would have returned alongside the verdict
+    def __init__(self):
+        self.tokens = None
+        self.answer = ""
+        self.verdict = None
+        self.chunks = []
+
+    def __iter__(self):
+        return iter(self.tokens)
+
+    def __aiter__(self):
+        return self.tokens.__aiter__()
+
+
+class TextbookAgent:
+    def __init__(
+        self,
+        model="gpt-4o-mini",
+        db=None,
+        cache=None,
+        semantic_cache=None,
+        router_threshold=0.4,
+        router_top_n=3,
+        context=None,
+        max_rounds=1,
+        time_budget=None,
+        token_budget=None,
+    ):
+        if db is None:
+            db = VectorDB()
+            db.build_index()
+        self.db = db
+        self.model = model
+        # Responses are cached by model, prompt and parameters; pass
+        # cache=False to always call the API
+        if cache is None:
+            cache = MemoryCache()
+        self.cache = None if cache is False else cache
+        # Optional answer cache for paraphrased questions, see SemanticCache
+        self.semantic_cache = semantic_cache
+        # Chapters are picked from their centroid embeddings when the best
+        # match scores at least router_threshold; below that, or with
+        # router_threshold=None, the LLM chooses
+        self.router_threshold = router_threshold
+        self.router_top_n = router_top_n
+        # Retrieved chunks are deduplicated, packed into a token budget and
+        # merged by page before synthesis; context=False sends them as is
+        if context is None:
+            context = ContextBuilder()
+        self.context = None if context is False else context
+        # answer_question retrieves from further chapters while the answer
+        # is judged incomplete, for at most max_rounds rounds; no new round
+        # starts once time_budget seconds or token_budget tokens (context
+        # sent plus answers generated) are spent
+        self.max_rounds = max_rounds
+        self.time_budget = time_budget
+        self.token_budget = token_budget
+        self.last_rounds = []
+
+    def warmup(self):
+        # Pay for the embedding model, FAISS and the API client up front
+        # instead of on the first question
+        self.db.warmup()
+        self.get_client()
+        return self
+
+    def get_client(self):
+        return get_client()
+
+    def complete(self, prompt, **params):
+        params.setdefault("temperature", 0)
+        messages = [{"role": "user", "content": prompt}]
+        key = cache_key(self.model, messages, **params)
+        if self.cache is not None:
+            content = self.cache.get(key)
+            telemetry.current().set(cache="miss" if content is None else "hit")
+            if content is not None:
+                return content
+
+        response = self.get_client().chat.completions.create(
             model=self.model,
-            messages=[{"role": "user", "content": prompt}],
-            temperature=0,
+            messages=messages,
+            **params,
         )
-        return response.choices[0].message.content.strip()
+        content = response.choices[0].message.content
+        if telemetry.enabled:
+            record_usage(prompt, response, content)
+        if self.cache is not None:
+            self.cache.set(key, content)
+        return content
 
-    def answer_question(self, question, top_k=5, model="gpt-4o-mini"):
-        available_chapters = self.db.list_chapters()
-        consulted_chapters = set()
-        all_chunks = []
+    def complete_stream(self, prompt, **params):
+        # Yields the completion in pieces as they arrive; cached under the
+        # same key as complete, so a hit comes back as a single piece
+        params.setdefault("temperature", 0)
+        messages = [{"role": "user", "content": prompt}]
+        key = cache_key(self.model, messages, **params)
+        if self.cache is not None:
+            content = self.cache.get(key)
+            if content is not None:
+                yield content
+                return
+
+        response = self.get_client().chat.completions.create(
+            model=self.model,
+            messages=messages,
+            stream=True,
+            **params,
+        )
+        parts = []
+        for event in response:
+            if not event.choices:
+                continue
+            delta = event.choices[0].delta.content
+            if delta:
+                parts.append(delta)
+                yield delta
+        if self.cache is not None:
+            self.cache.set(key, "".join(parts))
+
+    def cache_stats(self):
+        if self.cache is None:
+            return None
+        return self.cache.stats()
 
-        chapters, consulted_chapters = self.find_chapters(
-            question, available_chapters, consulted_chapters
+    @traced("choose_chapters")
+    def choose_chapters(self, question, available_chapters):
+        chapters = parse_chapters(
+            self.complete(chapters_prompt(question, available_chapters))
         )
-        if not chapters:
-            print(f"Unable to find content related to '{question}'")
-            return "", ""
-        results = self.db.query(
-            question, top_k=top_k, chapter_keywords=chapters
+        telemetry.current().set(
+            input_size=len(available_chapters), output_size=len(chapters)
+        )
+        return chapters
+
+    @traced("route_chapters")
+    def route_chapters(self, q_vec, books=None, exclude=()):
+        if self.router_threshold is None:
+            return None
+        routed = self.db.route_chapters(
+            q_vec, top_n=self.router_top_n + len(exclude), books=books
         )
-        all_chunks.extend(results)
-        answer = self.synthesize_answer(question, all_chunks)
-        verdict = self.evaluate_answer(question, answer)
-        print(f"Self-evaluation: {verdict}")
+        chapters = [
+            chapter
+            for chapter, score in routed
+            if score >= self.router_threshold and chapter not in exclude
+        ]
+        telemetry.current().set(output_size=len(chapters))
+        return chapters[: self.router_top_n] or None
+
+    @traced("build_context")
+    def build_context(self, question, chunks):
+        if self.context is None:
+            return chunks, None
+        blocks, report = self.context.assemble(question, chunks)
+        telemetry.current().set(
+            input_size=report["tokens_in"], output_size=report["tokens_out"]
+        )
+        return blocks, report
+
+    def context_stats(self):
+        if self.context is None:
+            return None
+        return self.context.stats()
+
+    def synthesize_answer(self, question, chunks):
+        return self.synthesize_with_context(question, chunks)[0]
+
+    @traced("synthesize_answer")
+    def synthesize_with_context(self, question, chunks):
+        # The answer together with the context text it was given, after
+        # deduplication, packing and merging
+        blocks, report = self.build_context(question, chunks)
+        if report is not None:
+            print(
+                f"Context: {report['tokens_out']} tokens "
+                f"({report['tokens_saved']} saved)"
+            )
+        answer = self.complete(synthesis_prompt(question, blocks))
+        return answer, format_context(blocks)
+
+    def find_chapters(
+        self,
+        question,
+        available_chapters,
+        consulted_chapters,
+        q_vec=None,
+        books=None,
+    ):
+        chapters = None
+        if q_vec is not None:
+            chapters = self.route_chapters(q_vec, books, consulted_chapters)
+        if chapters is None:
+            chapters = self.choose_chapters(question, available_chapters)
+        new_chapters = [
+            chapter
+            for chapter in chapters  # fmt: off
+            if chapter not in consulted_chapters
+        ]
+        if not new_chapters:
+            print("No new chapters to consult.")
+            return [], consulted_chapters
+        consulted_chapters.update(new_chapters)
+        print(f"Consulting Chapters - {new_chapters}")
+        return new_chapters, consulted_chapters
+
+    @traced("evaluate_answer")
+    def evaluate_answer(self, question, answer):
+        return self.complete(evaluation_prompt(question, answer)).strip()
+
+    @traced("answer_question")
+    def answer_question(
+        self, question, top_k=5, model="gpt-4o-mini", books=None
+    ):
+        q_vec = None
+        if (
+            self.semantic_cache is not None
+            or self.router_threshold is not None
+            or self.max_rounds > 1
+            or self.db.min_score is not None
+        ):
+            # Encoded once and reused by the router and every round's search
+            with telemetry.span("embed", input_size=1):
+                q_vec = self.db.embedder.encode([question])
+        if self.semantic_cache is not None:
+            scope = (self.db.version, top_k, tuple(books or ()))
+            cached = self.lookup_semantic_cache(q_vec, scope)
+            if cached is not None:
+                print("Answered from semantic cache")
+                return cached
+        if self.off_topic(q_vec, books):
+            print(f"No textbook content is close enough to '{question}'")
+            return "", ""
+
+        available_chapters = self.db.list_chapters(books)
+        consulted_chapters = set()
+        all_chunks = []
+        seen = set()
+        tokens_used = 0
+        started = time.perf_counter()
+        self.last_rounds = []
+        answer, verdict = "", ""
+
+        for round_num in range(1, self.max_rounds + 1):
+            if round_num > 1:
+                if (
+                    self.time_budget is not None
+                    and time.perf_counter() - started >= self.time_budget
+                ):
+                    print(f"Time budget of {self.time_budget}s reached")
+                    break
+                if (
+                    self.token_budget is not None
+                    and tokens_used >= self.token_budget
+                ):
+                    print(f"Token budget of {self.token_budget} reached")
+                    break
+
+            round_start = time.perf_counter()
+            remaining = [
+                chapter
+                for chapter in available_chapters  # fmt: off
+                if chapter not in consulted_chapters
+            ]
+            chapters, consulted_chapters = self.find_chapters(
+                question, remaining, consulted_chapters, q_vec, books
+            )
+            if not chapters:
+                break
+            routed = time.perf_counter()
+
+            params = {}
+            retrieved = [chunk["row"] for chunk in all_chunks if "row" in chunk]
+            if retrieved:
+                params["exclude_rows"] = sorted(retrieved)
+            results = self.db.query(
+                question,
+                top_k=top_k,
+                chapter_keywords=chapters,
+                books=books,
+                q_vec=q_vec,
+                **params,
+            )
+            new_chunks = [
+                chunk
+                for chunk in results  # fmt: off
+                if chunk_key(chunk) not in seen
+            ]
+            seen.update(chunk_key(chunk) for chunk in new_chunks)
+            all_chunks.extend(new_chunks)
+            searched = time.perf_counter()
+            if not new_chunks:
+                print(f"Round {round_num}: no new chunks")
+                continue
+
+            answer, context = self.synthesize_with_context(
+                question, all_chunks
+            )
+            synthesized = time.perf_counter()
+            verdict = self.evaluate_answer(question, answer)
+            evaluated = time.perf_counter()
+
+            # Every round resends the whole context as assembled for the
+            # prompt, plus the new answer
+            round_tokens = count_tokens(context) + count_tokens(answer)
+            tokens_used += round_tokens
+            stats = {
+                "round": round_num,
+                "chapters": chapters,
+                "new_chunks": len(new_chunks),
+                "tokens": round_tokens,
+                "route": routed - round_start,
+                "search": searched - routed,
+                "synthesize": synthesized - searched,
+                "evaluate": evaluated - synthesized,
+                "total": evaluated - round_start,
+            }
+            self.last_rounds.append(stats)
+            print(
+                f"Round {round_num}: {len(new_chunks)} new chunks, "
+                f"{round_tokens} tokens, {stats['total']:.2f}s "
+                f"(route {stats['route']:.2f}s, search {stats['search']:.2f}s, "
+                f"synthesize {stats['synthesize']:.2f}s, "
+                f"evaluate {stats['evaluate']:.2f}s)"
+            )
+            print(f"Self-evaluation: {verdict}")
+            if verdict == "YES":
+                break
+
         if verdict == "YES":
             print("=== ANSWER ===")
             print(answer)
             print("\n=== CHUNKS RETRIEVED ===")
-            for result in results:
+            for result in all_chunks:
                 print(f"{result['chapter']} (Page {result['page']}): ")
+            if self.semantic_cache is not None:
+                self.semantic_cache.add(
+                    q_vec, question, answer, all_chunks, scope
+                )
             return answer, all_chunks
         else:
             print(f"Unable to find content related to '{question}'")
             return "", ""
+
+    def off_topic(self, q_vec, books=None):
+        # With a similarity floor set, a question nothing in the books
+        # passes is turned away before any LLM call
+        if self.db.min_score is None:
+            return False
+        return self.off_topic_batch(q_vec, books)[0]
+
+    def off_topic_batch(self, q_vecs, books=None):
+        # One batched FAISS search for a whole set of questions
+        if self.db.min_score is None:
+            return [False] * len(q_vecs)
+        span = telemetry.span("similarity_floor", input_size=len(q_vecs))
+        with span:
+            matched = self.db.has_match(q_vecs, books)
+            span.set(output_size=int(matched.sum()))
+        return [not match for match in matched]
+
+    def lookup_semantic_cache(self, q_vec, scope):
+        with telemetry.span("semantic_cache") as span:
+            cached = self.semantic_cache.lookup(q_vec, scope)
+            span.set(cache="miss" if cached is None else "hit")
+        return cached
+
+    def stream_answer(self, question, top_k=5, books=None):
+        # Like answer_question, but the answer is yielded as it is generated
+        # and the model states its own verdict at the end of the same call
+        stream = AnswerStream()
+        stream.tokens = self.stream_tokens(stream, question, top_k, books)
+        return stream
+
+    def stream_tokens(self, stream, question, top_k, books):
+        q_vec = None
+        if (
+            self.semantic_cache is not None
+            or self.router_threshold is not None
+            or self.db.min_score is not None
+        ):
+            q_vec = self.db.embedder.encode([question])
+        scope = (self.db.version, top_k, tuple(books or ()))
+        if self.semantic_cache is not None:
+            cached = self.semantic_cache.lookup(q_vec, scope)
+            if cached is not None:
+                stream.answer, stream.chunks = cached
+                stream.verdict = "YES"
+                yield stream.answer
+                return
+        if self.off_topic(q_vec, books):
+            stream.verdict = "NO"
+            return
+
+        chapters, _ = self.find_chapters(
+            question, self.db.list_chapters(books), set(), q_vec, books
+        )
+        if not chapters:
+            stream.verdict = "NO"
+            return
+        results = self.db.query(
+            question,
+            top_k=top_k,
+            chapter_keywords=chapters,
+            books=books,
+            q_vec=q_vec,
+        )
+        blocks, _ = self.build_context(question, results)
+        splitter = VerdictSplitter()
+        prompt = verdict_synthesis_prompt(question, blocks)
+        for piece in self.complete_stream(prompt):
+            text = splitter.feed(piece)
+            if text:
+                yield text
+        text = splitter.close()
+        if text:
+            yield text
+
+        stream.answer, stream.chunks = splitter.answer, results
+        # Only pay for a separate evaluation if the model skipped the verdict
+        stream.verdict = splitter.verdict or self.evaluate_answer(
+            question, stream.answer
+        )
+        if stream.verdict == "YES" and self.semantic_cache is not None:
+            self.semantic_cache.add(
+                q_vec, question, stream.answer, results, scope
+            )
+
+
+class AsyncTextbookAgent(TextbookAgent):
+    def __init__(
+        self,
+        model="gpt-4o-mini",
+        db=None,
+        cache=None,
+        semantic_cache=None,
+        router_threshold=0.4,
+        router_top_n=3,
+        context=None,
+        max_concurrency=16,
+        client=None,
+        base_url=None,
+    ):
+        super().__init__(
+            model,
+            db,
+            cache,
+            semantic_cache,
+            router_threshold,
+            router_top_n,
+            context,
+        )
+        # One client for every question, so all requests share its HTTP
+        # connection pool; created on first use unless one is passed in
+        self.client = client
+        self.base_url = base_url
+        self.max_concurrency = max_concurrency
+        self.semaphore = None
+
+    def get_client(self):
+        if self.client is None:
+            from openai import AsyncOpenAI
+
+            self.client = AsyncOpenAI(api_key=api_key, base_url=self.base_url)
+        return self.client
+
+    @property
+    def async_client(self):
+        return self.get_client()
+
+    async def run_blocking(self, func, *args, **kwargs):
+        # Embedding and FAISS search are CPU-bound; keep them off the loop
+        # The executor thread runs in a copy of this task's context, so its
+        # spans keep their parent
+        loop = asyncio.get_running_loop()
+        context = contextvars.copy_context()
+        return await loop.run_in_executor(
+            None, functools.partial(context.run, func, *args, **kwargs)
+        )
+
+    async def complete(self, prompt, **params):
+        params.setdefault("temperature", 0)
+        messages = [{"role": "user", "content": prompt}]
+        key = cache_key(self.model, messages, **params)
+        if self.cache is not None:
+            content = self.cache.get(key)
+            telemetry.current().set(cache="miss" if content is None else "hit")
+            if content is not None:
+                return content
+
+        if self.semaphore is None:
+            self.semaphore = asyncio.Semaphore(self.max_concurrency)
+        async with self.semaphore:
+            response = await self.async_client.chat.completions.create(
+                model=self.model,
+                messages=messages,
+                **params,
+            )
+        content = response.choices[0].message.content
+        if telemetry.enabled:
+            record_usage(prompt, response, content)
+        if self.cache is not None:
+            self.cache.set(key, content)
+        return content
+
+    async def complete_stream(self, prompt, **params):
+        params.setdefault("temperature", 0)
+        messages = [{"role": "user", "content": prompt}]
+        key = cache_key(self.model, messages, **params)
+        if self.cache is not None:
+            content = self.cache.get(key)
+            if content is not None:
+                yield content
+                return
+
+        if self.semaphore is None:
+            self.semaphore = asyncio.Semaphore(self.max_concurrency)
+        parts = []
+        async with self.semaphore:
+            response = await self.async_client.chat.completions.create(
+                model=self.model,
+                messages=messages,
+                stream=True,
+                **params,
+            )
+            async for event in response:
+                if not event.choices:
+                    continue
+                delta = event.choices[0].delta.content
+                if delta:
+                    parts.append(delta)
+                    yield delta
+        if self.cache is not None:
+            self.cache.set(key, "".join(parts))
+
+    @traced("choose_chapters")
+    async def choose_chapters(self, question, available_chapters):
+        chapters = parse_chapters(
+            await self.complete(chapters_prompt(question, available_chapters))
+        )
+        telemetry.current().set(
+            input_size=len(available_chapters), output_size=len(chapters)
+        )
+        return chapters
+
+    @traced("synthesize_answer")
+    async def synthesize_answer(self, question, chunks):
+        blocks, _ = await self.run_blocking(
+            self.build_context, question, chunks
+        )
+        return await self.complete(synthesis_prompt(question, blocks))
+
+    @traced("evaluate_answer")
+    async def evaluate_answer(self, question, answer):
+        content = await self.complete(evaluation_prompt(question, answer))
+        return content.strip()
+
+    @traced("answer_question")
+    async def answer_question(
+        self, question, top_k=5, model="gpt-4o-mini", books=None
+    ):
+        q_vec = None
+        if (
+            self.semantic_cache is not None
+            or self.router_threshold is not None
+            or self.db.min_score is not None
+        ):
+            with telemetry.span("embed", input_size=1):
+                q_vec = await self.run_blocking(
+                    self.db.embedder.encode, [question]
+                )
+        if self.semantic_cache is not None:
+            scope = (self.db.version, top_k, tuple(books or ()))
+            cached = self.lookup_semantic_cache(q_vec, scope)
+            if cached is not None:
+                return cached
+        if await self.run_blocking(self.off_topic, q_vec, books):
+            return "", ""
+
+        chapters = None
+        if q_vec is not None:
+            chapters = self.route_chapters(q_vec, books)
+        if chapters is None:
+            available_chapters = self.db.list_chapters(books)
+            chapters = await self.choose_chapters(question, available_chapters)
+        if not chapters:
+            return "", ""
+        results = await self.run_blocking(
+            self.db.query,
+            question,
+            top_k=top_k,
+            chapter_keywords=chapters,
+            books=books,
+            q_vec=q_vec,
+        )
+        answer = await self.synthesize_answer(question, results)
+        verdict = await self.evaluate_answer(question, answer)
+        if verdict != "YES":
+            return "", ""
+        if self.semantic_cache is not None:
+            self.semantic_cache.add(q_vec, question, answer, results, scope)
+        return answer, results
+
+    async def stream_tokens(self, stream, question, top_k, books):
+        q_vec = None
+        if (
+            self.semantic_cache is not None
+            or self.router_threshold is not None
+            or self.db.min_score is not None
+        ):
+            q_vec = await self.run_blocking(self.db.embedder.encode, [question])
+        scope = (self.db.version, top_k, tuple(books or ()))
+        if self.semantic_cache is not None:
+            cached = self.semantic_cache.lookup(q_vec, scope)
+            if cached is not None:
+                stream.answer, stream.chunks = cached
+                stream.verdict = "YES"
+                yield stream.answer
+                return
+        if await self.run_blocking(self.off_topic, q_vec, books):
+            stream.verdict = "NO"
+            return
+
+        chapters = None
+        if q_vec is not None:
+            chapters = self.route_chapters(q_vec, books)
+        if chapters is None:
+            available_chapters = self.db.list_chapters(books)
+            chapters = await self.choose_chapters(question, available_chapters)
+        if not chapters:
+            stream.verdict = "NO"
+            return
+        results = await self.run_blocking(
+            self.db.query,
+            question,
+            top_k=top_k,
+            chapter_keywords=chapters,
+            books=books,
+            q_vec=q_vec,
+        )
+        blocks, _ = await self.run_blocking(
+            self.build_context, question, results
+        )
+        splitter = VerdictSplitter()
+        prompt = verdict_synthesis_prompt(question, blocks)
+        async for piece in self.complete_stream(prompt):
+            text = splitter.feed(piece)
+            if text:
+                yield text
+        text = splitter.close()
+        if text:
+            yield text
+
+        stream.answer, stream.chunks = splitter.answer, results
+        stream.verdict = splitter.verdict or await self.evaluate_answer(
+            question, stream.answer
+        )
+        if stream.verdict == "YES" and self.semantic_cache is not None:
+            self.semantic_cache.add(
+                q_vec, question, stream.answer, results, scope
+            )
+
+    async def answer_questions(self, questions, top_k=5, books=None):
+        return await asyncio.gather(
+            *(
+                self.answer_question(question, top_k=top_k, books=books)
+                for question in questions
+            )
+        )
+
+    async def close(self):
+        if self.client is not None:
+            await self.client.close()
@@ -0,0 +1,192 @@
+from pathlib import Path
+
+import asyncio
+import csv
+import json
+
+
+def read_questions(path):
+    # JSONL lines are {"id": ..., "question": ...} objects or bare strings;
+    # CSV files need a "question" column and may have an "id" column
+    path = Path(path)
+    questions = []
+    with open(path, "r", encoding="utf-8", newline="") as f:
+        if path.suffix == ".csv":
+            rows = list(csv.DictReader(f))
+        else:
+            rows = [json.loads(line) for line in f if line.strip()]
+    for pos, row in enumerate(rows, start=1):
+        if isinstance(row, str):
+            row = {"question": row}
+        question_id = row.get("id") or str(pos)
+        questions.append({"id": str(question_id), "question": row["question"]})
+    return questions
+
+
+def completed_ids(output_path):
+    output_path = Path(output_path)
+    if not output_path.exists():
+        return set()
+    done = set()
+    with open(output_path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                done.add(json.loads(line)["id"])
+            except (json.JSONDecodeError, KeyError):
+                # A line cut short by an interrupted run is retried
+                continue
+    return done
+
+
+class ResultWriter:
+    def __init__(self, output_path):
+        output_path = Path(output_path)
+        # Start on a fresh line if the last run stopped mid-write
+        needs_newline = False
+        if output_path.exists() and output_path.stat().st_size:
+            with open(output_path, "rb") as f:
+                f.seek(-1, 2)
+                needs_newline = f.read(1) != b"\n"
+        self.file = open(output_path, "a", encoding="utf-8")
+        if needs_newline:
+            self.file.write("\n")
+
+    def write(self, record):
+        self.file.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+def result_record(item, answer, verdict, chunks):
+    return {
+        "id": item["id"],
+        "question": item["question"],
+        "answer": answer if verdict == "YES" else "",
+        "verdict": verdict,
+        "chunks": [
+            {
+                "chapter": chunk["chapter"],
+                "page": chunk["page"],
+                "book": chunk["book"],
+            }
+            for chunk in chunks
+        ],
+    }
+
+
+def error_record(item, error):
+    return {
+        "id": item["id"],
+        "question": item["question"],
+        "error": f"{type(error).__name__}: {error}",
+    }
+
+
+async def answer_window(agent, items, writer, top_k, books):
+    questions = [item["question"] for item in items]
+
+    # Stage 1: embed every question in the window with one encode call, route
+    # what the chapter centroids can answer confidently, and send only the
+    # rest to the LLM, concurrently
+    q_vecs = await agent.run_blocking(agent.db.embedder.encode, questions)
+    # Questions below the similarity floor get no chapters, so no LLM calls
+    off_topic = await agent.run_blocking(agent.off_topic_batch, q_vecs, books)
+    chapters = [
+        [] if skip else agent.route_chapters(q_vec, books)
+        for q_vec, skip in zip(q_vecs, off_topic)
+    ]
+    # A question whose LLM call fails is written out as an error record and
+    # the rest of the batch carries on; at temperature 0 the same failure
+    # would only repeat on every resume
+    errors = {}
+    unrouted = [pos for pos, routed in enumerate(chapters) if routed is None]
+    if unrouted:
+        available_chapters = agent.db.list_chapters(books)
+
+        async def choose(pos):
+            try:
+                chapters[pos] = await agent.choose_chapters(
+                    questions[pos], available_chapters
+                )
+            except Exception as error:
+                errors[pos] = error
+
+        await asyncio.gather(*(choose(pos) for pos in unrouted))
+
+    # Stage 2: a single batched FAISS search for the questions that have
+    # chapters to consult; off-topic and failed questions retrieve nothing
+    searched = [
+        pos
+        for pos, item_chapters in enumerate(chapters)  # fmt: off
+        if item_chapters and pos not in errors
+    ]
+    results = [[] for _ in items]
+    if searched:
+        found = await agent.run_blocking(
+            agent.db.query_batch,
+            [questions[pos] for pos in searched],
+            top_k=top_k,
+            chapter_keywords=[chapters[pos] for pos in searched],
+            books=books,
+            q_vecs=q_vecs[searched],
+        )
+        for pos, chunks in zip(searched, found):
+            results[pos] = chunks
+
+    # Stage 3: synthesis and evaluation, written out as each one finishes
+    def fail(item, error):
+        record = error_record(item, error)
+        print(f"Question {item['id']} failed: {record['error']}")
+        writer.write(record)
+
+    async def finish(pos):
+        item, chunks = items[pos], results[pos]
+        if pos in errors:
+            fail(item, errors[pos])
+            return
+        answer, verdict = "", ""
+        if pos in searched:
+            try:
+                answer = await agent.synthesize_answer(
+                    item["question"], chunks
+                )
+                verdict = await agent.evaluate_answer(item["question"], answer)
+            except Exception as error:
+                fail(item, error)
+                return
+        writer.write(result_record(item, answer, verdict, chunks))
+
+    return [asyncio.ensure_future(finish(pos)) for pos in range(len(items))]
+
+
+async def run_batch(
+    agent, input_path, output_path, top_k=5, books=None, window=64
+):
+    # Questions already in the output file are skipped, so an interrupted
+    # run picks up where it stopped
+    done = completed_ids(output_path)
+    pending = [
+        item for item in read_questions(input_path) if item["id"] not in done
+    ]
+    print(f"{len(done)} questions already answered, {len(pending)} to go")
+
+    writer = ResultWriter(output_path)
+    tasks = []
+    try:
+        # Windows overlap: synthesis for one window keeps running while
+        # the next window selects chapters and searches
+        for start in range(0, len(pending), window):
+            items = pending[start:start + window]
+            tasks.extend(
+                await answer_window(agent, items, writer, top_k, books)
+            )
+        await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        raise
+    finally:
+        writer.close()
+    return len(pending)
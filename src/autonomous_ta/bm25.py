@@ -0,0 +1,160 @@
+import numpy as np
+import re
+
+
+TERM_PATTERN = re.compile(r"\w+")
+
+
+def terms(text):
+    return TERM_PATTERN.findall(text.lower())
+
+
+class Postings:
+    # One book's inverted index with a book-local vocabulary: the rows
+    # (relative to the book) containing each term and how often, stored in
+    # CSR form so term i's postings are rows[indptr[i]:indptr[i + 1]]
+    def __init__(self, vocab, indptr, rows, tf, lengths):
+        self.vocab = vocab
+        self.indptr = indptr
+        self.rows = rows
+        self.tf = tf
+        self.lengths = lengths
+
+    @classmethod
+    def from_texts(cls, texts):
+        vocab_ids = {}
+        term_ids = []
+        row_ids = []
+        lengths = np.zeros(len(texts), dtype="int32")
+        for row, text in enumerate(texts):
+            row_terms = terms(text)
+            lengths[row] = len(row_terms)
+            term_ids.extend(
+                vocab_ids.setdefault(term, len(vocab_ids)) for term in row_terms
+            )
+            row_ids.extend([row] * len(row_terms))
+
+        # Count (term, row) pairs with one sort; rows stay ordered per term
+        keys = np.array(term_ids, dtype="int64") << 32
+        keys |= np.array(row_ids, dtype="int64")
+        keys, tf = np.unique(keys, return_counts=True)
+        indptr = np.zeros(len(vocab_ids) + 1, dtype="int64")
+        counts = np.bincount(keys >> 32, minlength=len(vocab_ids))
+        np.cumsum(counts, out=indptr[1:])
+        return cls(
+            list(vocab_ids),
+            indptr,
+            (keys & 0xFFFFFFFF).astype("int32"),
+            tf.astype("int32"),
+            lengths,
+        )
+
+    def __len__(self):
+        return len(self.lengths)
+
+
+class BM25Index:
+    # Okapi BM25 over every indexed book. Each book's postings are kept
+    # separately, re-keyed to a shared vocabulary, so books can be added and
+    # dropped without touching the others
+    def __init__(self, k1=1.5, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self.vocab = {}
+        self.df = np.zeros(0, dtype="int64")
+        self.segments = {}
+        self.rows = 0
+        self.total_length = 0
+
+    def add(self, book, start, postings):
+        vocab = self.vocab
+        global_ids = np.array(
+            [vocab.setdefault(term, len(vocab)) for term in postings.vocab],
+            dtype="int64",
+        )
+        if len(self.vocab) > len(self.df):
+            self.df = np.pad(self.df, (0, len(self.vocab) - len(self.df)))
+
+        # Re-sort the book's postings by global term id
+        counts = np.diff(postings.indptr)
+        order = np.argsort(global_ids, kind="stable")
+        term_of = np.repeat(global_ids, counts)
+        posting_order = np.argsort(term_of, kind="stable")
+        sorted_terms = global_ids[order]
+        indptr = np.zeros(len(order) + 1, dtype="int64")
+        np.cumsum(counts[order], out=indptr[1:])
+        self.df[sorted_terms] += counts[order]
+
+        self.segments[book] = {
+            "start": start,
+            "terms": sorted_terms,
+            "indptr": indptr,
+            "rows": postings.rows[posting_order],
+            "tf": postings.tf[posting_order].astype("float32"),
+            "lengths": postings.lengths.astype("float32"),
+        }
+        self.rows += len(postings)
+        self.total_length += int(postings.lengths.sum())
+
+    def remove(self, book):
+        segment = self.segments.pop(book, None)
+        if segment is None:
+            return
+        self.df[segment["terms"]] -= np.diff(segment["indptr"])
+        self.rows -= len(segment["lengths"])
+        self.total_length -= int(segment["lengths"].sum())
+
+    def search(self, query, top_n=10, rows=None):
+        # Returns the best-scoring row ids and their scores, best first;
+        # rows optionally restricts the search to a sorted array of row ids
+        query_ids = sorted(
+            {self.vocab[term] for term in terms(query) if term in self.vocab}
+        )
+        if not query_ids or not self.rows:
+            return np.empty(0, dtype="int64"), np.empty(0, dtype="float32")
+        query_ids = np.array(query_ids, dtype="int64")
+        df = self.df[query_ids]
+        idf = np.log(1 + (self.rows - df + 0.5) / (df + 0.5))
+        avg_length = self.total_length / self.rows or 1.0
+
+        hits, scores = [], []
+        for segment in self.segments.values():
+            segment_terms = segment["terms"]
+            pos = np.searchsorted(segment_terms, query_ids)
+            found = pos < len(segment_terms)
+            found[found] = segment_terms[pos[found]] == query_ids[found]
+            indptr = segment["indptr"]
+            for term_pos, weight in zip(pos[found], idf[found]):
+                lo, hi = indptr[term_pos], indptr[term_pos + 1]
+                local = segment["rows"][lo:hi]
+                tf = segment["tf"][lo:hi]
+                norm = self.k1 * (
+                    1 - self.b + self.b * segment["lengths"][local] / avg_length
+                )
+                hits.append(local.astype("int64") + segment["start"])
+                scores.append(weight * tf * (self.k1 + 1) / (tf + norm))
+        if not hits:
+            return np.empty(0, dtype="int64"), np.empty(0, dtype="float32")
+
+        hits, inverse = np.unique(np.concatenate(hits), return_inverse=True)
+        scores = np.bincount(inverse, weights=np.concatenate(scores))
+        if rows is not None:
+            pos = np.searchsorted(rows, hits)
+            keep = pos < len(rows)
+            keep[keep] = rows[pos[keep]] == hits[keep]
+            hits, scores = hits[keep], scores[keep]
+        if len(hits) > top_n:
+            best = np.argpartition(-scores, top_n - 1)[:top_n]
+            hits, scores = hits[best], scores[best]
+        order = np.argsort(-scores, kind="stable")
+        return hits[order], scores[order].astype("float32")
+
+
+def reciprocal_rank_fusion(rankings, k=60):
+    # Each ranking is a sequence of row ids, best first; rows are scored by
+    # the sum of 1 / (k + rank) over the rankings they appear in
+    fused = {}
+    for ranking in rankings:
+        for rank, row in enumerate(ranking, start=1):
+            fused[int(row)] = fused.get(int(row), 0.0) + 1.0 / (k + rank)
+    return sorted(fused, key=fused.get, reverse=True)
@@ -0,0 +1,201 @@
+from collections import OrderedDict
+
+from src.autonomous_ta.lazy import lazy_import
+
+import hashlib
+import json
+import numpy as np
+import sqlite3
+import threading
+import time
+
+faiss = lazy_import("faiss")
+
+
+def cache_key(model, messages, **params):
+    payload = json.dumps(
+        {"model": model, "messages": messages, "params": params},
+        sort_keys=True,
+        ensure_ascii=False,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    def __init__(self, max_size=1024, ttl=None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            value = self.load(key)
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            return value
+
+    def set(self, key, value):
+        with self.lock:
+            self.store(key, value)
+
+    def expired(self, created):
+        return self.ttl is not None and time.time() - created > self.ttl
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "size": len(self),
+        }
+
+
+class MemoryCache(ResponseCache):
+    def __init__(self, max_size=1024, ttl=None):
+        super().__init__(max_size, ttl)
+        self.entries = OrderedDict()
+
+    def load(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        value, created = entry
+        if self.expired(created):
+            del self.entries[key]
+            return None
+        self.entries.move_to_end(key)
+        return value
+
+    def store(self, key, value):
+        self.entries[key] = (value, time.time())
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self.entries)
+
+
+class SQLiteCache(ResponseCache):
+    def __init__(self, path, max_size=100_000, ttl=None):
+        super().__init__(max_size, ttl)
+        self.conn = sqlite3.connect(str(path), check_same_thread=False)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, value TEXT, created REAL, accessed REAL)"
+        )
+        self.conn.execute(
+            "CREATE INDEX IF NOT EXISTS responses_accessed "
+            "ON responses (accessed)"
+        )
+        self.conn.commit()
+
+    def load(self, key):
+        row = self.conn.execute(
+            "SELECT value, created FROM responses WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            return None
+        value, created = row
+        if self.expired(created):
+            self.conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+            self.conn.commit()
+            return None
+        self.conn.execute(
+            "UPDATE responses SET accessed = ? WHERE key = ?",
+            (time.time(), key),
+        )
+        self.conn.commit()
+        return json.loads(value)
+
+    def store(self, key, value):
+        now = time.time()
+        self.conn.execute(
+            "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?)",
+            (key, json.dumps(value, ensure_ascii=False), now, now),
+        )
+        # Evict least recently used rows beyond max_size
+        self.conn.execute(
+            "DELETE FROM responses WHERE key IN ("
+            "SELECT key FROM responses ORDER BY accessed DESC "
+            "LIMIT -1 OFFSET ?)",
+            (self.max_size,),
+        )
+        self.conn.commit()
+
+    def __len__(self):
+        return self.conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+
+    def close(self):
+        self.conn.close()
+
+
+class SemanticCache:
+    def __init__(self, threshold=0.9, max_size=1000):
+        self.threshold = threshold
+        self.max_size = max_size
+        self.index = None
+        self.entries = []
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def normalize(self, q_vec):
+        q_vec = np.array(q_vec, dtype="float32").reshape(1, -1)
+        faiss.normalize_L2(q_vec)
+        return q_vec
+
+    def lookup(self, q_vec, scope):
+        # scope holds everything the answer depends on besides the question,
+        # e.g. the index version, top_k and the books searched
+        with self.lock:
+            if self.index is not None and self.index.ntotal:
+                q_vec = self.normalize(q_vec)
+                k = min(8, self.index.ntotal)
+                scores, ids = self.index.search(q_vec, k)
+                for score, idx in zip(scores[0], ids[0]):
+                    if idx < 0 or score < self.threshold:
+                        break
+                    entry = self.entries[idx]
+                    if entry["scope"] == scope:
+                        self.hits += 1
+                        return entry["answer"], entry["chunks"]
+            self.misses += 1
+            return None
+
+    def add(self, q_vec, question, answer, chunks, scope):
+        with self.lock:
+            q_vec = self.normalize(q_vec)
+            if self.index is None:
+                self.index = faiss.IndexFlatIP(q_vec.shape[1])
+            self.entries.append(
+                {
+                    "question": question,
+                    "answer": answer,
+                    "chunks": chunks,
+                    "scope": scope,
+                    "vector": q_vec[0],
+                }
+            )
+            self.index.add(q_vec)
+            if len(self.entries) > self.max_size:
+                # Drop the oldest entries and rebuild; the index is small
+                self.entries = self.entries[-self.max_size:]
+                self.index.reset()
+                self.index.add(
+                    np.stack([entry["vector"] for entry in self.entries])
+                )
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "size": len(self.entries),
+        }
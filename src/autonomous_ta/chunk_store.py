@@ -0,0 +1,172 @@
+from collections.abc import Sequence
+
+import numpy as np
+
+
+class ChunkSegment:
+    # One book's chunks in columns: the texts as a single UTF-8 blob with
+    # row offsets, plus page numbers and chapter ids local to the book that
+    # index into chapter_table ([title, level] pairs)
+    def __init__(self, blob, offsets, pages, chapters, chapter_table):
+        self.blob = blob
+        self.offsets = offsets
+        self.pages = pages
+        self.chapters = chapters
+        self.chapter_table = chapter_table
+
+    @classmethod
+    def from_columns(cls, texts, chapters, levels, pages):
+        table_ids = {}
+        chapter_table = []
+        local = np.empty(len(texts), dtype="int32")
+        for pos, (chapter, level) in enumerate(zip(chapters, levels)):
+            if chapter not in table_ids:
+                table_ids[chapter] = len(chapter_table)
+                chapter_table.append([chapter, int(level)])
+            local[pos] = table_ids[chapter]
+
+        encoded = [text.encode("utf-8") for text in texts]
+        offsets = np.zeros(len(texts) + 1, dtype="int64")
+        np.cumsum([len(data) for data in encoded], out=offsets[1:])
+        blob = np.frombuffer(b"".join(encoded), dtype="uint8")
+        return cls(
+            blob, offsets, np.asarray(pages, dtype="int32"), local, chapter_table
+        )
+
+    @classmethod
+    def from_chunks(cls, chunks):
+        return cls.from_columns(
+            [chunk["chunk_text"] for chunk in chunks],
+            [chunk["chapter_title"] for chunk in chunks],
+            [chunk.get("chapter_level", 1) for chunk in chunks],
+            [chunk["page_num"] for chunk in chunks],
+        )
+
+    def __len__(self):
+        return len(self.pages)
+
+    def text(self, pos):
+        start, stop = self.offsets[pos], self.offsets[pos + 1]
+        return bytes(self.blob[start:stop]).decode("utf-8")
+
+    def texts(self):
+        return [self.text(pos) for pos in range(len(self))]
+
+
+class ChunkStore:
+    # Every indexed chunk, one row per FAISS id. Page, chapter and book are
+    # small integer columns; chapter titles and book names are stored once.
+    # Chapters are interned per book, so books sharing a title keep apart.
+    # Text stays in each book's segment blob, which may be memory-mapped.
+    def __init__(self):
+        self.segments = []
+        self.starts = np.zeros(0, dtype="int64")
+        self.pages = np.zeros(0, dtype="int32")
+        self.chapters = np.zeros(0, dtype="int32")
+        self.books = np.zeros(0, dtype="int32")
+        self.chapter_titles = []
+        self.chapter_levels = []
+        self.chapter_books = []
+        self.chapter_ids = {}
+        self.book_names = []
+        self.book_ids = {}
+        self.texts = TextView(self)
+        self.metadata = MetadataView(self)
+
+    def __len__(self):
+        return len(self.pages)
+
+    def intern_chapter(self, book_id, title, level=1):
+        chapter_id = self.chapter_ids.get((book_id, title))
+        if chapter_id is None:
+            chapter_id = len(self.chapter_titles)
+            self.chapter_ids[(book_id, title)] = chapter_id
+            self.chapter_titles.append(title)
+            self.chapter_levels.append(level)
+            self.chapter_books.append(book_id)
+        return chapter_id
+
+    def append(self, book, segment):
+        # Returns the global chapter id of every appended row
+        if book not in self.book_ids:
+            self.book_ids[book] = len(self.book_names)
+            self.book_names.append(book)
+        chapter_map = np.array(
+            [
+                self.intern_chapter(self.book_ids[book], title, level)
+                for title, level in segment.chapter_table
+            ],
+            dtype="int32",
+        )
+        chapters = chapter_map[segment.chapters]
+        if len(segment):
+            self.segments.append(segment)
+            self.starts = np.append(self.starts, len(self))
+            self.pages = np.concatenate([self.pages, segment.pages])
+            self.chapters = np.concatenate([self.chapters, chapters])
+            self.books = np.concatenate(
+                [
+                    self.books,
+                    np.full(len(segment), self.book_ids[book], dtype="int32"),
+                ]
+            )
+        return chapters
+
+    def locate(self, row):
+        pos = int(np.searchsorted(self.starts, row, side="right")) - 1
+        return self.segments[pos], row - int(self.starts[pos])
+
+    def text(self, row):
+        segment, pos = self.locate(row)
+        return segment.text(pos)
+
+    def record(self, row):
+        chapter = self.chapters[row]
+        return {
+            "chapter": self.chapter_titles[chapter],
+            "level": self.chapter_levels[chapter],
+            "page": int(self.pages[row]),
+            "book": self.book_names[self.books[row]],
+        }
+
+    def nbytes(self):
+        columns = self.pages.nbytes + self.chapters.nbytes + self.books.nbytes
+        segments = sum(
+            segment.blob.nbytes + segment.offsets.nbytes for segment in self.segments
+        )
+        return columns + segments
+
+    def bytes_per_row(self):
+        return self.nbytes() / len(self) if len(self) else 0.0
+
+
+class RowView(Sequence):
+    def __init__(self, store):
+        self.store = store
+
+    def __len__(self):
+        return len(self.store)
+
+    def __getitem__(self, row):
+        if isinstance(row, slice):
+            return [self.item(pos) for pos in range(*row.indices(len(self)))]
+        if row < 0:
+            row += len(self)
+        if not 0 <= row < len(self):
+            raise IndexError(row)
+        return self.item(int(row))
+
+    def __eq__(self, other):
+        if isinstance(other, (list, RowView)):
+            return list(self) == list(other)
+        return NotImplemented
+
+
+class TextView(RowView):
+    def item(self, row):
+        return self.store.text(row)
+
+
+class MetadataView(RowView):
+    def item(self, row):
+        return self.store.record(row)
@@ -0,0 +1,156 @@
+from src.autonomous_ta.tokens import count_tokens
+
+import re
+import threading
+
+
+WORD_PATTERN = re.compile(r"\w+")
+
+
+def shingles(text, size=3):
+    words = WORD_PATTERN.findall(text.lower())
+    if len(words) <= size:
+        return {tuple(words)}
+    return {tuple(words[pos:pos + size]) for pos in range(len(words) - size + 1)}
+
+
+def trim_overlap(previous, text, probe=40):
+    # Drop the start of text if it repeats the end of previous, as chunks
+    # written with overlap do
+    pos = previous.rfind(text[:probe]) if len(text) >= probe else -1
+    if pos != -1 and text.startswith(previous[pos:]):
+        return text[len(previous) - pos:].lstrip()
+    return text
+
+
+class ContextBuilder:
+    # Turns retrieved chunks into the context blocks of a synthesis prompt:
+    # near-duplicates are dropped, chunks are optionally reranked, packed
+    # into a token budget in rank order, and chunks from adjacent pages of
+    # the same chapter are merged into one block
+    def __init__(self, max_tokens=3000, dedupe_threshold=0.8, reranker=None):
+        self.max_tokens = max_tokens
+        self.dedupe_threshold = dedupe_threshold
+        # A CrossEncoder model name, or any object with predict(pairs)
+        self.reranker = reranker
+        self.requests = 0
+        self.tokens_in = 0
+        self.tokens_out = 0
+        self.lock = threading.Lock()
+
+    def dedupe(self, chunks):
+        kept, kept_shingles = [], []
+        for chunk in chunks:
+            current = shingles(chunk["chunk_text"])
+            duplicate = any(
+                len(current & other) / max(1, min(len(current), len(other)))
+                >= self.dedupe_threshold
+                for other in kept_shingles
+            )
+            if not duplicate:
+                kept.append(chunk)
+                kept_shingles.append(current)
+        return kept
+
+    def rerank(self, question, chunks):
+        if self.reranker is None or len(chunks) < 2:
+            return chunks
+        with self.lock:
+            if isinstance(self.reranker, str):
+                from sentence_transformers import CrossEncoder
+
+                self.reranker = CrossEncoder(self.reranker)
+        scores = self.reranker.predict(
+            [(question, chunk["chunk_text"]) for chunk in chunks]
+        )
+        order = sorted(range(len(chunks)), key=lambda pos: -float(scores[pos]))
+        return [chunks[pos] for pos in order]
+
+    def pack(self, chunks):
+        # Best-ranked chunks first; one that does not fit is skipped so a
+        # smaller one further down can still use the remaining budget
+        packed, used = [], 0
+        for chunk in chunks:
+            if used + chunk["tokens"] <= self.max_tokens:
+                packed.append(chunk)
+                used += chunk["tokens"]
+        return packed
+
+    def merge(self, chunks):
+        # Blocks keep the rank of their best chunk; chunks of one page are
+        # joined in reading order, which the row number preserves
+        blocks = []
+        by_key = {}
+        for chunk in sorted(
+            chunks,
+            key=lambda c: (c["book"], c["chapter"], c["page"], c.get("row", 0)),
+        ):
+            key = (chunk["book"], chunk["chapter"])
+            block = by_key.get(key)
+            if block is not None and chunk["page"] - block["page_end"] <= 1:
+                block["texts"].append(
+                    trim_overlap(block["texts"][-1], chunk["chunk_text"])
+                )
+                block["page_end"] = chunk["page"]
+                block["rank"] = min(block["rank"], chunk["rank"])
+                continue
+            block = {
+                "book": chunk["book"],
+                "chapter": chunk["chapter"],
+                "page_start": chunk["page"],
+                "page_end": chunk["page"],
+                "texts": [chunk["chunk_text"]],
+                "rank": chunk["rank"],
+            }
+            by_key[key] = block
+            blocks.append(block)
+
+        blocks.sort(key=lambda block: block["rank"])
+        return [
+            {
+                "book": block["book"],
+                "chapter": block["chapter"],
+                "page": (
+                    block["page_start"]
+                    if block["page_start"] == block["page_end"]
+                    else f"{block['page_start']}-{block['page_end']}"
+                ),
+                "chunk_text": "\n".join(block["texts"]),
+            }
+            for block in blocks
+        ]
+
+    def assemble(self, question, chunks):
+        chunks = [
+            dict(chunk, tokens=count_tokens(chunk["chunk_text"]))
+            for chunk in chunks
+        ]
+        tokens_in = sum(chunk["tokens"] for chunk in chunks)
+
+        ranked = self.rerank(question, self.dedupe(chunks))
+        for rank, chunk in enumerate(ranked):
+            chunk["rank"] = rank
+        blocks = self.merge(self.pack(ranked))
+
+        tokens_out = sum(count_tokens(block["chunk_text"]) for block in blocks)
+        with self.lock:
+            self.requests += 1
+            self.tokens_in += tokens_in
+            self.tokens_out += tokens_out
+        report = {
+            "chunks_in": len(chunks),
+            "blocks_out": len(blocks),
+            "tokens_in": tokens_in,
+            "tokens_out": tokens_out,
+            "tokens_saved": tokens_in - tokens_out,
+        }
+        return blocks, report
+
+    def stats(self):
+        with self.lock:
+            return {
+                "requests": self.requests,
+                "tokens_in": self.tokens_in,
+                "tokens_out": self.tokens_out,
+                "tokens_saved": self.tokens_in - self.tokens_out,
+            }
@@ -1,21 +1,37 @@
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 
-import fitz
+from src.autonomous_ta.lazy import lazy_import
+from src.autonomous_ta.tokens import count_tokens, split_tokens
+
+import argparse
+import functools
 import json
 import os
+import re
+
+fitz = lazy_import("fitz")
 
 
 DATA_DIR = Path("data/raw/")
-DATA_DIR.mkdir(parents=True, exist_ok=True)
+# all-MiniLM-L6-v2 embeds at most 256 wordpieces and silently drops the
+# rest; WordPiece splits English prose into more pieces than cl100k, so
+# chunks stay well below that
+MAX_TOKENS = 200
 
 
-def load_pdf(pdf_path):
-    doc = fitz.open(pdf_path)
-    pages_text = []
+def iter_pages(doc):
+    # PyMuPDF loads one page at a time, so only the current page's text is
+    # held in memory
     for page_num, page in enumerate(doc, start=1):
         text = page.get_text().strip()
         if text:
-            pages_text.append({"page_num": page_num, "text": text})
+            yield {"page_num": page_num, "text": text}
+
+
+def load_pdf(pdf_path):
+    doc = fitz.open(pdf_path)
+    pages_text = list(iter_pages(doc))
     return pages_text, doc
 
 
@@ -28,62 +44,208 @@ def get_toc(doc):
     return chapters
 
 
-def chunk_text(pages, toc, max_tokens=300):
-    chunks = []
-    current_chunk = " "
-    current_chapter = "Unknown"
-    chapter_index = 0
-    for page in pages:
-        while (
-            chapter_index + 1 < len(toc)
-            and page["page_num"] >= toc[chapter_index + 1]["page_num"]
-        ):
-            chapter_index += 1
-        current_chapter = toc[chapter_index]["title"]
-
-        paragraphs = page["text"].split("\n\n")
-        for para in paragraphs:
-            para = para.strip()
-            if len(para) == 0:
+PARAGRAPH_BREAK = re.compile(r"\n\s*\n")
+SENTENCE_END = re.compile(r"(?<=[.!?])\s+")
+
+
+def iter_units(text, max_tokens):
+    # Paragraphs with their token counts; a paragraph over the budget is
+    # split at sentence ends, and a sentence still over it on token bounds.
+    # Sentences are split at whitespace, so a paragraph's count is the sum
+    # of its sentences' and each sentence is only counted once
+    for para in PARAGRAPH_BREAK.split(text):
+        para = para.strip()
+        if not para:
+            continue
+        sentences = SENTENCE_END.split(para)
+        counts = [count_tokens(sentence) for sentence in sentences]
+        if sum(counts) <= max_tokens:
+            yield para, sum(counts)
+            continue
+        for sentence, tokens in zip(sentences, counts):
+            if tokens <= max_tokens:
+                yield sentence, tokens
                 continue
-            if len(current_chunk) + len(para) < max_tokens * 4:
-                current_chunk += " " + para
-            else:
-                chunks.append(
-                    {
-                        "chapter_title": current_chapter,
-                        "page_num": page["page_num"],
-                        "chunk_text": current_chunk.strip(),
-                    }
-                )
-                current_chunk = para
-    if current_chunk:
-        chunks.append(
-            {
-                "chapter_title": current_chapter,
-                "page_num": page["page_num"],
-                "chunk_text": current_chunk.strip(),
-            }
+            for piece in split_tokens(sentence, max_tokens):
+                yield piece, count_tokens(piece)
+
+
+def title_pattern(title):
+    # Headings are matched case-insensitively with any whitespace between
+    # words, since PDF text rarely reproduces the TOC title exactly
+    words = title.split()
+    if not words:
+        return None
+    return re.compile(r"\s+".join(map(re.escape, words)), re.IGNORECASE)
+
+
+def page_sections(text, page_num, toc, entry, chapter):
+    # Split a page where TOC entries starting on it begin. Returns the
+    # (text, chapter) sections along with the TOC position and chapter in
+    # effect at the end of the page
+    sections = []
+    pos = 0
+    while entry + 1 < len(toc) and toc[entry + 1]["page_num"] <= page_num:
+        entry += 1
+        start = pos
+        pattern = title_pattern(toc[entry]["title"])
+        if toc[entry]["page_num"] == page_num and pattern is not None:
+            match = pattern.search(text, pos)
+            if match:
+                start = match.start()
+        if start > pos:
+            sections.append((text[pos:start], chapter))
+            pos = start
+        chapter = (toc[entry]["title"], toc[entry]["level"])
+    sections.append((text[pos:], chapter))
+    return sections, entry, chapter
+
+
+def make_chunk(chapter, parts, tokens):
+    title, level = chapter
+    return {
+        "chapter_title": title,
+        "chapter_level": level,
+        "page_num": parts[0][2],
+        "page_start": parts[0][2],
+        "page_end": parts[-1][2],
+        "token_count": tokens,
+        "chunk_text": " ".join(part[0] for part in parts),
+    }
+
+
+def iter_chunks(pages, toc, max_tokens=MAX_TOKENS, overlap=0):
+    # Chunks hold at most max_tokens tokens (units are only cut mid-sentence
+    # when a single sentence is longer), never span two chapters and repeat
+    # up to overlap tokens from the end of the previous chunk in the same
+    # chapter. Each unit is counted once and each chunk joined once.
+    chapter = ("Unknown", 1)
+    entry = -1
+    parts = []  # (text, tokens, page_num) of the chunk being built
+    tokens = 0
+    fresh = False  # whether parts hold anything not yet yielded
+    for page in pages:
+        page_num = page["page_num"]
+        sections, entry, next_chapter = page_sections(
+            page["text"], page_num, toc, entry, chapter
         )
-    return chunks
-
-
-def parse_book():
-    for file in os.listdir(DATA_DIR):
+        for text, section_chapter in sections:
+            if section_chapter != chapter:
+                if fresh:
+                    yield make_chunk(chapter, parts, tokens)
+                parts, tokens, fresh = [], 0, False
+                chapter = section_chapter
+            for unit, unit_tokens in iter_units(text, max_tokens):
+                if fresh and tokens + unit_tokens > max_tokens:
+                    yield make_chunk(chapter, parts, tokens)
+                    # Keep the trailing units that fit in the overlap
+                    keep = len(parts)
+                    kept_tokens = 0
+                    while keep and kept_tokens + parts[keep - 1][1] <= overlap:
+                        keep -= 1
+                        kept_tokens += parts[keep][1]
+                    parts, tokens, fresh = parts[keep:], kept_tokens, False
+                while parts and tokens + unit_tokens > max_tokens:
+                    tokens -= parts.pop(0)[1]
+                parts.append((unit, unit_tokens, page_num))
+                tokens += unit_tokens
+                fresh = True
+        chapter = next_chapter
+    if fresh:
+        yield make_chunk(chapter, parts, tokens)
+
+
+def chunk_text(pages, toc, max_tokens=MAX_TOKENS, overlap=0):
+    return list(iter_chunks(pages, toc, max_tokens, overlap))
+
+
+def write_chunks(chunks, output_file):
+    # One compact JSON object per line, written as chunks are produced
+    output_file = Path(output_file)
+    tmp_file = output_file.with_name(output_file.name + ".tmp")
+    count = 0
+    with open(tmp_file, "w", encoding="utf-8") as f:
+        for chunk in chunks:
+            f.write(json.dumps(chunk, ensure_ascii=False, separators=(",", ":")))
+            f.write("\n")
+            count += 1
+    os.replace(tmp_file, output_file)
+    return count
+
+
+def parse_pdf(pdf_path, max_tokens=MAX_TOKENS, overlap=0):
+    pdf_path = Path(pdf_path)
+    print(f"Loading PDF from {pdf_path.name}")
+    with fitz.open(pdf_path) as doc:
+        toc = get_toc(doc)
+        print(f"Extracted {len(toc)} table of contents entries")
+
+        output_file = pdf_path.with_name(f"{pdf_path.name}.jsonl")
+        chunks = iter_chunks(iter_pages(doc), toc, max_tokens, overlap)
+        count = write_chunks(chunks, output_file)
+
+    print(f"Saved {count} chunks to {output_file}")
+    return output_file
+
+
+def parse_book(force=False, workers=None, max_tokens=MAX_TOKENS, overlap=0):
+    # Only PDFs that are new or changed since their chunks were written
+    # are parsed again, one process per document
+    DATA_DIR.mkdir(parents=True, exist_ok=True)
+    pending = []
+    for file in sorted(os.listdir(DATA_DIR)):
         if file.split(".")[-1] == "pdf":
-            print(f"Loading PDF from {file}")
-            pages, doc = load_pdf(DATA_DIR / file)
-            toc = get_toc(doc)
-
-            print("Extracted Table of Contents:")
-            for c in toc:
-                print(f"----{c['title']} (page {c['page_num']})")
-
-            print("Chunking pages...")
-            chunks = chunk_text(pages, toc)
-
-            output_file = DATA_DIR / f"{file}.json"
-            with open(output_file, "w", encoding="utf-8") as f:
-                json.dump(chunks, f, ensure_ascii=False, indent=2)
-
-            print(f"Saved {len(chunks)} chunks to {output_file}")
\ No newline at end of file
+            pdf_path = DATA_DIR / file
+            output_file = DATA_DIR / f"{file}.jsonl"
+            if (
+                not force
+                and output_file.exists()
+                and output_file.stat().st_mtime >= pdf_path.stat().st_mtime
+            ):
+                print(f"Skipping {file}, chunks are up to date")
+                continue
+            pending.append(pdf_path)
+
+    parse = functools.partial(
+        parse_pdf, max_tokens=max_tokens, overlap=overlap
+    )
+    if len(pending) <= 1 or workers == 1:
+        return [parse(pdf_path) for pdf_path in pending]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(parse, pending))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Parse and chunk the PDF textbooks in data/raw/"
+    )
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        help="Re-parse PDFs even if their chunks are up to date",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=None,
+        help="Number of worker processes (default: one per CPU)",
+    )
+    parser.add_argument(
+        "--max-tokens",
+        type=int,
+        default=MAX_TOKENS,
+        help=f"Maximum tokens per chunk (default: {MAX_TOKENS})",
+    )
+    parser.add_argument(
+        "--overlap",
+        type=int,
+        default=0,
+        help="Tokens repeated from the end of the previous chunk (default: 0)",
+    )
+    args = parser.parse_args()
+    parse_book(
+        force=args.force,
+        workers=args.workers,
+        max_tokens=args.max_tokens,
+        overlap=args.overlap,
+    )
@@ -0,0 +1,200 @@
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from src.autonomous_ta.agent import TextbookAgent
+from src.autonomous_ta.telemetry import telemetry
+
+import argparse
+import json
+import queue
+import threading
+import time
+
+
+class BatchingEmbedder:
+    def __init__(self, embedder, max_batch=32, max_wait=0.005):
+        self.embedder = embedder
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.batches = 0
+        self.queue = queue.Queue()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def __getattr__(self, name):
+        return getattr(self.embedder, name)
+
+    def encode(self, texts, **kwargs):
+        # Single questions from concurrent requests are coalesced into one
+        # encode call; bulk encodes go straight through
+        texts = list(texts)
+        if len(texts) != 1:
+            return self.embedder.encode(texts, **kwargs)
+        future = Future()
+        self.queue.put((texts[0], future))
+        return future.result()[None, :]
+
+    def run(self):
+        while True:
+            items = [self.queue.get()]
+            deadline = time.monotonic() + self.max_wait
+            while len(items) < self.max_batch:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    items.append(self.queue.get(timeout=timeout))
+                except queue.Empty:
+                    break
+
+            try:
+                vectors = self.embedder.encode([text for text, _ in items])
+            except Exception as e:
+                for _, future in items:
+                    future.set_exception(e)
+                continue
+            self.batches += 1
+            for (_, future), vector in zip(items, vectors):
+                future.set_result(vector)
+
+
+class QueryHandler(BaseHTTPRequestHandler):
+    def send_json(self, status, payload):
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == "/metrics":
+            # Per-stage telemetry; empty unless telemetry is enabled
+            body = telemetry.prometheus_text().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+        if self.path != "/health":
+            self.send_json(404, {"error": f"Unknown endpoint {self.path}"})
+            return
+        agent = self.server.agent
+        self.send_json(
+            200,
+            {
+                "status": "ok",
+                "books": agent.db.list_books(),
+                "chunks": agent.db.live_rows(),
+                "cache": agent.cache_stats(),
+            },
+        )
+
+    def do_POST(self):
+        if self.path not in ("/answer", "/retrieve"):
+            self.send_json(404, {"error": f"Unknown endpoint {self.path}"})
+            return
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            request = json.loads(self.rfile.read(length) or b"{}")
+            question = request["question"]
+        except (ValueError, KeyError):
+            self.send_json(400, {"error": "Expected a JSON body with a question"})
+            return
+
+        # top_k must be a positive integer; larger values than max_top_k
+        # are capped rather than searched
+        top_k = request.get("top_k", 5)
+        if not isinstance(top_k, int) or isinstance(top_k, bool) or top_k < 1:
+            self.send_json(400, {"error": "top_k must be a positive integer"})
+            return
+        top_k = min(top_k, self.server.max_top_k)
+
+        agent = self.server.agent
+        books = request.get("books")
+        try:
+            # Requests beyond max_concurrent wait here for a free slot
+            with self.server.slots:
+                if self.path == "/answer":
+                    answer, chunks = agent.answer_question(
+                        question, top_k=top_k, books=books
+                    )
+                    payload = {"answer": answer, "chunks": chunks or []}
+                else:
+                    chunks = agent.db.query(
+                        question,
+                        top_k=top_k,
+                        chapter_keywords=request.get("chapter_keywords"),
+                        books=books,
+                    )
+                    payload = {"chunks": chunks}
+        except Exception as e:
+            self.send_json(500, {"error": str(e)})
+            return
+        self.send_json(200, payload)
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+
+class QueryServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(
+        self,
+        address,
+        agent,
+        max_concurrent=8,
+        max_batch=32,
+        max_wait=0.005,
+        max_top_k=50,
+        verbose=False,
+    ):
+        super().__init__(address, QueryHandler)
+        self.agent = agent
+        self.max_top_k = max_top_k
+        self.agent.db.embedder = BatchingEmbedder(
+            agent.db.embedder, max_batch=max_batch, max_wait=max_wait
+        )
+        self.slots = threading.BoundedSemaphore(max_concurrent)
+        self.verbose = verbose
+
+
+def serve(
+    host="127.0.0.1",
+    port=8000,
+    model="gpt-4o-mini",
+    max_concurrent=8,
+    verbose=True,
+):
+    # The model and index are loaded once and stay warm for every request
+    agent = TextbookAgent(model=model).warmup()
+    server = QueryServer(
+        (host, port), agent, max_concurrent=max_concurrent, verbose=verbose
+    )
+    print(f"Serving on http://{host}:{server.server_address[1]}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Serve answers and retrieval over HTTP"
+    )
+    parser.add_argument("--host", type=str, default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--model", type=str, default="gpt-4o-mini")
+    parser.add_argument(
+        "--max-concurrent",
+        type=int,
+        default=8,
+        help="Requests handled at once; the rest are queued (default: 8)",
+    )
+    args = parser.parse_args()
+    serve(args.host, args.port, args.model, args.max_concurrent)
@@ -0,0 +1,213 @@
+from pathlib import Path
+
+from src.autonomous_ta.bm25 import Postings
+from src.autonomous_ta.chunk_store import ChunkSegment
+from src.autonomous_ta.lazy import lazy_import
+
+import hashlib
+import json
+import numpy as np
+import os
+
+faiss = lazy_import("faiss")
+
+
+def content_hash(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def store_paths(chunks_file, model_name):
+    chunks_file = Path(chunks_file)
+    slug = model_name.replace("/", "__")
+    prefix = f"{chunks_file.name}.{slug}"
+    return (
+        chunks_file.with_name(f"{prefix}.npy"),
+        chunks_file.with_name(f"{prefix}.meta"),
+    )
+
+
+def load_embeddings(chunks_file, model_name, source_hash):
+    embeddings_file, meta_file = store_paths(chunks_file, model_name)
+    if not embeddings_file.exists() or not meta_file.exists():
+        return None
+    with open(meta_file, "r", encoding="utf-8") as f:
+        meta = json.load(f)
+    if meta.get("model") != model_name:
+        return None
+    if meta.get("content_hash") != source_hash:
+        return None
+
+    embeddings = np.load(embeddings_file, mmap_mode="r")
+    if list(embeddings.shape) != [meta["count"], meta["dim"]]:
+        return None
+    return embeddings
+
+
+def save_embeddings(chunks_file, model_name, source_hash, embeddings):
+    embeddings_file, meta_file = store_paths(chunks_file, model_name)
+    embeddings = np.ascontiguousarray(embeddings, dtype="float32")
+    meta = {
+        "model": model_name,
+        "content_hash": source_hash,
+        "count": embeddings.shape[0],
+        "dim": embeddings.shape[1],
+    }
+
+    # Write to temporary files first so a crash never leaves a torn store
+    tmp_embeddings = embeddings_file.with_name(embeddings_file.name + ".tmp")
+    with open(tmp_embeddings, "wb") as f:
+        np.save(f, embeddings)
+    os.replace(tmp_embeddings, embeddings_file)
+
+    tmp_meta = meta_file.with_name(meta_file.name + ".tmp")
+    with open(tmp_meta, "w", encoding="utf-8") as f:
+        json.dump(meta, f)
+    os.replace(tmp_meta, meta_file)
+
+
+def chunk_paths(chunks_file):
+    chunks_file = Path(chunks_file)
+    prefix = f"{chunks_file.name}.chunks"
+    return (
+        chunks_file.with_name(f"{prefix}.bin"),
+        chunks_file.with_name(f"{prefix}.npy"),
+        chunks_file.with_name(f"{prefix}.meta"),
+    )
+
+
+CHUNK_COLUMNS = np.dtype([("offset", "<i8"), ("page", "<i4"), ("chapter", "<i4")])
+
+
+def load_chunks(chunks_file, source_hash):
+    blob_file, columns_file, meta_file = chunk_paths(chunks_file)
+    if not all(path.exists() for path in (blob_file, columns_file, meta_file)):
+        return None
+    with open(meta_file, "r", encoding="utf-8") as f:
+        meta = json.load(f)
+    if meta.get("content_hash") != source_hash:
+        return None
+
+    # Both files are memory-mapped, so nothing is copied until a row is read
+    columns = np.load(columns_file, mmap_mode="r")
+    if columns.dtype != CHUNK_COLUMNS or len(columns) != meta["count"] + 1:
+        return None
+    if blob_file.stat().st_size:
+        blob = np.memmap(blob_file, dtype="uint8", mode="r")
+    else:
+        blob = np.zeros(0, dtype="uint8")
+    if len(blob) != columns["offset"][-1]:
+        return None
+    return ChunkSegment(
+        blob,
+        columns["offset"],
+        columns["page"][:-1],
+        columns["chapter"][:-1],
+        meta["chapters"],
+    )
+
+
+def save_chunks(chunks_file, source_hash, segment):
+    blob_file, columns_file, meta_file = chunk_paths(chunks_file)
+    # The last row only carries the end offset of the final text
+    columns = np.zeros(len(segment) + 1, dtype=CHUNK_COLUMNS)
+    columns["offset"] = segment.offsets
+    columns["page"][:-1] = segment.pages
+    columns["chapter"][:-1] = segment.chapters
+    meta = {
+        "content_hash": source_hash,
+        "count": len(segment),
+        "chapters": segment.chapter_table,
+    }
+
+    tmp_blob = blob_file.with_name(blob_file.name + ".tmp")
+    with open(tmp_blob, "wb") as f:
+        f.write(segment.blob.tobytes())
+    os.replace(tmp_blob, blob_file)
+
+    tmp_columns = columns_file.with_name(columns_file.name + ".tmp")
+    with open(tmp_columns, "wb") as f:
+        np.save(f, columns)
+    os.replace(tmp_columns, columns_file)
+
+    tmp_meta = meta_file.with_name(meta_file.name + ".tmp")
+    with open(tmp_meta, "w", encoding="utf-8") as f:
+        json.dump(meta, f, ensure_ascii=False)
+    os.replace(tmp_meta, meta_file)
+
+
+def postings_path(chunks_file):
+    chunks_file = Path(chunks_file)
+    return chunks_file.with_name(f"{chunks_file.name}.bm25.npz")
+
+
+def load_postings(chunks_file, source_hash):
+    postings_file = postings_path(chunks_file)
+    if not postings_file.exists():
+        return None
+    with np.load(postings_file, allow_pickle=False) as data:
+        if str(data["content_hash"]) != source_hash:
+            return None
+        return Postings(
+            data["vocab"].tolist(),
+            data["indptr"],
+            data["rows"],
+            data["tf"],
+            data["lengths"],
+        )
+
+
+def save_postings(chunks_file, source_hash, postings):
+    postings_file = postings_path(chunks_file)
+    tmp_postings = postings_file.with_name(postings_file.name + ".tmp")
+    with open(tmp_postings, "wb") as f:
+        np.savez(
+            f,
+            content_hash=np.array(source_hash),
+            vocab=np.array(postings.vocab, dtype=str),
+            indptr=postings.indptr,
+            rows=postings.rows,
+            tf=postings.tf,
+            lengths=postings.lengths,
+        )
+    os.replace(tmp_postings, postings_file)
+
+
+def index_paths(data_dir, model_name, index_type):
+    slug = model_name.replace("/", "__")
+    prefix = f"index.{slug}.{index_type}"
+    return (
+        Path(data_dir) / f"{prefix}.faiss",
+        Path(data_dir) / f"{prefix}.meta",
+    )
+
+
+def index_name(params):
+    # Reduced-precision indexes are saved alongside the float32 one
+    precision = params.get("precision", "float32")
+    if precision == "float32":
+        return params["index_type"]
+    return f"{params['index_type']}-{precision}"
+
+
+def load_index(data_dir, model_name, index_type):
+    index_file, meta_file = index_paths(data_dir, model_name, index_type)
+    if not index_file.exists() or not meta_file.exists():
+        return None
+    with open(meta_file, "r", encoding="utf-8") as f:
+        meta = json.load(f)
+    return faiss.read_index(str(index_file)), meta
+
+
+def save_index(data_dir, model_name, index, meta):
+    index_file, meta_file = index_paths(
+        data_dir, model_name, index_name(meta["params"])
+    )
+
+    tmp_index = index_file.with_name(index_file.name + ".tmp")
+    faiss.write_index(index, str(tmp_index))
+    os.replace(tmp_index, index_file)
+
+    tmp_meta = meta_file.with_name(meta_file.name + ".tmp")
+    with open(tmp_meta, "w", encoding="utf-8") as f:
+        json.dump(meta, f)
+    os.replace(tmp_meta, meta_file)
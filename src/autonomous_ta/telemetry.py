@@ -0,0 +1,247 @@
+import contextvars
+import functools
+import inspect
+import itertools
+import json
+import threading
+import time
+
+
+# The span the current thread or task is inside, for parent links
+CURRENT_SPAN = contextvars.ContextVar("current_span", default=None)
+# Span attributes that are summed per stage
+COUNTERS = ("prompt_tokens", "completion_tokens", "input_size", "output_size")
+
+
+class NullSpan:
+    # Returned while telemetry is disabled, so instrumented code costs one
+    # attribute check and no timing calls
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+    def set(self, **attrs):
+        pass
+
+
+NULL_SPAN = NullSpan()
+
+
+class Span:
+    __slots__ = (
+        "telemetry",
+        "name",
+        "attrs",
+        "parent",
+        "trace",
+        "start",
+        "duration",
+        "token",
+    )
+
+    def __init__(self, telemetry, name, attrs):
+        self.telemetry = telemetry
+        self.name = name
+        self.attrs = attrs
+
+    def __enter__(self):
+        parent = CURRENT_SPAN.get()
+        self.parent = parent.name if parent is not None else None
+        self.trace = (
+            parent.trace if parent is not None else next(self.telemetry.traces)
+        )
+        self.token = CURRENT_SPAN.set(self)
+        self.start = time.time()
+        self.duration = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.duration = time.perf_counter() - self.duration
+        CURRENT_SPAN.reset(self.token)
+        if exc_type is not None:
+            self.attrs["error"] = exc_type.__name__
+        self.telemetry.record(self)
+        return False
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+    def to_dict(self):
+        return {
+            "name": self.name,
+            "trace": self.trace,
+            "parent": self.parent,
+            "start": self.start,
+            "duration_ms": self.duration * 1000,
+            **self.attrs,
+        }
+
+
+class JSONLExporter:
+    # Appends every finished span to a JSON-lines file
+    def __init__(self, path):
+        self.file = open(path, "a", encoding="utf-8")
+        self.lock = threading.Lock()
+
+    def export(self, span):
+        line = json.dumps(span.to_dict(), ensure_ascii=False, default=str)
+        with self.lock:
+            self.file.write(line + "\n")
+            self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+class Telemetry:
+    # Per-stage spans with duration, sizes, token counts and cache status.
+    # Off by default; enable() starts aggregating per stage and passing
+    # each finished span to the exporters
+    def __init__(self):
+        self.enabled = False
+        self.exporters = []
+        self.stages = {}
+        self.traces = itertools.count(1)
+        self.lock = threading.Lock()
+
+    def enable(self, jsonl_path=None):
+        if jsonl_path is not None:
+            self.exporters.append(JSONLExporter(jsonl_path))
+        self.enabled = True
+        return self
+
+    def disable(self):
+        self.enabled = False
+        for exporter in self.exporters:
+            exporter.close()
+        self.exporters = []
+
+    def reset(self):
+        with self.lock:
+            self.stages = {}
+
+    def span(self, name, **attrs):
+        if not self.enabled:
+            return NULL_SPAN
+        return Span(self, name, attrs)
+
+    def current(self):
+        # The innermost open span, for code that annotates its caller's
+        # stage, such as token counts from a completion
+        if not self.enabled:
+            return NULL_SPAN
+        return CURRENT_SPAN.get() or NULL_SPAN
+
+    def record(self, span):
+        with self.lock:
+            stage = self.stages.get(span.name)
+            if stage is None:
+                stage = self.stages[span.name] = {
+                    "count": 0,
+                    "seconds": 0.0,
+                    "max_seconds": 0.0,
+                    "cache_hits": 0,
+                    "cache_misses": 0,
+                    "errors": 0,
+                    **{counter: 0 for counter in COUNTERS},
+                }
+            stage["count"] += 1
+            stage["seconds"] += span.duration
+            stage["max_seconds"] = max(stage["max_seconds"], span.duration)
+            cache = span.attrs.get("cache")
+            if cache is not None:
+                stage["cache_hits" if cache == "hit" else "cache_misses"] += 1
+            if "error" in span.attrs:
+                stage["errors"] += 1
+            for counter in COUNTERS:
+                stage[counter] += span.attrs.get(counter) or 0
+        for exporter in self.exporters:
+            exporter.export(span)
+
+    def stats(self):
+        with self.lock:
+            return {name: dict(stage) for name, stage in self.stages.items()}
+
+    def report(self):
+        # Per-stage breakdown, slowest stage first
+        stages = sorted(
+            self.stats().items(), key=lambda item: -item[1]["seconds"]
+        )
+        lines = [
+            f"{'stage':<20} {'calls':>6} {'total ms':>10} {'mean ms':>9} "
+            f"{'max ms':>9} {'tok in':>8} {'tok out':>8} {'cache':>7}"
+        ]
+        for name, stage in stages:
+            lookups = stage["cache_hits"] + stage["cache_misses"]
+            cache = f"{stage['cache_hits']}/{lookups}" if lookups else "-"
+            lines.append(
+                f"{name:<20} {stage['count']:>6} "
+                f"{stage['seconds'] * 1000:>10.1f} "
+                f"{stage['seconds'] / stage['count'] * 1000:>9.1f} "
+                f"{stage['max_seconds'] * 1000:>9.1f} "
+                f"{stage['prompt_tokens']:>8} {stage['completion_tokens']:>8} "
+                f"{cache:>7}"
+            )
+        return "\n".join(lines)
+
+    def prometheus_text(self):
+        # Prometheus text exposition format, one series per stage
+        stages = self.stats()
+        seconds = "autonomous_ta_stage_seconds"
+        tokens = "autonomous_ta_tokens_total"
+        cache = "autonomous_ta_cache_total"
+        # (family, type, series suffix, stats field, extra labels); the
+        # stage durations are a summary family with _sum and _count series
+        metrics = [
+            (seconds, "summary", "_sum", "seconds", ""),
+            (seconds, "summary", "_count", "count", ""),
+            (f"{seconds}_max", "gauge", "", "max_seconds", ""),
+            (tokens, "counter", "", "prompt_tokens", ',kind="prompt"'),
+            (tokens, "counter", "", "completion_tokens", ',kind="completion"'),
+            (cache, "counter", "", "cache_hits", ',result="hit"'),
+            (cache, "counter", "", "cache_misses", ',result="miss"'),
+            ("autonomous_ta_stage_errors_total", "counter", "", "errors", ""),
+        ]
+        lines = []
+        typed = set()
+        for family, kind, suffix, field, label in metrics:
+            if family not in typed:
+                lines.append(f"# TYPE {family} {kind}")
+                typed.add(family)
+            for name, stage in sorted(stages.items()):
+                lines.append(
+                    f'{family}{suffix}{{stage="{name}"{label}}} {stage[field]}'
+                )
+        return "\n".join(lines) + "\n"
+
+
+# Shared by the agent, the vector database and the server
+telemetry = Telemetry()
+
+
+def traced(name):
+    # Runs every call of the decorated function or coroutine in a span
+    def decorate(func):
+        if inspect.iscoroutinefunction(func):
+
+            @functools.wraps(func)
+            async def wrapper(*args, **kwargs):
+                if not telemetry.enabled:
+                    return await func(*args, **kwargs)
+                with telemetry.span(name):
+                    return await func(*args, **kwargs)
+
+        else:
+
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                if not telemetry.enabled:
+                    return func(*args, **kwargs)
+                with telemetry.span(name):
+                    return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorate
@@ -0,0 +1,48 @@
+import functools
+import re
+
+try:
+    import tiktoken
+except ImportError:  # optional extra; token counts fall back to a regex
+    tiktoken = None
+
+
+ENCODING_NAME = "cl100k_base"
+# Words and individual punctuation marks, a close stand-in for BPE tokens on
+# English prose when tiktoken is not installed or its encoding cannot be
+# downloaded
+TOKEN_PATTERN = re.compile(r"\w+|[^\w\s]")
+
+
+@functools.lru_cache(maxsize=None)
+def get_encoding(name=ENCODING_NAME):
+    if tiktoken is None:
+        return None
+    try:
+        return tiktoken.get_encoding(name)
+    except Exception:
+        # The encoding is downloaded on first use; work offline without it
+        return None
+
+
+def count_tokens(text):
+    encoding = get_encoding()
+    if encoding is not None:
+        return len(encoding.encode(text, disallowed_special=()))
+    return len(TOKEN_PATTERN.findall(text))
+
+
+def split_tokens(text, max_tokens):
+    # Cut text into pieces of at most max_tokens tokens
+    encoding = get_encoding()
+    if encoding is not None:
+        ids = encoding.encode(text, disallowed_special=())
+        return [
+            encoding.decode(ids[start:start + max_tokens])
+            for start in range(0, len(ids), max_tokens)
+        ]
+    spans = [match.span() for match in TOKEN_PATTERN.finditer(text)]
+    return [
+        text[spans[start][0]:spans[min(start + max_tokens, len(spans)) - 1][1]]
+        for start in range(0, len(spans), max_tokens)
+    ]
@@ -1,91 +1,1041 @@
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from sentence_transformers import SentenceTransformer
 
-import faiss
+from src.autonomous_ta import store
+from src.autonomous_ta.bm25 import BM25Index, Postings, reciprocal_rank_fusion
+from src.autonomous_ta.chunk_store import ChunkSegment, ChunkStore
+from src.autonomous_ta.lazy import lazy_import
+from src.autonomous_ta.telemetry import telemetry, traced
+
+import contextvars
+import difflib
+import functools
 import json
 import numpy as np
 import os
+import re
+import tempfile
+import time
+
+faiss = lazy_import("faiss")
 
 
 DATA_DIR = Path("data/raw/")
 
 
+def load_model(model_name):
+    # sentence_transformers pulls in torch; only import it once a model is
+    # actually needed
+    from sentence_transformers import SentenceTransformer
+
+    return SentenceTransformer(model_name)
+
+
+class Embedder:
+    def __init__(self, model, batch_size=64, num_threads=None, num_workers=0):
+        # A loaded model, or a function that loads one on first use
+        if hasattr(model, "encode"):
+            self.loader, self.loaded = None, model
+        else:
+            self.loader, self.loaded = model, None
+        self.batch_size = batch_size
+        self.num_workers = num_workers
+        self.pool = None
+        self.last_throughput = None
+        if num_threads:
+            import torch
+
+            torch.set_num_threads(num_threads)
+            faiss.omp_set_num_threads(num_threads)
+
+    @property
+    def model(self):
+        if self.loaded is None:
+            self.loaded = self.loader()
+        return self.loaded
+
+    @property
+    def dim(self):
+        return self.model.get_sentence_embedding_dimension()
+
+    def encode(self, texts, show_progress_bar=False):
+        texts = list(texts)
+        if not texts:
+            # The model returns shape (0,) for no input, which would be
+            # cached and indexed as a vector-less book
+            return np.empty((0, self.dim), dtype="float32")
+        start = time.perf_counter()
+
+        # Longest first, so each batch pads to a similar length and every
+        # worker shard gets an even mix of work
+        order = np.argsort([-len(text) for text in texts], kind="stable")
+        sorted_texts = [texts[pos] for pos in order]
+        if self.num_workers > 1 and len(texts) > self.batch_size:
+            if self.pool is None:
+                self.pool = self.model.start_multi_process_pool(
+                    ["cpu"] * self.num_workers
+                )
+            encoded = self.model.encode(
+                sorted_texts,
+                batch_size=self.batch_size,
+                pool=self.pool,
+                chunk_size=max(
+                    self.batch_size, len(texts) // (4 * self.num_workers)
+                ),
+            )
+        else:
+            encoded = self.model.encode(
+                sorted_texts,
+                batch_size=self.batch_size,
+                show_progress_bar=show_progress_bar,
+            )
+        encoded = np.asarray(encoded, dtype="float32")
+
+        embeddings = np.empty_like(encoded)
+        embeddings[order] = encoded
+        elapsed = time.perf_counter() - start
+        self.last_throughput = len(texts) / elapsed if elapsed else None
+        return embeddings
+
+    def close(self):
+        if self.pool is not None:
+            self.model.stop_multi_process_pool(self.pool)
+            self.pool = None
+
+
+def normalize_rows(vectors):
+    # Unit-length copy, so inner product equals cosine similarity
+    vectors = np.asarray(vectors, dtype="float32")
+    vectors = vectors.reshape(-1, vectors.shape[-1])
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.where(norms == 0, 1.0, norms)
+
+
+def rows_from_runs(runs):
+    # Expand sorted [start, stop) runs into row ids without a Python loop
+    if not len(runs):
+        return np.empty(0, dtype="int64")
+    runs = runs[np.argsort(runs[:, 0], kind="stable")]
+    lengths = runs[:, 1] - runs[:, 0]
+    offsets = np.repeat(runs[:, 0] - (np.cumsum(lengths) - lengths), lengths)
+    return offsets + np.arange(lengths.sum(), dtype="int64")
+
+
+def spill_vectors(vectors):
+    # Page vectors out to an unnamed temporary file; without the .npy cache
+    # they would otherwise stay resident next to the index, although only
+    # the few rows hybrid fusion or compaction reads are ever needed. The
+    # mapping keeps its own descriptor, so the file object can be closed.
+    with tempfile.TemporaryFile() as f:
+        spilled = np.memmap(
+            f, dtype=vectors.dtype, mode="w+", shape=vectors.shape
+        )
+    spilled[:] = vectors
+    return spilled
+
+
+# "<title> [<book>]", the form list_chapters and route_chapters return
+LABEL_PATTERN = re.compile(r"^(.*?)\s*\[([^\[\]]+)\]$")
+
+INDEX_TYPES = ("flat", "ivf", "hnsw", "ivfpq")
+# Storage precision of the vectors inside the index; the float32 vectors
+# for hybrid search and exact reranking are memory-mapped from the .npy
+# cache, or a temporary file without it, unless reranking needs them resident
+PRECISIONS = ("float32", "float16", "int8")
+
+
 class VectorDB:
-    def __init__(self, model_name="all-MiniLM-L6-v2"):
-        self.model = SentenceTransformer(model_name)
+    def __init__(
+        self,
+        model_name="all-MiniLM-L6-v2",
+        cache_embeddings=True,
+        compact_threshold=0.25,
+        batch_size=64,
+        num_threads=None,
+        num_workers=0,
+        index_type="flat",
+        nlist=None,
+        nprobe=8,
+        hnsw_m=32,
+        ef_search=64,
+        pq_m=None,
+        train_size=100_000,
+        hybrid=True,
+        rrf_k=60,
+        candidates=4,
+        precision="float32",
+        rerank_factor=0,
+        normalize=True,
+        min_score=None,
+    ):
+        if index_type not in INDEX_TYPES:
+            raise ValueError(
+                f"Unknown index type {index_type!r}, expected one of "
+                f"{', '.join(INDEX_TYPES)}"
+            )
+        if precision not in PRECISIONS:
+            raise ValueError(
+                f"Unknown precision {precision!r}, expected one of "
+                f"{', '.join(PRECISIONS)}"
+            )
+        if precision != "float32" and index_type == "ivfpq":
+            raise ValueError("ivfpq already compresses vectors; use float32")
+        # The model is loaded on first encode, or by warmup()
+        self.embedder = Embedder(
+            functools.partial(load_model, model_name),
+            batch_size=batch_size,
+            num_threads=num_threads,
+            num_workers=num_workers,
+        )
+        self.model_name = model_name
+        self.cache_embeddings = cache_embeddings
+        self.compact_threshold = compact_threshold
+        self.index_type = index_type
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.hnsw_m = hnsw_m
+        self.ef_search = ef_search
+        self.pq_m = pq_m
+        self.train_size = train_size
+        self.precision = precision
+        # Fetch rerank_factor * top_k candidates from the index and reorder
+        # them by exact distance to the float32 vectors; 0 disables
+        self.rerank_factor = rerank_factor
+        # Normalized embeddings are searched by inner product, so scores are
+        # cosine similarities; results scoring below min_score are dropped
+        self.normalize = normalize
+        self.min_score = min_score
+        # Hybrid search fuses the top candidates * top_k rows of the dense
+        # and BM25 rankings with reciprocal-rank fusion
+        self.hybrid = hybrid
+        self.rrf_k = rrf_k
+        self.candidates = candidates
+        self.lexical_pool = None
+        # Bumped whenever the searchable content changes, so callers can
+        # tell when cached answers may be stale
+        self.version = 0
+        self.reset()
+
+    @property
+    def model(self):
+        return self.embedder.model
+
+    @property
+    def store_name(self):
+        # Normalized and raw embeddings are cached and indexed separately
+        if self.normalize:
+            return f"{self.model_name}.normalized"
+        return self.model_name
+
+    def warmup(self):
+        # Load the embedding model and FAISS now rather than on the first
+        # query, e.g. before a server starts taking requests
+        self.embedder.encode(["warmup"])
+        faiss.IndexFlatL2(1)
+        return self
+
+    def reset(self):
         self.index = None
-        self.texts = []
-        self.metadata = []
+        # Text, page, chapter and book of every row, stored column-wise;
+        # texts and metadata are read-only views over it
+        self.chunks = ChunkStore()
+        self.texts = self.chunks.texts
+        self.metadata = self.chunks.metadata
+        self.alive = np.zeros(0, dtype=bool)
+        self.dead_rows = 0
+        self.live_bitmap = None
+        self.live_selector = None
+        self.books = {}
+        self.book_hashes = {}
+        self.book_vectors = {}
+        self.book_chunks = {}
+        self.book_postings = {}
+        self.lexical = BM25Index()
+        # Chapters are interned per (book, title) to integer ids in the
+        # chunk store; chapter_rows maps a chapter id to the [start, stop)
+        # row runs it covers in its book
+        self.chapter_titles = self.chunks.chapter_titles
+        self.chapter_levels = self.chunks.chapter_levels
+        self.chapter_books = self.chunks.chapter_books
+        self.chapter_rows = {}
+        self.keyword_ids = {}
+        self.chapter_centroids = {}
+        self.centroid_cache = None
+        self.version += 1
 
+    @traced("build_index")
     def build_index(self):
-        for file in os.listdir(DATA_DIR):
-            if file.split(".")[-1] == "json":
-                CHUNKS_FILE = DATA_DIR / file
-                with open(CHUNKS_FILE, "r", encoding="utf-8") as f:
-                    chunks = json.load(f)
-
-                self.texts = [chunk["chunk_text"] for chunk in chunks]
-                self.metadata = [
-                    {  # fmt: off
-                        "chapter": chunk["chapter_title"],
-                        "page": chunk["page_num"],
-                        "book": file,
-                    }
-                    for chunk in chunks
-                ]
+        self.reset()
+        entries = [
+            self.load_book(chunks_file)
+            for chunks_file in self.chunk_files().values()
+        ]
+        if not self.load_saved_index(entries):
+            self.append_books(entries)
+            self.save_index()
+        print(
+            f"Index built with {self.live_rows()} chunks "
+            f"from {len(self.books)} books"
+        )
+        print(
+            f"Chunk store uses {self.chunks.bytes_per_row():.1f} bytes per row"
+        )
+        telemetry.current().set(output_size=self.live_rows())
+
+    def chunk_files(self):
+        names = set(os.listdir(DATA_DIR))
+        return {
+            file: DATA_DIR / file
+            for file in sorted(names)
+            if file.split(".")[-1] == "jsonl"
+            # Older JSON output is only used if there is no JSONL version
+            or (file.split(".")[-1] == "json" and f"{file}l" not in names)
+        }
+
+    def sync(self):
+        # Bring the index in line with DATA_DIR, touching only changed books
+        files = self.chunk_files()
+        for book in list(self.books):
+            if book not in files:
+                self.remove_book(book)
+        for file, chunks_file in files.items():
+            if file in self.books:
+                self.refresh_book(chunks_file)
+            else:
+                self.add_book(chunks_file)
+
+    def read_chunks(self, chunks_file, raw):
+        text = raw.decode("utf-8")
+        if Path(chunks_file).suffix == ".jsonl":
+            return [json.loads(line) for line in text.splitlines() if line]
+        return json.loads(text)
+
+    def load_book(self, chunks_file, raw=None):
+        chunks_file = Path(chunks_file)
+        book = chunks_file.name
+        if raw is None:
+            raw = chunks_file.read_bytes()
+        source_hash = store.content_hash(raw)
+
+        # Columnar chunks are memory-mapped from disk when the chunks file
+        # is unchanged, so the JSON is only parsed once
+        chunks = None
+        if self.cache_embeddings:
+            chunks = store.load_chunks(chunks_file, source_hash)
+        if chunks is None:
+            chunks = ChunkSegment.from_chunks(
+                self.read_chunks(chunks_file, raw)
+            )
+            if self.cache_embeddings:
+                store.save_chunks(chunks_file, source_hash, chunks)
+        postings = None
+        if self.cache_embeddings:
+            postings = store.load_postings(chunks_file, source_hash)
+        if postings is None:
+            postings = Postings.from_texts(chunks.texts())
+            if self.cache_embeddings:
+                store.save_postings(chunks_file, source_hash, postings)
+        embeddings = self.load_or_encode(chunks_file, source_hash, chunks)
+        return {
+            "book": book,
+            "hash": source_hash,
+            "chunks": chunks,
+            "postings": postings,
+            "embeddings": embeddings,
+        }
+
+    def add_book(self, chunks_file):
+        book = Path(chunks_file).name
+        if book in self.books:
+            raise ValueError(f"Book {book} is already indexed")
+        self.append_books([self.load_book(chunks_file)])
+        start, stop = self.books[book]
+        print(f"Added {book} with {stop - start} chunks")
+
+    def remove_book(self, book):
+        start, stop = self.books.pop(book)
+        del self.book_hashes[book]
+        del self.book_vectors[book]
+        del self.book_chunks[book]
+        del self.book_postings[book]
+        self.lexical.remove(book)
+        for chapter_id in list(self.chapter_rows):
+            if self.chapter_rows[chapter_id].pop(book, None) is not None:
+                del self.chapter_centroids[(book, chapter_id)]
+            if not self.chapter_rows[chapter_id]:
+                del self.chapter_rows[chapter_id]
+
+        # Tombstone the rows; they stay in the index until the next compaction
+        self.alive[start:stop] = False
+        self.dead_rows += stop - start
+        self.version += 1
+        self.update_live_selector()
+        print(f"Removed {book} ({stop - start} chunks)")
+        if self.dead_rows > self.compact_threshold * len(self.chunks):
+            self.compact()
+
+    def refresh_book(self, chunks_file):
+        chunks_file = Path(chunks_file)
+        book = chunks_file.name
+        raw = chunks_file.read_bytes()
+        if self.book_hashes.get(book) == store.content_hash(raw):
+            return False
+        if book in self.books:
+            self.remove_book(book)
+        self.append_books([self.load_book(chunks_file, raw)])
+        print(f"Refreshed {book}")
+        return True
 
-                print("Computing embeddings...")
-                embeddings = self.model.encode(  # fmt: off
-                    self.texts, show_progress_bar=True
+    def load_or_encode(self, chunks_file, source_hash, chunks):
+        if self.cache_embeddings:
+            embeddings = store.load_embeddings(
+                chunks_file, self.store_name, source_hash
+            )
+            if embeddings is not None:
+                print(f"Loaded cached embeddings for {chunks_file.name}")
+                return embeddings
+
+        print("Computing embeddings...")
+        texts = chunks.texts()
+        embeddings = self.embedder.encode(texts, show_progress_bar=True)
+        if self.embedder.last_throughput:
+            print(
+                f"Encoded {len(texts)} chunks at "
+                f"{self.embedder.last_throughput:.1f} chunks/s"
+            )
+        if self.normalize and len(embeddings):
+            embeddings = normalize_rows(embeddings)
+        if self.cache_embeddings:
+            store.save_embeddings(
+                chunks_file, self.store_name, source_hash, embeddings
+            )
+            # Keep the float32 vectors memory-mapped rather than resident,
+            # so a reduced-precision index actually saves memory
+            saved = store.load_embeddings(
+                chunks_file, self.store_name, source_hash
+            )
+            if saved is not None:
+                embeddings = saved
+        return embeddings
+
+    def set_corpus(self, texts, metadata, embeddings):
+        self.reset()
+        if self.normalize and len(embeddings):
+            embeddings = normalize_rows(embeddings)
+        entries = []
+        start = 0
+        for pos in range(1, len(metadata) + 1):
+            if (
+                pos == len(metadata)
+                or metadata[pos]["book"] != metadata[start]["book"]
+            ):
+                book_metadata = metadata[start:pos]
+                chunks = ChunkSegment.from_columns(
+                    texts[start:pos],
+                    [meta["chapter"] for meta in book_metadata],
+                    [meta.get("level", 1) for meta in book_metadata],
+                    [meta["page"] for meta in book_metadata],
+                )
+                entries.append(
+                    {
+                        "book": metadata[start]["book"],
+                        "hash": None,
+                        "chunks": chunks,
+                        "embeddings": embeddings[start:pos],
+                    }
                 )
-                embeddings = np.array(embeddings).astype("float32")
+                start = pos
+        self.append_books(entries)
 
-                # Build FAISS index
-                dim = embeddings.shape[1]
-                self.index = faiss.IndexFlatL2(dim)
-                self.index.add(embeddings)
-                print(f"Index for {file} built with {len(self.texts)} chunks")
+    def append_books(self, entries):
+        vectors = [
+            np.ascontiguousarray(entry["embeddings"], dtype="float32")
+            for entry in entries
+            if len(entry["chunks"])
+        ]
+        if vectors and self.index is None:
+            self.index = self.make_index(
+                vectors[0].shape[1], sum(len(v) for v in vectors)
+            )
+        if vectors and not self.index.is_trained:
+            self.train_index(vectors)
+        for entry in entries:
+            self.append_rows(
+                entry["book"],
+                entry["chunks"],
+                entry["embeddings"],
+                entry.get("postings"),
+            )
+            self.book_hashes[entry["book"]] = entry["hash"]
 
-    def query(self, question, top_k=5, chapter_keywords=None):
-        filtered_indices = list(range(len(self.texts)))
-        if chapter_keywords:
-            chapter_keywords_lower = [  # fmt: off
-                keyword.lower() for keyword in chapter_keywords
-            ]
-            filtered_indices = [
-                pos
-                for pos, meta in enumerate(self.metadata)
-                if any(
-                    keyword in meta["chapter"].lower()
-                    for keyword in chapter_keywords_lower
+    def index_params(self):
+        return {
+            "index_type": self.index_type,
+            "nlist": self.nlist,
+            "hnsw_m": self.hnsw_m,
+            "pq_m": self.pq_m,
+            "precision": self.precision,
+            "normalize": self.normalize,
+        }
+
+    def make_index(self, dim, n_rows):
+        qtype = {
+            "float16": faiss.ScalarQuantizer.QT_fp16,
+            "int8": faiss.ScalarQuantizer.QT_8bit,
+        }.get(self.precision)
+        metric = faiss.METRIC_L2
+        if self.normalize:
+            metric = faiss.METRIC_INNER_PRODUCT
+        if self.index_type == "flat":
+            if qtype is not None:
+                return faiss.IndexScalarQuantizer(dim, qtype, metric)
+            return faiss.IndexFlat(dim, metric)
+        if self.index_type == "hnsw":
+            if qtype is not None:
+                return faiss.IndexHNSWSQ(dim, qtype, self.hnsw_m, metric)
+            return faiss.IndexHNSWFlat(dim, self.hnsw_m, metric)
+
+        # IVF: roughly 4 * sqrt(n) lists, with enough training points per
+        # list for k-means (FAISS wants at least 39)
+        nlist = self.nlist or int(4 * np.sqrt(n_rows))
+        nlist = max(1, min(nlist, n_rows // 39))
+        quantizer = faiss.IndexFlat(dim, metric)
+        if self.index_type == "ivf":
+            if qtype is not None:
+                return faiss.IndexIVFScalarQuantizer(
+                    quantizer, dim, nlist, qtype, metric
                 )
+            return faiss.IndexIVFFlat(quantizer, dim, nlist, metric)
+        pq_m = self.pq_m or next(
+            m for m in (dim // 8, dim // 4, dim // 2, dim) if dim % m == 0
+        )
+        if dim % pq_m:
+            raise ValueError(
+                f"pq_m={pq_m} must divide the embedding dimension {dim}"
+            )
+        return faiss.IndexIVFPQ(quantizer, dim, nlist, pq_m, 8, metric)
+
+    def train_index(self, vectors):
+        # Train on a random sample drawn proportionally from every book
+        total = sum(len(v) for v in vectors)
+        fraction = min(1.0, self.train_size / total)
+        rng = np.random.default_rng(0)
+        sample = np.concatenate(
+            [
+                v[
+                    np.sort(
+                        rng.choice(
+                            len(v),
+                            max(1, int(len(v) * fraction)),
+                            replace=False,
+                        )
+                    )
+                ]
+                for v in vectors
             ]
-            if not filtered_indices:
-                filtered_indices = list(range(len(self.texts)))
-        filtered_embeddings = np.array(
-            [self.model.encode(self.texts[pos]) for pos in filtered_indices]
-        ).astype("float32")
-
-        q_vec = self.model.encode([question]).astype("float32")
-        index = faiss.IndexFlatL2(filtered_embeddings.shape[1])
-        index.add(filtered_embeddings)
-        distances, indices = index.search(  # fmt: off
-            q_vec, min(top_k, len(filtered_indices))
         )
+        if self.index_type == "ivfpq" and len(sample) < 256:
+            raise ValueError(
+                f"ivfpq needs at least 256 chunks to train, got {len(sample)}"
+            )
+        print(f"Training {self.index_type} index on {len(sample)} vectors...")
+        self.index.train(sample)
+
+    def save_index(self):
+        # A flat index is just the cached embeddings, so only trained or
+        # graph indexes are worth persisting
+        if self.index is None or self.index_type == "flat":
+            return
+        books = [
+            [book, self.book_hashes[book], stop - start]
+            for book, (start, stop) in self.books.items()
+        ]
+        if self.dead_rows or any(book_hash is None for _, book_hash, _ in books):
+            return
+        store.save_index(
+            DATA_DIR,
+            self.store_name,
+            self.index,
+            {"params": self.index_params(), "books": books},
+        )
+
+    def load_saved_index(self, entries):
+        if self.index_type == "flat":
+            return False
+        saved = store.load_index(
+            DATA_DIR, self.store_name, store.index_name(self.index_params())
+        )
+        if saved is None:
+            return False
+        index, meta = saved
+        books = [
+            [entry["book"], entry["hash"], len(entry["chunks"])]
+            for entry in entries
+        ]
+        if meta["params"] != self.index_params() or meta["books"] != books:
+            return False
+        print(f"Loaded saved {store.index_name(self.index_params())} index")
+        self.index = index
+        for entry in entries:
+            self.append_rows(
+                entry["book"],
+                entry["chunks"],
+                entry["embeddings"],
+                entry.get("postings"),
+                add_to_index=False,
+            )
+            self.book_hashes[entry["book"]] = entry["hash"]
+        return True
+
+    def append_rows(
+        self, book, chunks, embeddings, postings=None, add_to_index=True
+    ):
+        start = len(self.chunks)
+        if postings is None:
+            postings = Postings.from_texts(chunks.texts())
+        self.book_chunks[book] = chunks
+        self.book_postings[book] = postings
+        self.lexical.add(book, start, postings)
+        if not len(chunks):
+            self.books[book] = (start, start)
+            self.book_vectors[book] = None
+            return
+        mapped = isinstance(embeddings, np.memmap)
+        embeddings = np.ascontiguousarray(embeddings, dtype="float32")
+
+        # FAISS assigns sequential ids, so index ids always equal row numbers
+        if add_to_index:
+            self.index.add(embeddings)
+        chapter_ids = self.chunks.append(book, chunks)
+        self.alive = np.concatenate([self.alive, np.ones(len(chunks), bool)])
+        self.version += 1
+        if self.dead_rows:
+            self.update_live_selector()
+
+        # Row range per book and row runs per chapter, so scoping and
+        # filtering never touch the embeddings
+        self.books[book] = (start, start + len(chunks))
+        self.book_vectors[book] = embeddings
+        if not mapped and not self.rerank_factor:
+            self.book_vectors[book] = spill_vectors(embeddings)
+        bounds = np.flatnonzero(chapter_ids[1:] != chapter_ids[:-1]) + 1
+        run_starts = np.concatenate([[0], bounds])
+        run_stops = np.concatenate([bounds, [len(chunks)]])
+        run_sums = np.add.reduceat(embeddings, run_starts, axis=0)
+
+        runs, sums = {}, {}
+        for first, stop, run_sum in zip(run_starts, run_stops, run_sums):
+            chapter_id = int(chapter_ids[first])
+            runs.setdefault(chapter_id, []).append((start + first, start + stop))
+            sums[chapter_id] = sums.get(chapter_id, 0) + run_sum
+        for chapter_id, chapter_runs in runs.items():
+            self.chapter_rows.setdefault(chapter_id, {})[book] = np.array(
+                chapter_runs, dtype="int64"
+            )
+
+            # Unit-length chapter centroid, used to route questions to
+            # chapters without an LLM call
+            norm = np.linalg.norm(sums[chapter_id])
+            self.chapter_centroids[(book, chapter_id)] = sums[chapter_id] / (
+                norm or 1.0
+            )
+
+    def compact(self):
+        # Rebuild from the surviving books' stored vectors; nothing is
+        # re-embedded
+        live = sorted(self.books.items(), key=lambda item: item[1][0])
+        entries = [
+            {
+                "book": book,
+                "hash": self.book_hashes[book],
+                "chunks": self.book_chunks[book],
+                "postings": self.book_postings[book],
+                "embeddings": self.book_vectors[book],
+            }
+            for book, (start, stop) in live
+        ]
+        self.reset()
+        self.append_books(entries)
+        print(f"Compacted index to {len(self.chunks)} chunks")
+
+    def update_live_selector(self):
+        if not self.dead_rows:
+            self.live_selector = None
+            return
+        self.live_bitmap = np.packbits(self.alive, bitorder="little")
+        self.live_selector = faiss.IDSelectorBitmap(
+            len(self.alive), faiss.swig_ptr(self.live_bitmap)
+        )
+
+    def live_rows(self):
+        return len(self.chunks) - self.dead_rows
+
+    def chapter_label(self, chapter_id):
+        # Chapters are listed with their book, so the same title in two
+        # books stays two choices
+        book = self.chunks.book_names[self.chapter_books[chapter_id]]
+        return f"{self.chapter_titles[chapter_id]} [{book}]"
+
+    def match_chapter(self, keyword):
+        # Keywords match whole words of a title, so "1.1" finds "1.1 Mean"
+        # and "1.1.2 Modes" but not "1.10 Ranges"; a near-miss title falls
+        # back to the closest spelling. A "[book]" suffix, as in the labels
+        # from list_chapters, limits the match to that book's chapters.
+        keyword = keyword.strip().lower()
+        candidates = range(len(self.chapter_titles))
+        qualified = LABEL_PATTERN.match(keyword)
+        if qualified:
+            book_ids = {
+                book.lower(): book_id
+                for book, book_id in self.chunks.book_ids.items()
+            }
+            if qualified.group(2) in book_ids:
+                keyword = qualified.group(1)
+                book_id = book_ids[qualified.group(2)]
+                candidates = [
+                    chapter_id
+                    for chapter_id in candidates
+                    if self.chapter_books[chapter_id] == book_id
+                ]
+        if not keyword:
+            return []
+        pattern = re.escape(keyword)
+        if re.match(r"\w", keyword[0]):
+            pattern = r"(?<!\w)" + pattern
+        if re.match(r"\w", keyword[-1]):
+            pattern = pattern + r"(?!\w)"
+        pattern = re.compile(pattern)
+        titles = {
+            chapter_id: self.chapter_titles[chapter_id].lower()
+            for chapter_id in candidates
+        }
+        matched = [
+            chapter_id
+            for chapter_id, title in titles.items()  # fmt: off
+            if pattern.search(title)
+        ]
+        if matched:
+            return matched
+        close = difflib.get_close_matches(
+            keyword, list(titles.values()), n=1, cutoff=0.8
+        )
+        return [
+            chapter_id
+            for chapter_id, title in titles.items()  # fmt: off
+            if title in close
+        ]
+
+    def resolve_chapters(self, chapter_keywords):
+        # Titles are only matched once per keyword until new chapters appear
+        if self.keyword_ids.get(None) != len(self.chapter_titles):
+            self.keyword_ids = {None: len(self.chapter_titles)}
+        chapter_ids = set()
+        for keyword in chapter_keywords:
+            if keyword not in self.keyword_ids:
+                self.keyword_ids[keyword] = self.match_chapter(keyword)
+            chapter_ids.update(self.keyword_ids[keyword])
+        return sorted(chapter_ids)
+
+    def chapter_runs(self, chapter_ids, scope, level=None):
+        return [
+            book_runs
+            for chapter_id in chapter_ids
+            if chapter_id in self.chapter_rows
+            and (level is None or self.chapter_levels[chapter_id] == level)
+            for book, book_runs in self.chapter_rows[chapter_id].items()
+            if book in scope
+        ]
+
+    @traced("filter")
+    def filter_rows(self, chapter_keywords=None, books=None, level=None):
+        scope = self.books if books is None else set(books)
+        if chapter_keywords:
+            chapter_ids = self.resolve_chapters(chapter_keywords)
+            runs = self.chapter_runs(chapter_ids, scope, level)
+            if runs:
+                rows = rows_from_runs(np.concatenate(runs))
+                telemetry.current().set(output_size=len(rows))
+                return rows
+        if level is not None:
+            # A level with no chapters in scope selects no rows at all
+            runs = self.chapter_runs(self.chapter_rows, scope, level)
+            rows = rows_from_runs(np.concatenate(runs) if runs else runs)
+            telemetry.current().set(output_size=len(rows))
+            return rows
+        if books is None:
+            return None
+
+        ranges = [self.books[book] for book in scope if book in self.books]
+        rows = rows_from_runs(np.array(ranges, dtype="int64").reshape(-1, 2))
+        telemetry.current().set(output_size=len(rows))
+        return rows
+
+    def selector(self, rows):
+        # Contiguous rows (a single book or chapter) need no id lookup table
+        if rows[-1] - rows[0] + 1 == len(rows):
+            return faiss.IDSelectorRange(int(rows[0]), int(rows[-1]) + 1)
+        return faiss.IDSelectorBatch(rows)
+
+    def search_params(self, sel=None):
+        if self.index_type == "hnsw":
+            return faiss.SearchParametersHNSW(sel=sel, efSearch=self.ef_search)
+        if self.index_type in ("ivf", "ivfpq"):
+            return faiss.SearchParametersIVF(sel=sel, nprobe=self.nprobe)
+        if sel is not None:
+            return faiss.SearchParameters(sel=sel)
+        return None
+
+    def prepare(self, q_vecs):
+        q_vecs = np.asarray(q_vecs, dtype="float32")
+        return normalize_rows(q_vecs) if self.normalize else q_vecs
+
+    def scores(self, distances):
+        # Higher is better: cosine similarity for unit vectors, the negated
+        # squared L2 distance otherwise
+        if self.normalize:
+            return 1 - np.asarray(distances) / 2
+        return -np.asarray(distances)
 
+    @traced("search")
+    def search(self, q_vecs, top_k=5, rows=None):
+        # Returns squared L2 distances whatever the index metric, so exact
+        # reranking, hybrid fusion and results compare like with like
+        telemetry.current().set(input_size=len(q_vecs))
+        q_vecs = self.prepare(q_vecs)
+        if rows is None:
+            sel = self.live_selector
+            k = min(top_k, self.live_rows())
+        else:
+            sel = self.selector(rows) if len(rows) else None
+            k = min(top_k, len(rows))
+        if self.index is None or k == 0:
+            empty = np.empty((len(q_vecs), 0))
+            return empty.astype("float32"), empty.astype("int64")
+        if not self.rerank_factor:
+            distances, indices = self.index.search(
+                q_vecs, k, params=self.search_params(sel)
+            )
+            if self.normalize:
+                # |q - x|^2 = 2 - 2 q.x for unit vectors; slots FAISS
+                # padded with -FLT_MAX get the L2 padding, FLT_MAX, instead
+                found = indices >= 0
+                distances[found] = 2 - 2 * distances[found]
+                distances[~found] = np.finfo("float32").max
+            return distances, indices
+
+        available = self.live_rows() if rows is None else len(rows)
+        n_candidates = min(k * self.rerank_factor, available)
+        _, candidates = self.index.search(
+            q_vecs, n_candidates, params=self.search_params(sel)
+        )
+        return self.rerank(q_vecs, candidates, k)
+
+    def rerank(self, q_vecs, candidates, k):
+        # Reorder approximate candidates by exact distance; missing results
+        # are padded the way FAISS pads them
+        distances = np.full((len(q_vecs), k), np.finfo("float32").max)
+        indices = np.full((len(q_vecs), k), -1, dtype="int64")
+        for pos, (q_vec, ids) in enumerate(zip(q_vecs, candidates)):
+            ids = ids[ids >= 0]
+            if not len(ids):
+                continue
+            exact = self.row_distances(q_vec, ids)
+            order = np.argsort(exact, kind="stable")[:k]
+            distances[pos, : len(order)] = exact[order]
+            indices[pos, : len(order)] = ids[order]
+        return distances.astype("float32"), indices
+
+    def lexical_search(self, questions, top_n, rows=None):
+        # BM25 runs on a worker thread while FAISS searches
+        if self.lexical_pool is None:
+            self.lexical_pool = ThreadPoolExecutor(max_workers=1)
+
+        def run():
+            with telemetry.span("bm25", input_size=len(questions)):
+                return [
+                    self.lexical.search(question, top_n, rows)[0]
+                    for question in questions
+                ]
+
+        return self.lexical_pool.submit(contextvars.copy_context().run, run)
+
+    def row_distances(self, q_vec, rows):
+        # Squared L2 distance from the stored vectors, for rows that only
+        # the lexical ranking returned
+        vectors = []
+        for row in rows:
+            book = self.chunks.book_names[self.chunks.books[row]]
+            vectors.append(self.book_vectors[book][row - self.books[book][0]])
+        diff = np.stack(vectors) - self.prepare(q_vec).reshape(-1)
+        return (diff * diff).sum(axis=1)
+
+    def fuse(self, q_vec, distances, indices, lexical_rows, top_k):
+        dense_rows = [int(idx) for idx in indices if idx >= 0]
+        rows = reciprocal_rank_fusion([dense_rows, lexical_rows], self.rrf_k)
+        rows = rows[:top_k]
+        known = dict(zip(dense_rows, distances.tolist()))
+        missing = [row for row in rows if row not in known]
+        if missing:
+            known.update(zip(missing, self.row_distances(q_vec, missing)))
+        return [known[row] for row in rows], rows
+
+    def results(self, distances, indices):
         results = []
-        for dist, idx in zip(distances[0], indices[0]):
-            real_idx = filtered_indices[idx]
+        scores = self.scores(distances)
+        for dist, score, idx in zip(distances, scores, indices):
+            if idx < 0:
+                continue
+            if self.min_score is not None and score < self.min_score:
+                continue
+            meta = self.chunks.record(idx)
             results.append(
                 {
-                    "chunk_text": self.texts[real_idx],
-                    "chapter": self.metadata[real_idx]["chapter"],
-                    "page": self.metadata[real_idx]["page"],
-                    "book": self.metadata[real_idx]["book"],
+                    "chunk_text": self.chunks.text(idx),
+                    "chapter": meta["chapter"],
+                    "page": meta["page"],
+                    "book": meta["book"],
                     "distance": float(dist),
+                    "score": float(score),
+                    "row": int(idx),
                 }
             )
         return results
 
-    def list_chapters(self):
-        return sorted(set(meta["chapter"] for meta in self.metadata))
+    @traced("query")
+    def query(
+        self,
+        question,
+        top_k=5,
+        chapter_keywords=None,
+        books=None,
+        q_vec=None,
+        exclude_rows=None,
+        level=None,
+    ):
+        rows = self.filter_rows(chapter_keywords, books, level)
+        if exclude_rows is not None and len(exclude_rows):
+            # Rows a previous round already returned, so top_k are all new
+            if rows is None:
+                rows = np.flatnonzero(self.alive)
+            rows = np.setdiff1d(rows, exclude_rows, assume_unique=True)
+        if self.index is None or (rows is not None and len(rows) == 0):
+            return []
+
+        if q_vec is None:
+            with telemetry.span("embed", input_size=1):
+                q_vec = self.embedder.encode([question])
+        if not self.hybrid:
+            distances, indices = self.search(q_vec, top_k, rows)
+            results = self.results(distances[0], indices[0])
+            telemetry.current().set(output_size=len(results))
+            return results
+
+        n_candidates = top_k * self.candidates
+        lexical = self.lexical_search([question], n_candidates, rows)
+        distances, indices = self.search(q_vec, n_candidates, rows)
+        lexical_rows = lexical.result()[0]
+        results = self.results(
+            *self.fuse(q_vec, distances[0], indices[0], lexical_rows, top_k)
+        )
+        telemetry.current().set(output_size=len(results))
+        return results
+
+    @traced("query_batch")
+    def query_batch(
+        self,
+        questions,
+        top_k=5,
+        chapter_keywords=None,
+        books=None,
+        q_vecs=None,
+        level=None,
+    ):
+        # One encode call for every question, and one FAISS search per
+        # distinct chapter filter rather than per question
+        if q_vecs is None:
+            with telemetry.span("embed", input_size=len(questions)):
+                q_vecs = self.embedder.encode(questions)
+        q_vecs = np.asarray(q_vecs, dtype="float32")
+        if chapter_keywords is None:
+            chapter_keywords = [None] * len(questions)
+
+        groups = {}
+        for pos, keywords in enumerate(chapter_keywords):
+            groups.setdefault(tuple(keywords or ()), []).append(pos)
+
+        results = [[] for _ in questions]
+        for keywords, positions in groups.items():
+            rows = self.filter_rows(list(keywords), books, level)
+            if self.index is None or (rows is not None and len(rows) == 0):
+                continue
+            if not self.hybrid:
+                distances, indices = self.search(q_vecs[positions], top_k, rows)
+                for pos, dists, ids in zip(positions, distances, indices):
+                    results[pos] = self.results(dists, ids)
+                continue
+
+            n_candidates = top_k * self.candidates
+            lexical = self.lexical_search(
+                [questions[pos] for pos in positions], n_candidates, rows
+            )
+            distances, indices = self.search(
+                q_vecs[positions], n_candidates, rows
+            )
+            for pos, dists, ids, lexical_rows in zip(
+                positions, distances, indices, lexical.result()
+            ):
+                results[pos] = self.results(
+                    *self.fuse(q_vecs[pos], dists, ids, lexical_rows, top_k)
+                )
+        return results
+
+    def has_match(self, q_vecs, books=None):
+        # Whether any chunk in scope passes the similarity floor, per
+        # question; the best dense match is the most similar chunk there is
+        q_vecs = np.asarray(q_vecs, dtype="float32").reshape(len(q_vecs), -1)
+        rows = self.filter_rows(None, books)
+        if self.index is None or (rows is not None and len(rows) == 0):
+            return np.zeros(len(q_vecs), dtype=bool)
+        if self.min_score is None:
+            return np.ones(len(q_vecs), dtype=bool)
+        distances, indices = self.search(q_vecs, 1, rows)
+        if not indices.size:
+            return np.zeros(len(q_vecs), dtype=bool)
+        return (indices[:, 0] >= 0) & (
+            self.scores(distances[:, 0]) >= self.min_score
+        )
+
+    def route_chapters(self, q_vec, top_n=3, books=None):
+        if not self.chapter_centroids:
+            return []
+        if self.centroid_cache is None or self.centroid_cache[0] != self.version:
+            keys = list(self.chapter_centroids)
+            matrix = np.stack([self.chapter_centroids[key] for key in keys])
+            self.centroid_cache = (self.version, keys, matrix)
+        _, keys, matrix = self.centroid_cache
+
+        q_vec = np.asarray(q_vec, dtype="float32").reshape(-1)
+        scores = matrix @ (q_vec / (np.linalg.norm(q_vec) or 1.0))
+        scope = self.books if books is None else set(books)
+
+        routed = []
+        for pos in np.argsort(-scores):
+            book, chapter_id = keys[pos]
+            if book not in scope:
+                continue
+            routed.append((self.chapter_label(chapter_id), float(scores[pos])))
+            if len(routed) == top_n:
+                break
+        return routed
+
+    def list_chapters(self, books=None, level=None):
+        scope = self.books if books is None else set(books)
+        return sorted(
+            self.chapter_label(chapter_id)
+            for chapter_id, book_runs in self.chapter_rows.items()
+            if any(book in scope for book in book_runs)
+            and (level is None or self.chapter_levels[chapter_id] == level)
+        )
+
+    def list_books(self):
+        return sorted(self.books)
@@ -0,0 +1,464 @@
+"""Tests for TextbookAgent."""
+
+import asyncio
+import json
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+os.environ.setdefault("OPENAI_API_KEY", "test-key")
+
+import src.autonomous_ta.agent as agent_module
+from src.autonomous_ta.agent import (
+    AsyncTextbookAgent,
+    TextbookAgent,
+    VerdictSplitter,
+)
+from src.autonomous_ta.cache import SemanticCache
+from src.autonomous_ta.vector_db import VectorDB
+
+
+class FakeEmbedder:
+    """Maps questions to fixed vectors so paraphrases share a direction."""
+
+    vectors = {
+        "What is the mean?": [1.0, 0.0],
+        "Explain the average of a dataset.": [0.98, 0.05],
+        "What is a histogram?": [0.0, 1.0],
+    }
+
+    def encode(self, texts):
+        return np.array(
+            [self.vectors.get(text, [0.5, 0.5]) for text in texts], dtype="float32"
+        )
+
+
+class FakeDB:
+    """Minimal stand-in for VectorDB with a single chapter."""
+
+    def __init__(self):
+        self.embedder = FakeEmbedder()
+        self.version = 1
+        self.routes = []
+        self.min_score = None
+
+    def list_chapters(self, books=None):
+        return ["1.1 Descriptive Statistics"]
+
+    def route_chapters(self, q_vec, top_n=3, books=None):
+        return self.routes[:top_n]
+
+    def query(
+        self,
+        question,
+        top_k=5,
+        chapter_keywords=None,
+        books=None,
+        q_vec=None,
+        exclude_rows=None,
+    ):
+        return [
+            {
+                "chunk_text": "The mean is the average of the data.",
+                "chapter": "1.1 Descriptive Statistics",
+                "page": 12,
+                "book": "stats.pdf.jsonl",
+                "distance": 0.5,
+            }
+        ]
+
+
+class FakeCompletions:
+    """Records chat completion requests and answers by prompt type."""
+
+    def __init__(self):
+        self.calls = []
+
+    def create(self, model, messages, stream=False, **params):
+        self.calls.append(messages[0]["content"])
+        content = fake_reply(messages[0]["content"])
+        if stream:
+            return fake_events(content)
+        return SimpleNamespace(
+            choices=[SimpleNamespace(message=SimpleNamespace(content=content))]
+        )
+
+
+def fake_events(content, size=4):
+    """Split a reply into streamed chat completion chunks."""
+    return [
+        SimpleNamespace(
+            choices=[SimpleNamespace(delta=SimpleNamespace(content=content[pos:pos + size]))]
+        )
+        for pos in range(0, len(content), size)
+    ]
+
+
+@pytest.fixture
+def fake_client(monkeypatch):
+    """Replace the OpenAI client with a recording fake."""
+    completions = FakeCompletions()
+    client = SimpleNamespace(chat=SimpleNamespace(completions=completions))
+    monkeypatch.setattr(agent_module, "client", client)
+    return completions
+
+
+def test_repeated_question_is_served_from_cache(fake_client):
+    """Test that asking the same question twice makes no new API calls."""
+    agent = TextbookAgent(db=FakeDB())
+
+    first = agent.answer_question("What is the mean?")
+    assert len(fake_client.calls) == 3
+
+    second = agent.answer_question("What is the mean?")
+    assert second == first
+    assert len(fake_client.calls) == 3
+    assert agent.cache_stats()["hits"] == 3
+
+
+def test_cache_can_be_disabled(fake_client):
+    """Test that cache=False always calls the API."""
+    agent = TextbookAgent(db=FakeDB(), cache=False)
+
+    agent.answer_question("What is the mean?")
+    agent.answer_question("What is the mean?")
+
+    assert len(fake_client.calls) == 6
+    assert agent.cache_stats() is None
+
+
+def test_semantic_cache_answers_paraphrases(fake_client):
+    """Test that a paraphrased question skips every LLM call."""
+    db = FakeDB()
+    agent = TextbookAgent(db=db, cache=False, semantic_cache=SemanticCache(0.95))
+
+    answer, chunks = agent.answer_question("What is the mean?")
+    assert len(fake_client.calls) == 3
+
+    assert agent.answer_question("Explain the average of a dataset.") == (answer, chunks)
+    assert len(fake_client.calls) == 3
+
+    agent.answer_question("What is a histogram?")
+    assert len(fake_client.calls) == 6
+
+    db.version += 1
+    agent.answer_question("Explain the average of a dataset.")
+    assert len(fake_client.calls) == 9
+
+
+def test_confident_router_skips_chapter_selection_call(fake_client):
+    """Test that the LLM only picks chapters when the router is unsure."""
+    db = FakeDB()
+    agent = TextbookAgent(db=db, cache=False, router_threshold=0.5)
+
+    db.routes = [("1.1 Descriptive Statistics", 0.8), ("2.1 Probability", 0.3)]
+    agent.answer_question("What is the mean?")
+    assert len(fake_client.calls) == 2
+    assert not any("JSON array of chapter titles" in call for call in fake_client.calls)
+
+    db.routes = [("1.1 Descriptive Statistics", 0.3)]
+    agent.answer_question("What is a histogram?")
+    assert len(fake_client.calls) == 5
+
+
+def test_similarity_floor_turns_away_off_topic_questions(fake_client):
+    """Test that a question no chunk is similar enough to makes no LLM call."""
+    db = VectorDB(min_score=0.5)
+    db.embedder = FakeEmbedder()
+    db.set_corpus(
+        ["The mean is the average of the data."],
+        [{"chapter": "1.1 Descriptive Statistics", "page": 12, "book": "stats.pdf.jsonl"}],
+        np.array([[1.0, 0.1]], dtype="float32"),
+    )
+    agent = TextbookAgent(db=db, cache=False)
+
+    assert agent.answer_question("What is a histogram?") == ("", "")
+    stream = agent.stream_answer("What is a histogram?")
+    assert list(stream) == []
+    assert stream.verdict == "NO"
+    assert fake_client.calls == []
+
+    answer, chunks = agent.answer_question("What is the mean?")
+    assert answer == "The mean is the average."
+    assert chunks[0]["score"] > 0.9
+    assert len(fake_client.calls) == 2
+
+
+def test_stream_answer_folds_verdict_into_synthesis(fake_client):
+    """Test that streaming yields the answer without the verdict line or an evaluation call."""
+    db = FakeDB()
+    db.routes = [("1.1 Descriptive Statistics", 0.8)]
+    agent = TextbookAgent(db=db, cache=False)
+
+    stream = agent.stream_answer("What is the mean?")
+    pieces = list(stream)
+
+    assert len(pieces) > 1
+    assert "".join(pieces).strip() == "The mean is the average."
+    assert stream.answer == "The mean is the average."
+    assert stream.verdict == "YES"
+    assert stream.chunks[0]["page"] == 12
+    assert len(fake_client.calls) == 1
+
+
+def test_verdict_splitter_handles_marker_across_pieces():
+    """Test that a verdict split over several pieces is never emitted as answer text."""
+    splitter = VerdictSplitter()
+    out = [splitter.feed(piece) for piece in ["Yes, VER", "y much.\nVERD", "ICT", ": N", "O"]]
+    out.append(splitter.close())
+
+    assert "".join(out) == "Yes, VERy much.\n"
+    assert splitter.answer == "Yes, VERy much."
+    assert splitter.verdict == "NO"
+
+    splitter = VerdictSplitter()
+    splitter.feed("No verdict here")
+    splitter.close()
+    assert splitter.answer == "No verdict here"
+    assert splitter.verdict == ""
+
+
+def test_async_stream_answer(fake_client):
+    """Test that the async agent streams through an async iterator."""
+
+    class AsyncEvents:
+        def __init__(self, events):
+            self.events = iter(events)
+
+        def __aiter__(self):
+            return self
+
+        async def __anext__(self):
+            try:
+                return next(self.events)
+            except StopIteration:
+                raise StopAsyncIteration
+
+    async def create(**kwargs):
+        response = fake_client.create(**kwargs)
+        return AsyncEvents(response) if kwargs.get("stream") else response
+
+    client = SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=create)))
+
+    async def run():
+        agent = AsyncTextbookAgent(db=FakeDB(), cache=False, client=client)
+        stream = agent.stream_answer("What is the mean?")
+        return [piece async for piece in stream], stream
+
+    pieces, stream = asyncio.run(run())
+
+    assert "".join(pieces).strip() == "The mean is the average."
+    assert stream.verdict == "YES"
+    assert len(fake_client.calls) == 2
+
+
+class TwoChapterDB(FakeDB):
+    """Two chapters, only the second of which covers the question."""
+
+    texts = {
+        "1.1 Descriptive Statistics": "The mean is the average of the data.",
+        "1.2 Variance": "The variance measures the spread of the data.",
+    }
+
+    def __init__(self):
+        super().__init__()
+        self.routes = [("1.1 Descriptive Statistics", 0.8), ("1.2 Variance", 0.6)]
+        self.queries = []
+
+    def list_chapters(self, books=None):
+        return list(self.texts)
+
+    def query(
+        self,
+        question,
+        top_k=5,
+        chapter_keywords=None,
+        books=None,
+        q_vec=None,
+        exclude_rows=None,
+    ):
+        self.queries.append((chapter_keywords, exclude_rows, q_vec))
+        return [
+            {
+                "chunk_text": self.texts[chapter],
+                "chapter": chapter,
+                "page": row + 1,
+                "book": "stats.pdf.jsonl",
+                "distance": 0.5,
+                "row": row,
+            }
+            for row, chapter in enumerate(self.texts)
+            if chapter in chapter_keywords and row not in (exclude_rows or ())
+        ]
+
+
+class SpreadCompletions(FakeCompletions):
+    """Judges an answer complete only once it mentions spread."""
+
+    def create(self, model, messages, **params):
+        prompt = messages[0]["content"]
+        self.calls.append(prompt)
+        if "ONLY ONE WORD" in prompt:
+            content = "YES" if "spread" in prompt else "NO"
+        elif "spread" in prompt:
+            content = "Variance measures spread."
+        else:
+            content = "The mean is the average."
+        return SimpleNamespace(
+            choices=[SimpleNamespace(message=SimpleNamespace(content=content))]
+        )
+
+
+def test_rounds_consult_new_chapters_until_complete(monkeypatch):
+    """Test that an incomplete answer triggers a round on an unconsulted chapter."""
+    completions = SpreadCompletions()
+    monkeypatch.setattr(
+        agent_module, "client", SimpleNamespace(chat=SimpleNamespace(completions=completions))
+    )
+    db = TwoChapterDB()
+    agent = TextbookAgent(db=db, cache=False, router_top_n=1, max_rounds=3)
+
+    answer, chunks = agent.answer_question("What is the variance?")
+
+    assert answer == "Variance measures spread."
+    assert [chunk["row"] for chunk in chunks] == [0, 1]
+    assert [query[0] for query in db.queries] == [["1.1 Descriptive Statistics"], ["1.2 Variance"]]
+    assert db.queries[1][1] == [0]
+    assert db.queries[0][2] is db.queries[1][2]
+    assert [stats["new_chunks"] for stats in agent.last_rounds] == [1, 1]
+    assert len(completions.calls) == 4
+
+
+def test_rounds_stop_at_budget(monkeypatch):
+    """Test that no further round starts once the token budget is spent."""
+    completions = SpreadCompletions()
+    monkeypatch.setattr(
+        agent_module, "client", SimpleNamespace(chat=SimpleNamespace(completions=completions))
+    )
+    agent = TextbookAgent(
+        db=TwoChapterDB(), cache=False, router_top_n=1, max_rounds=3, token_budget=5
+    )
+
+    assert agent.answer_question("What is the variance?") == ("", "")
+    assert len(agent.last_rounds) == 1
+    assert agent.last_rounds[0]["tokens"] >= 5
+    assert len(completions.calls) == 2
+
+
+def test_round_tokens_count_the_assembled_context(monkeypatch):
+    """Test that round tokens count the context actually sent, not the raw chunks."""
+    from src.autonomous_ta.agent import format_context
+    from src.autonomous_ta.context import ContextBuilder
+    from src.autonomous_ta.tokens import count_tokens
+
+    monkeypatch.setattr(
+        agent_module,
+        "client",
+        SimpleNamespace(chat=SimpleNamespace(completions=SpreadCompletions())),
+    )
+    db = TwoChapterDB()
+    db.routes = [("1.2 Variance", 0.8)]
+    agent = TextbookAgent(db=db, cache=False, router_top_n=1)
+
+    answer, chunks = agent.answer_question("What is the variance?")
+
+    blocks, _ = ContextBuilder().assemble("What is the variance?", chunks)
+    assert agent.last_rounds[0]["tokens"] == (
+        count_tokens(format_context(blocks)) + count_tokens(answer)
+    )
+
+    # A chunk that does not fit the context budget is never sent
+    agent = TextbookAgent(
+        db=db, cache=False, router_top_n=1, context=ContextBuilder(max_tokens=3)
+    )
+    assert agent.answer_question("What is the variance?") == ("", "")
+    assert agent.last_rounds[0]["tokens"] == count_tokens("The mean is the average.")
+
+
+def fake_reply(prompt):
+    """Answer a prompt the way the fake client does."""
+    if "JSON array of chapter titles" in prompt:
+        return '["1.1 Descriptive Statistics"]'
+    if "ONLY ONE WORD" in prompt:
+        return "YES"
+    if "VERDICT: YES" in prompt:
+        return "The mean is the average.\nVERDICT: YES"
+    return "The mean is the average."
+
+
+@pytest.fixture
+def mock_server():
+    """Serve a local chat-completions endpoint that tracks concurrency."""
+    state = {"requests": 0, "active": 0, "peak": 0}
+    lock = threading.Lock()
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+            with lock:
+                state["requests"] += 1
+                state["active"] += 1
+                state["peak"] = max(state["peak"], state["active"])
+            time.sleep(0.02)
+            with lock:
+                state["active"] -= 1
+            payload = json.dumps(
+                {
+                    "id": "chatcmpl-test",
+                    "object": "chat.completion",
+                    "created": 0,
+                    "model": body["model"],
+                    "choices": [
+                        {
+                            "index": 0,
+                            "message": {
+                                "role": "assistant",
+                                "content": fake_reply(body["messages"][0]["content"]),
+                            },
+                            "finish_reason": "stop",
+                        }
+                    ],
+                }
+            ).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    state["url"] = f"http://127.0.0.1:{server.server_address[1]}/v1"
+    yield state
+    server.shutdown()
+    server.server_close()
+
+
+def test_async_agent_answers_concurrently(mock_server):
+    """Test that concurrent questions share one client within the concurrency bound."""
+
+    async def run():
+        agent = AsyncTextbookAgent(
+            db=FakeDB(), cache=False, max_concurrency=4, base_url=mock_server["url"]
+        )
+        try:
+            questions = [f"What is the mean? ({i})" for i in range(12)]
+            return await agent.answer_questions(questions)
+        finally:
+            await agent.close()
+
+    answers = asyncio.run(run())
+
+    assert all(answer == "The mean is the average." for answer, _ in answers)
+    assert all(chunks[0]["page"] == 12 for _, chunks in answers)
+    assert mock_server["requests"] == 36
+    assert 1 < mock_server["peak"] <= 4
@@ -0,0 +1,228 @@
+"""Tests for batch question answering."""
+
+import asyncio
+import json
+
+import numpy as np
+
+from src.autonomous_ta.batch import completed_ids, read_questions, run_batch
+
+
+class FakeEmbedder:
+    """Counts encode calls and returns one vector per text."""
+
+    def __init__(self):
+        self.calls = []
+
+    def encode(self, texts):
+        self.calls.append(list(texts))
+        return np.zeros((len(texts), 2), dtype="float32")
+
+
+class FakeDB:
+    """Records batched queries."""
+
+    def __init__(self):
+        self.embedder = FakeEmbedder()
+        self.batches = []
+
+    def list_chapters(self, books=None):
+        return ["1.1 Mean"]
+
+    def query_batch(self, questions, top_k=5, chapter_keywords=None, books=None, q_vecs=None):
+        self.batches.append(list(questions))
+        return [
+            [{"chunk_text": q, "chapter": "1.1 Mean", "page": 1, "book": "b.pdf.jsonl"}]
+            for q in questions
+        ]
+
+
+class FakeAgent:
+    """Async agent stand-in that can fail or go off topic on chosen questions."""
+
+    def __init__(self, fail_on=None, fail_choosing=None, off_topic=()):
+        self.db = FakeDB()
+        self.fail_on = fail_on
+        self.fail_choosing = fail_choosing
+        self.off_topic = off_topic
+        self.synthesized = []
+        self.questions = []
+
+    async def run_blocking(self, func, *args, **kwargs):
+        return func(*args, **kwargs)
+
+    def off_topic_batch(self, q_vecs, books=None):
+        # Questions are embedded in window order
+        questions = self.db.embedder.calls[-1]
+        return [question in self.off_topic for question in questions]
+
+    def route_chapters(self, q_vec, books=None):
+        return None
+
+    async def choose_chapters(self, question, available_chapters):
+        if question == self.fail_choosing:
+            raise ValueError("Could not parse response as JSON: sorry")
+        return ["1.1 Mean"]
+
+    async def synthesize_answer(self, question, chunks):
+        if question == self.fail_on:
+            raise RuntimeError("API unavailable")
+        self.synthesized.append(question)
+        return f"Answer to {question}"
+
+    async def evaluate_answer(self, question, answer):
+        return "YES"
+
+
+def test_read_questions_jsonl_and_csv(tmp_path):
+    """Test reading question banks in both supported formats."""
+    jsonl = tmp_path / "bank.jsonl"
+    jsonl.write_text('{"id": "q1", "question": "What is a mean?"}\n"What is a mode?"\n')
+    csv_file = tmp_path / "bank.csv"
+    csv_file.write_text("id,question\na,What is a median?\n,What is a range?\n")
+
+    assert read_questions(jsonl) == [
+        {"id": "q1", "question": "What is a mean?"},
+        {"id": "2", "question": "What is a mode?"},
+    ]
+    assert read_questions(csv_file) == [
+        {"id": "a", "question": "What is a median?"},
+        {"id": "2", "question": "What is a range?"},
+    ]
+
+
+def test_run_batch_embeds_and_searches_once_per_window(tmp_path):
+    """Test that a window of questions shares one encode call and one search."""
+    bank = tmp_path / "bank.jsonl"
+    bank.write_text("".join(json.dumps(f"Question {i}") + "\n" for i in range(5)))
+    output = tmp_path / "answers.jsonl"
+    agent = FakeAgent()
+
+    count = asyncio.run(run_batch(agent, bank, output, window=5))
+
+    assert count == 5
+    assert len(agent.db.embedder.calls) == 1
+    assert len(agent.db.batches) == 1
+    records = [json.loads(line) for line in output.read_text().splitlines()]
+    assert sorted(record["id"] for record in records) == ["1", "2", "3", "4", "5"]
+    assert all(record["answer"].startswith("Answer to") for record in records)
+
+
+def test_run_batch_records_failures_and_finishes(tmp_path):
+    """Test that a failing question gets an error record and the rest complete."""
+    bank = tmp_path / "bank.jsonl"
+    bank.write_text("".join(json.dumps(f"Question {i}") + "\n" for i in range(4)))
+    output = tmp_path / "answers.jsonl"
+    agent = FakeAgent(fail_on="Question 2", fail_choosing="Question 1")
+
+    count = asyncio.run(run_batch(agent, bank, output, window=2))
+
+    assert count == 4
+    records = {
+        record["id"]: record
+        for record in map(json.loads, output.read_text().splitlines())
+    }
+    assert records["2"]["error"].startswith("ValueError: Could not parse")
+    assert records["3"]["error"] == "RuntimeError: API unavailable"
+    assert records["1"]["verdict"] == records["4"]["verdict"] == "YES"
+    assert sorted(agent.synthesized) == ["Question 0", "Question 3"]
+    assert [len(batch) for batch in agent.db.batches] == [1, 2]
+
+    # A rerun treats the recorded failures as done rather than retrying them
+    asyncio.run(run_batch(FakeAgent(), bank, output, window=2))
+    assert len(output.read_text().splitlines()) == 4
+
+
+def test_run_batch_resumes_after_interruption(tmp_path):
+    """Test that a rerun only answers the questions that were not written."""
+    bank = tmp_path / "bank.jsonl"
+    bank.write_text("".join(json.dumps(f"Question {i}") + "\n" for i in range(4)))
+    output = tmp_path / "answers.jsonl"
+    output.write_text(
+        '{"id": "2", "question": "Question 1", "answer": "", "verdict": "NO", "chunks": []}\n'
+        '{"id": "3", "quest'  # torn final line
+    )
+    done = completed_ids(output)
+    assert done == {"2"}
+
+    agent = FakeAgent()
+    asyncio.run(run_batch(agent, bank, output, window=2))
+
+    assert sorted(agent.synthesized) == ["Question 0", "Question 2", "Question 3"]
+    assert completed_ids(output) == {"1", "2", "3", "4"}
+
+
+def test_run_batch_skips_retrieval_for_off_topic_questions(tmp_path):
+    """Test that off-topic questions are neither searched nor answered."""
+    bank = tmp_path / "bank.jsonl"
+    bank.write_text("".join(json.dumps(f"Question {i}") + "\n" for i in range(3)))
+    output = tmp_path / "answers.jsonl"
+    agent = FakeAgent(off_topic={"Question 1"})
+
+    asyncio.run(run_batch(agent, bank, output))
+
+    assert agent.db.batches == [["Question 0", "Question 2"]]
+    records = {
+        record["id"]: record
+        for record in map(json.loads, output.read_text().splitlines())
+    }
+    assert records["2"]["chunks"] == [] and records["2"]["answer"] == ""
+    assert records["1"]["chunks"] and records["3"]["chunks"]
+
+    agent = FakeAgent(off_topic={"Question 0"})
+    asyncio.run(run_batch(agent, bank, tmp_path / "one.jsonl", window=1))
+    assert agent.db.batches == [["Question 1"], ["Question 2"]]
+
+
+def test_run_batch_makes_no_llm_calls_for_off_topic_questions(tmp_path):
+    """Test that questions below the similarity floor skip every LLM call."""
+    from types import SimpleNamespace
+
+    from src.autonomous_ta.agent import AsyncTextbookAgent
+    from src.autonomous_ta.vector_db import VectorDB
+
+    class TopicEmbedder:
+        def __init__(self):
+            self.calls = []
+
+        def encode(self, texts):
+            self.calls.append(list(texts))
+            return np.array(
+                [[1.0, 0.0] if "mean" in text else [0.0, 1.0] for text in texts],
+                dtype="float32",
+            )
+
+    prompts = []
+
+    async def create(model, messages, **params):
+        prompts.append(messages[0]["content"])
+        message = SimpleNamespace(content="YES")
+        return SimpleNamespace(choices=[SimpleNamespace(message=message)])
+
+    db = VectorDB(min_score=0.5)
+    db.embedder = TopicEmbedder()
+    db.set_corpus(
+        ["The mean is the average of the data."],
+        [{"chapter": "1.1 Mean", "page": 1, "book": "b.pdf.jsonl"}],
+        np.array([[1.0, 0.1]], dtype="float32"),
+    )
+    client = SimpleNamespace(
+        chat=SimpleNamespace(completions=SimpleNamespace(create=create))
+    )
+    agent = AsyncTextbookAgent(db=db, cache=False, client=client)
+    bank = tmp_path / "bank.jsonl"
+    questions = ["What is the mean?", "Who won the cup?", "Best pizza?"]
+    bank.write_text("".join(json.dumps(q) + "\n" for q in questions))
+    output = tmp_path / "answers.jsonl"
+
+    asyncio.run(run_batch(agent, bank, output))
+
+    records = {
+        record["question"]: record
+        for record in map(json.loads, output.read_text().splitlines())
+    }
+    assert records["What is the mean?"]["verdict"] == "YES"
+    assert records["Who won the cup?"]["answer"] == ""
+    assert records["Best pizza?"]["chunks"] == []
+    assert len(prompts) == 2
+    assert all("What is the mean?" in prompt for prompt in prompts)
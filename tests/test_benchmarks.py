@@ -0,0 +1,78 @@
+"""Tests for the benchmark suite and result comparison."""
+
+import json
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+from benchmarks import bench_suite
+
+ROOT = Path(__file__).resolve().parent.parent
+
+
+def compare(baseline, candidate):
+    return subprocess.run(
+        [sys.executable, "-m", "benchmarks.compare", baseline, candidate],
+        cwd=ROOT,
+        capture_output=True,
+        text=True,
+    )
+
+
+def test_suite_writes_results_and_compare_flags_regressions(
+    monkeypatch, tmp_path
+):
+    """Test a tiny suite run end to end, then compare it against a slower copy."""
+    output = tmp_path / "before.json"
+    data_dir = bench_suite.vector_db.DATA_DIR
+    monkeypatch.delenv("OPENAI_BASE_URL", raising=False)
+    monkeypatch.setenv("OPENAI_API_KEY", "test-key")
+    client = bench_suite.agent_module.client
+    argv = (
+        "bench_suite --sizes 40 --fake-embeddings --dim 16 --queries 5 "
+        "--e2e-questions 2 --chunk-pages 20 --output"
+    ).split()
+    monkeypatch.setattr(sys, "argv", [*argv, str(output)])
+    bench_suite.main()
+
+    results = json.loads(output.read_text())
+    size = results["sizes"][0]
+    assert bench_suite.vector_db.DATA_DIR == data_dir
+    assert bench_suite.agent_module.client is client
+    assert "OPENAI_BASE_URL" not in os.environ
+    assert os.environ["OPENAI_API_KEY"] == "test-key"
+    assert size["chunks"] == 40
+    assert size["llm_calls_per_answer"] == 3
+    assert results["environment"]["args"]["fake_embeddings"] is True
+
+    assert compare(output, output).returncode == 0
+
+    size["query_p99_ms"] *= 2
+    results["chunking"]["pages_per_s"] /= 2
+    slower = tmp_path / "after.json"
+    slower.write_text(json.dumps(results))
+    result = compare(output, slower)
+    assert result.returncode == 1
+    assert "2 regression(s)" in result.stdout
+
+
+def test_router_benchmark_times_the_llm_selector(monkeypatch, tmp_path, capsys):
+    """Test that bench_router --llm compares against the fake chat server."""
+    import src.autonomous_ta.agent as agent_module
+    from benchmarks import bench_router
+    from benchmarks.fake_llm import FakeChatServer
+
+    bench_suite.write_corpus(tmp_path, 40, 1, 300)
+    monkeypatch.setattr(bench_suite.vector_db, "DATA_DIR", tmp_path)
+    monkeypatch.setattr(agent_module, "client", None)
+    with FakeChatServer() as server:
+        monkeypatch.setenv("OPENAI_BASE_URL", server.url)
+        monkeypatch.setenv("OPENAI_API_KEY", "benchmark")
+        bench_router.main(["--llm", "--samples", "5"])
+        assert server.requests == 5
+    monkeypatch.setattr(agent_module, "client", None)
+
+    rows = capsys.readouterr().out.splitlines()
+    assert any(row.split()[0] == "llm" for row in rows if row.strip())
+    assert any(row.split()[0] == "router+llm" for row in rows if row.strip())
@@ -0,0 +1,61 @@
+"""Tests for the BM25 inverted index."""
+
+import numpy as np
+
+from src.autonomous_ta.bm25 import BM25Index, Postings, reciprocal_rank_fusion
+
+
+def make_index():
+    index = BM25Index()
+    index.add(
+        "a.pdf.jsonl",
+        0,
+        Postings.from_texts(
+            [
+                "The sample mean estimates the population mean.",
+                "Variance measures spread around the mean.",
+                "Chebyshev's inequality bounds tail probabilities.",
+            ]
+        ),
+    )
+    index.add(
+        "b.pdf.jsonl",
+        3,
+        Postings.from_texts(["Bayes theorem relates conditional probabilities."]),
+    )
+    return index
+
+
+def test_bm25_ranks_exact_terms():
+    """Test that rare query terms dominate and rows are global ids."""
+    index = make_index()
+
+    rows, scores = index.search("What does Chebyshev's inequality say?")
+    assert rows[0] == 2
+    assert np.all(np.diff(scores) <= 0)
+
+    rows, _ = index.search("mean")
+    assert rows.tolist() == [0, 1]
+
+    rows, _ = index.search("probabilities")
+    assert sorted(rows.tolist()) == [2, 3]
+    rows, _ = index.search("probabilities", rows=np.array([3]))
+    assert rows.tolist() == [3]
+
+
+def test_bm25_remove_book_updates_statistics():
+    """Test that dropping a book removes its rows and document frequencies."""
+    index = make_index()
+    index.remove("b.pdf.jsonl")
+
+    rows, _ = index.search("Bayes probabilities")
+    assert rows.tolist() == [2]
+    assert index.rows == 3
+    assert index.df[index.vocab["probabilities"]] == 1
+
+
+def test_reciprocal_rank_fusion():
+    """Test that rows ranked well in both lists come first."""
+    fused = reciprocal_rank_fusion([[1, 2, 3], [3, 1, 4]], k=60)
+    assert fused[:2] == [1, 3]
+    assert set(fused) == {1, 2, 3, 4}
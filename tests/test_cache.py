@@ -0,0 +1,103 @@
+"""Tests for the LLM response caches."""
+
+import numpy as np
+
+from src.autonomous_ta.cache import (
+    MemoryCache,
+    SemanticCache,
+    SQLiteCache,
+    cache_key,
+)
+
+
+def test_cache_key_depends_on_model_prompt_and_params():
+    """Test that keys are stable and change with any input."""
+    messages = [{"role": "user", "content": "What is a p-value?"}]
+    key = cache_key("gpt-4o-mini", messages, temperature=0)
+
+    assert key == cache_key("gpt-4o-mini", messages, temperature=0)
+    assert key != cache_key("gpt-4o", messages, temperature=0)
+    assert key != cache_key("gpt-4o-mini", messages, temperature=1)
+    assert key != cache_key(
+        "gpt-4o-mini", [{"role": "user", "content": "What is a z-score?"}], temperature=0
+    )
+
+
+def test_memory_cache_evicts_least_recently_used():
+    """Test LRU eviction and hit/miss counters."""
+    cache = MemoryCache(max_size=2)
+    cache.set("a", "1")
+    cache.set("b", "2")
+    assert cache.get("a") == "1"
+    cache.set("c", "3")
+
+    assert cache.get("b") is None
+    assert cache.get("a") == "1"
+    assert cache.get("c") == "3"
+    assert cache.stats() == {"hits": 3, "misses": 1, "hit_rate": 0.75, "size": 2}
+
+
+def test_memory_cache_ttl(monkeypatch):
+    """Test that entries expire after the TTL."""
+    import src.autonomous_ta.cache as cache_module
+
+    now = [1000.0]
+    monkeypatch.setattr(cache_module.time, "time", lambda: now[0])
+    cache = MemoryCache(ttl=60)
+    cache.set("a", "1")
+
+    now[0] += 30
+    assert cache.get("a") == "1"
+    now[0] += 31
+    assert cache.get("a") is None
+    assert len(cache) == 0
+
+
+def test_sqlite_cache_persists_and_evicts(tmp_path):
+    """Test that the SQLite cache survives reopening and bounds its size."""
+    path = tmp_path / "responses.sqlite"
+    cache = SQLiteCache(path, max_size=2)
+    cache.set("a", "answer a")
+    cache.set("b", "answer b")
+    cache.close()
+
+    cache = SQLiteCache(path, max_size=2)
+    assert cache.get("a") == "answer a"
+    cache.set("c", "answer c")
+
+    assert len(cache) == 2
+    assert cache.get("b") is None
+    assert cache.get("c") == "answer c"
+    cache.close()
+
+
+def test_semantic_cache_matches_similar_questions():
+    """Test that near-duplicate questions hit and dissimilar ones miss."""
+    cache = SemanticCache(threshold=0.9)
+    chunks = [{"chunk_text": "CLT", "chapter": "7.1", "page": 3, "book": "b"}]
+    cache.add(np.array([[1.0, 0.0, 0.0]]), "What is the CLT?", "Answer", chunks, "v1")
+
+    assert cache.lookup(np.array([[0.95, 0.1, 0.0]]), "v1") == ("Answer", chunks)
+    assert cache.lookup(np.array([[0.0, 1.0, 0.0]]), "v1") is None
+    assert cache.stats()["hits"] == 1
+    assert cache.stats()["misses"] == 1
+
+
+def test_semantic_cache_respects_scope():
+    """Test that answers are not reused after the index changed."""
+    cache = SemanticCache(threshold=0.9)
+    cache.add(np.array([[1.0, 0.0]]), "q", "old answer", [], (1, 5, ()))
+
+    assert cache.lookup(np.array([[1.0, 0.0]]), (2, 5, ())) is None
+    assert cache.lookup(np.array([[1.0, 0.0]]), (1, 5, ())) == ("old answer", [])
+
+
+def test_semantic_cache_bounded_size():
+    """Test that the oldest entries are dropped beyond max_size."""
+    cache = SemanticCache(threshold=0.99, max_size=2)
+    for i, vec in enumerate([[1.0, 0.0, 0.0], [0.0, 1.0, 0.0], [0.0, 0.0, 1.0]]):
+        cache.add(np.array([vec]), f"q{i}", f"a{i}", [], "v")
+
+    assert cache.stats()["size"] == 2
+    assert cache.lookup(np.array([[1.0, 0.0, 0.0]]), "v") is None
+    assert cache.lookup(np.array([[0.0, 0.0, 1.0]]), "v") == ("a2", [])
@@ -0,0 +1,75 @@
+"""Tests for context assembly."""
+
+from src.autonomous_ta.context import ContextBuilder
+
+
+def chunk(text, page, chapter="1.1 Mean", book="stats.pdf.jsonl", row=0):
+    return {
+        "chunk_text": text,
+        "chapter": chapter,
+        "page": page,
+        "book": book,
+        "row": row,
+    }
+
+
+class ReverseReranker:
+    """Scores later chunks higher."""
+
+    def predict(self, pairs):
+        return list(range(len(pairs)))
+
+
+def test_assemble_dedupes_and_merges_adjacent_pages():
+    """Test that duplicates are dropped and adjacent pages share one block."""
+    overlap = "the mean is sensitive to outliers in the data set"
+    chunks = [
+        chunk(f"The mean is the sum divided by the count and {overlap}", 12),
+        chunk(f"{overlap} so the median is often preferred", 13),
+        chunk(f"The mean is the sum divided by the count and {overlap}", 40, book="other.pdf.jsonl"),
+        chunk("Histograms show the distribution of a variable", 30, chapter="2.1 Graphs"),
+    ]
+
+    blocks, report = ContextBuilder().assemble("What is the mean?", chunks)
+
+    assert [block["page"] for block in blocks] == ["12-13", 30]
+    assert blocks[0]["chunk_text"].count(overlap) == 1
+    assert blocks[0]["chunk_text"].endswith("so the median is often preferred")
+    assert report["chunks_in"] == 4
+    assert report["blocks_out"] == 2
+    assert report["tokens_saved"] > 0
+
+
+def test_assemble_packs_to_budget_in_rank_order():
+    """Test that the budget keeps the best-ranked chunks that fit."""
+    chunks = [
+        chunk("alpha " * 8, 1),
+        chunk("beta " * 8, 5),
+        chunk("gamma " * 3, 9),
+    ]
+
+    builder = ContextBuilder(max_tokens=12)
+    blocks, report = builder.assemble("question", chunks)
+    assert [block["page"] for block in blocks] == [1, 9]
+    assert report["tokens_out"] == 11
+
+    builder = ContextBuilder(max_tokens=12, reranker=ReverseReranker())
+    blocks, _ = builder.assemble("question", chunks)
+    assert [block["page"] for block in blocks] == [9, 5]
+    assert builder.stats()["requests"] == 1
+
+
+def test_merge_keeps_reading_order_within_a_page():
+    """Test that chunks of one page are joined by row, not by rank."""
+    chunks = [
+        chunk("Part two: the median splits the data in half", 7, row=4),
+        chunk("Part one: the mean averages every value", 7, row=3),
+    ]
+
+    blocks, _ = ContextBuilder().assemble("What is the median?", chunks)
+
+    assert len(blocks) == 1
+    assert blocks[0]["chunk_text"] == (
+        "Part one: the mean averages every value\n"
+        "Part two: the median splits the data in half"
+    )
@@ -0,0 +1,36 @@
+"""Tests for import time and import side effects."""
+
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+from benchmarks.bench_import import HEAVY, import_times
+
+# Generous for slow CI machines; eager openai/torch imports take seconds
+IMPORT_BUDGET_MS = 1000
+ROOT = Path(__file__).resolve().parent.parent
+
+
+def test_agent_import_fits_budget():
+    """Test that importing the agent loads no heavy dependency and stays within budget."""
+    rows = min(
+        (import_times("src.autonomous_ta.agent") for _ in range(3)),
+        key=lambda rows: rows[-1][2],
+    )
+
+    assert not [name for name, _, _ in rows if name in HEAVY]
+    assert rows[-1][2] / 1000 < IMPORT_BUDGET_MS
+
+
+def test_load_data_import_creates_no_directories(tmp_path):
+    """Test that importing load_data does not create data/raw/."""
+    env = dict(os.environ, PYTHONPATH=str(ROOT))
+    subprocess.run(
+        [sys.executable, "-c", "import src.autonomous_ta.load_data"],
+        cwd=tmp_path,
+        env=env,
+        check=True,
+    )
+
+    assert not (tmp_path / "data").exists()
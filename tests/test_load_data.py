@@ -7,7 +7,15 @@ from pathlib import Path
 import pytest
 from unittest.mock import MagicMock, patch
 
-from src.autonomous_ta.load_data import chunk_text, get_toc, load_pdf
+from src.autonomous_ta.load_data import (
+    chunk_text,
+    count_tokens,
+    get_toc,
+    iter_chunks,
+    load_pdf,
+    parse_book,
+    write_chunks,
+)
 
 
 def test_chunk_text():
@@ -59,3 +67,102 @@ def test_chunk_text_with_empty_pages():
     chunks = chunk_text(pages, toc)
     # Should handle empty pages gracefully
     assert isinstance(chunks, list)
+
+
+def test_iter_chunks_streams_pages():
+    """Test that chunking consumes pages lazily from a generator."""
+    consumed = []
+
+    def pages():
+        for page_num in range(1, 4):
+            consumed.append(page_num)
+            yield {"page_num": page_num, "text": f"Paragraph on page {page_num}. " * 10}
+
+    toc = [{"level": 1, "title": "Chapter 1", "page_num": 1}]
+    chunks = iter_chunks(pages(), toc, max_tokens=20)
+
+    first = next(chunks)
+    assert consumed == [1]
+    assert first["chunk_text"].startswith("Paragraph on page 1.")
+    rest = list(chunks)
+    assert consumed == [1, 2, 3]
+    assert [chunk["page_start"] for chunk in rest] == [1, 1, 2, 2, 3, 3, 3]
+    assert rest[1]["page_end"] == 2
+    assert all(chunk["token_count"] <= 20 for chunk in [first] + rest)
+
+
+def test_chunks_respect_chapter_boundaries_mid_page():
+    """Test that a chapter starting mid-page closes the previous chunk."""
+    pages = [
+        {"page_num": 1, "text": "Intro text.\n\nMore intro."},
+        {"page_num": 2, "text": "End of intro.\n\nCHAPTER  2\nSampling starts here."},
+    ]
+    toc = [
+        {"level": 1, "title": "Chapter 1", "page_num": 1},
+        {"level": 1, "title": "Chapter 2", "page_num": 2},
+    ]
+
+    chunks = chunk_text(pages, toc, max_tokens=100)
+
+    assert [chunk["chapter_title"] for chunk in chunks] == ["Chapter 1", "Chapter 2"]
+    assert chunks[0]["chunk_text"] == "Intro text. More intro. End of intro."
+    assert (chunks[0]["page_start"], chunks[0]["page_end"]) == (1, 2)
+    assert chunks[1]["chunk_text"].startswith("CHAPTER  2")
+    assert chunks[1]["page_num"] == 2
+
+
+def test_chunk_overlap_and_token_budget():
+    """Test that chunks stay within budget and repeat the overlap."""
+    sentences = " ".join(f"Sentence number {i} is here." for i in range(40))
+    pages = [{"page_num": 1, "text": sentences}]
+    toc = [{"level": 1, "title": "Chapter 1", "page_num": 1}]
+
+    chunks = chunk_text(pages, toc, max_tokens=30, overlap=12)
+
+    assert all(count_tokens(chunk["chunk_text"]) <= 30 for chunk in chunks)
+    for previous, chunk in zip(chunks, chunks[1:]):
+        # Each sentence is 6 tokens, so the last two are repeated
+        tail = ". ".join(previous["chunk_text"].split(". ")[-2:])
+        assert chunk["chunk_text"].startswith(tail)
+    assert chunks[-1]["chunk_text"].endswith("Sentence number 39 is here.")
+
+
+def test_write_chunks_jsonl(tmp_path):
+    """Test that chunks are written one compact JSON object per line."""
+    chunks = [
+        {"chapter_title": "Chapter 1", "page_num": 1, "chunk_text": "Alpha"},
+        {"chapter_title": "Chapter 1", "page_num": 2, "chunk_text": "Beta"},
+    ]
+    output_file = tmp_path / "book.pdf.jsonl"
+
+    count = write_chunks(iter(chunks), output_file)
+
+    assert count == 2
+    lines = output_file.read_text(encoding="utf-8").splitlines()
+    assert [json.loads(line) for line in lines] == chunks
+    assert not (tmp_path / "book.pdf.jsonl.tmp").exists()
+
+
+def test_parse_book_skips_up_to_date_pdfs(tmp_path, monkeypatch):
+    """Test parsing PDFs across workers and skipping unchanged ones."""
+    import fitz
+
+    import src.autonomous_ta.load_data as load_data_module
+
+    for name in ["a.pdf", "b.pdf"]:
+        doc = fitz.open()
+        page = doc.new_page()
+        page.insert_text((72, 72), f"Content of {name}")
+        doc.set_toc([[1, "Chapter 1", 1]])
+        doc.save(tmp_path / name)
+        doc.close()
+    monkeypatch.setattr(load_data_module, "DATA_DIR", tmp_path)
+
+    output_files = parse_book(workers=2)
+    assert sorted(path.name for path in output_files) == ["a.pdf.jsonl", "b.pdf.jsonl"]
+    with open(tmp_path / "a.pdf.jsonl", encoding="utf-8") as f:
+        chunk = json.loads(f.readline())
+    assert chunk["chapter_title"] == "Chapter 1"
+    assert "Content of a.pdf" in chunk["chunk_text"]
+
+    assert parse_book(workers=2) == []
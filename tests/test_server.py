@@ -0,0 +1,147 @@
+"""Tests for the query server."""
+
+import json
+import os
+import threading
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pytest
+
+os.environ.setdefault("OPENAI_API_KEY", "test-key")
+
+from src.autonomous_ta.server import BatchingEmbedder, QueryServer
+
+
+class CountingEmbedder:
+    """Encodes a text as its length and counts encode calls."""
+
+    def __init__(self):
+        self.calls = []
+        self.last_throughput = 1.0
+
+    def encode(self, texts, **kwargs):
+        self.calls.append(list(texts))
+        return np.array([[len(text), 1.0] for text in texts], dtype="float32")
+
+
+class FakeDB:
+    """Retrieval stand-in that embeds questions through its embedder."""
+
+    def __init__(self):
+        self.embedder = CountingEmbedder()
+
+    def list_books(self):
+        return ["stats.pdf.jsonl"]
+
+    def live_rows(self):
+        return 1
+
+    def query(self, question, top_k=5, chapter_keywords=None, books=None, q_vec=None):
+        q_vec = self.embedder.encode([question])
+        return [
+            {
+                "chunk_text": question,
+                "chapter": "1.1",
+                "page": int(q_vec[0][0]),
+                "book": "stats.pdf.jsonl",
+                "distance": 0.0,
+                "top_k": top_k,
+            }
+        ]
+
+
+class FakeAgent:
+    """Agent stand-in that answers from retrieval alone."""
+
+    def __init__(self):
+        self.db = FakeDB()
+
+    def cache_stats(self):
+        return None
+
+    def answer_question(self, question, top_k=5, books=None):
+        chunks = self.db.query(question, top_k=top_k, books=books)
+        return f"Answer to {question}", chunks
+
+
+@pytest.fixture
+def server():
+    """Run a QueryServer on a free local port."""
+    agent = FakeAgent()
+    server = QueryServer(("127.0.0.1", 0), agent, max_batch=64, max_wait=0.05)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server, f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+    server.server_close()
+
+
+def post(url, payload):
+    """POST JSON and decode the JSON response."""
+    request = urllib.request.Request(
+        url,
+        data=json.dumps(payload).encode("utf-8"),
+        headers={"Content-Type": "application/json"},
+    )
+    with urllib.request.urlopen(request) as response:
+        return json.loads(response.read())
+
+
+def test_batching_embedder_coalesces_concurrent_requests():
+    """Test that concurrent single encodes share encode calls."""
+    inner = CountingEmbedder()
+    embedder = BatchingEmbedder(inner, max_batch=64, max_wait=0.05)
+    texts = [f"q{'x' * i}" for i in range(16)]
+
+    with ThreadPoolExecutor(max_workers=16) as pool:
+        vectors = list(pool.map(lambda text: embedder.encode([text]), texts))
+
+    assert [int(vector[0][0]) for vector in vectors] == [len(text) for text in texts]
+    assert len(inner.calls) < len(texts)
+    assert embedder.last_throughput == 1.0
+
+
+def test_server_endpoints(server):
+    """Test the health, answer, retrieve and metrics endpoints."""
+    _, url = server
+
+    with urllib.request.urlopen(url + "/health") as response:
+        assert json.loads(response.read())["books"] == ["stats.pdf.jsonl"]
+
+    answer = post(url + "/answer", {"question": "What is a mean?"})
+    assert answer["answer"] == "Answer to What is a mean?"
+    assert answer["chunks"][0]["page"] == len("What is a mean?")
+
+    retrieved = post(url + "/retrieve", {"question": "abc", "top_k": 1})
+    assert retrieved["chunks"][0]["chunk_text"] == "abc"
+
+    with urllib.request.urlopen(url + "/metrics") as response:
+        assert response.headers["Content-Type"].startswith("text/plain")
+        assert b"# TYPE autonomous_ta_stage_seconds summary" in response.read()
+
+
+def test_server_rejects_bad_requests(server):
+    """Test that malformed requests get a 400 response."""
+    _, url = server
+    with pytest.raises(urllib.error.HTTPError) as error:
+        post(url + "/answer", {"top_k": 3})
+    assert error.value.code == 400
+
+
+@pytest.mark.parametrize("top_k", [0, -3, 2.5, "5", True, None])
+def test_server_rejects_invalid_top_k(server, top_k):
+    """Test that a top_k that is not a positive integer gets a 400 response."""
+    _, url = server
+    for endpoint in ("/answer", "/retrieve"):
+        with pytest.raises(urllib.error.HTTPError) as error:
+            post(url + endpoint, {"question": "What is a mean?", "top_k": top_k})
+        assert error.value.code == 400
+
+
+def test_server_caps_top_k(server):
+    """Test that a huge top_k is capped at max_top_k."""
+    _, url = server
+    retrieved = post(url + "/retrieve", {"question": "abc", "top_k": 10**9})
+    assert retrieved["chunks"][0]["top_k"] == 50
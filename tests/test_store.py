@@ -0,0 +1,64 @@
+"""Tests for the on-disk embedding and chunk store."""
+
+import numpy as np
+
+from src.autonomous_ta import store
+from src.autonomous_ta.chunk_store import ChunkSegment, ChunkStore
+
+
+def test_save_and_load_embeddings(tmp_path):
+    """Test that saved embeddings are loaded back memory-mapped."""
+    chunks_file = tmp_path / "book.pdf.json"
+    embeddings = np.arange(12, dtype="float32").reshape(3, 4)
+    source_hash = store.content_hash(b"chunks")
+
+    store.save_embeddings(chunks_file, "all-MiniLM-L6-v2", source_hash, embeddings)
+    loaded = store.load_embeddings(chunks_file, "all-MiniLM-L6-v2", source_hash)
+
+    assert isinstance(loaded, np.memmap)
+    np.testing.assert_array_equal(loaded, embeddings)
+
+
+def test_load_embeddings_misses_on_changed_source(tmp_path):
+    """Test that a different content hash or model invalidates the store."""
+    chunks_file = tmp_path / "book.pdf.json"
+    embeddings = np.ones((2, 3), dtype="float32")
+    source_hash = store.content_hash(b"old chunks")
+    store.save_embeddings(chunks_file, "all-MiniLM-L6-v2", source_hash, embeddings)
+
+    new_hash = store.content_hash(b"new chunks")
+    assert store.load_embeddings(chunks_file, "all-MiniLM-L6-v2", new_hash) is None
+    assert store.load_embeddings(chunks_file, "other-model", source_hash) is None
+
+
+def test_store_paths_are_not_picked_up_as_chunks(tmp_path):
+    """Test that store files never end in .json."""
+    paths = store.store_paths(tmp_path / "book.pdf.json", "org/model")
+    assert all(not path.name.endswith(".json") for path in paths)
+    assert all("/" not in path.name for path in paths)
+
+
+def test_save_and_load_chunks_zero_copy(tmp_path):
+    """Test that columnar chunks round-trip and are loaded memory-mapped."""
+    chunks_file = tmp_path / "book.pdf.jsonl"
+    chunks = [
+        {"chapter_title": "1.1 Mean", "chapter_level": 2, "page_num": 3, "chunk_text": "Moyenne é"},
+        {"chapter_title": "1.1 Mean", "chapter_level": 2, "page_num": 4, "chunk_text": ""},
+        {"chapter_title": "1.2 Median", "chapter_level": 2, "page_num": 5, "chunk_text": "Median"},
+    ]
+    source_hash = store.content_hash(b"chunks")
+    store.save_chunks(chunks_file, source_hash, ChunkSegment.from_chunks(chunks))
+
+    loaded = store.load_chunks(chunks_file, source_hash)
+    assert isinstance(loaded.blob, np.memmap)
+    assert loaded.texts() == ["Moyenne é", "", "Median"]
+    assert loaded.pages.tolist() == [3, 4, 5]
+    assert store.load_chunks(chunks_file, store.content_hash(b"new")) is None
+
+    chunk_store = ChunkStore()
+    chunk_store.append("book.pdf.jsonl", loaded)
+    assert chunk_store.texts[-1] == "Median"
+    assert chunk_store.metadata[0] == {
+        "chapter": "1.1 Mean", "level": 2, "page": 3, "book": "book.pdf.jsonl"
+    }
+    assert chunk_store.bytes_per_row() < 64
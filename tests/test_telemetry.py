@@ -0,0 +1,72 @@
+"""Tests for pipeline telemetry."""
+
+import json
+import os
+from types import SimpleNamespace
+
+import pytest
+
+os.environ.setdefault("OPENAI_API_KEY", "test-key")
+
+import src.autonomous_ta.agent as agent_module
+from src.autonomous_ta.agent import TextbookAgent
+from src.autonomous_ta.telemetry import NULL_SPAN, Telemetry, telemetry
+from tests.test_agent import FakeCompletions, FakeDB
+
+
+@pytest.fixture
+def enabled(tmp_path):
+    """Enable the shared telemetry with a JSONL exporter for one test."""
+    path = tmp_path / "spans.jsonl"
+    telemetry.reset()
+    telemetry.enable(jsonl_path=path)
+    yield path
+    telemetry.disable()
+    telemetry.reset()
+
+
+def test_disabled_telemetry_records_nothing():
+    """Test that spans are no-ops until telemetry is enabled."""
+    recorder = Telemetry()
+    with recorder.span("search", input_size=3) as span:
+        span.set(output_size=5)
+
+    assert span is NULL_SPAN
+    assert recorder.current() is NULL_SPAN
+    assert recorder.stats() == {}
+
+
+def test_answer_question_emits_stage_spans(monkeypatch, enabled):
+    """Test that each stage is timed with tokens and cache status, and exported."""
+    completions = FakeCompletions()
+    monkeypatch.setattr(
+        agent_module, "client", SimpleNamespace(chat=SimpleNamespace(completions=completions))
+    )
+    agent = TextbookAgent(db=FakeDB(), router_threshold=None)
+
+    agent.answer_question("What is the mean?")
+    agent.answer_question("What is the mean?")
+
+    stats = telemetry.stats()
+    assert stats["answer_question"]["count"] == 2
+    assert stats["choose_chapters"]["output_size"] == 2
+    assert stats["synthesize_answer"]["cache_hits"] == 1
+    assert stats["synthesize_answer"]["cache_misses"] == 1
+    assert stats["synthesize_answer"]["prompt_tokens"] > 0
+    assert stats["evaluate_answer"]["completion_tokens"] == 1
+
+    spans = [json.loads(line) for line in enabled.read_text().splitlines()]
+    first = [span for span in spans if span["trace"] == spans[0]["trace"]]
+    assert {span["name"] for span in first} >= {
+        "answer_question", "choose_chapters", "build_context", "synthesize_answer"
+    }
+    assert {span["parent"] for span in first if span["name"] == "build_context"} == {
+        "synthesize_answer"
+    }
+
+    metrics = telemetry.prometheus_text()
+    assert "# TYPE autonomous_ta_stage_seconds summary" in metrics
+    assert "# TYPE autonomous_ta_stage_seconds_sum" not in metrics
+    assert 'autonomous_ta_stage_seconds_count{stage="answer_question"} 2' in metrics
+    assert 'autonomous_ta_cache_total{stage="synthesize_answer",result="hit"} 1' in metrics
+    assert "stage" in telemetry.report().splitlines()[0]
@@ -5,9 +5,11 @@ import os
 import tempfile
 from pathlib import Path
 
+import faiss
+import numpy as np
 import pytest
 
-from src.autonomous_ta.vector_db import VectorDB
+from src.autonomous_ta.vector_db import VectorDB, normalize_rows
 
 
 @pytest.fixture
@@ -63,7 +65,9 @@ def test_list_chapters(temp_json_file, sample_chunks, monkeypatch):
         db.build_index()
         
         chapters = db.list_chapters()
-        expected_chapters = sorted(set(chunk["chapter_title"] for chunk in sample_chunks))
+        expected_chapters = sorted(
+            set(f"{chunk['chapter_title']} [{temp_json_file.name}]" for chunk in sample_chunks)
+        )
         assert chapters == expected_chapters
     finally:
         vdb_module.DATA_DIR = original_data_dir
@@ -109,3 +113,628 @@ def test_query_with_chapter_filter(temp_json_file, monkeypatch):
         assert all("Introduction" in result["chapter"] for result in results)
     finally:
         vdb_module.DATA_DIR = original_data_dir
+
+
+def test_query_encodes_only_the_question(temp_json_file, monkeypatch):
+    """Test that querying reuses the stored embeddings instead of re-encoding chunks."""
+    import src.autonomous_ta.vector_db as vdb_module
+
+    monkeypatch.setattr(vdb_module, "DATA_DIR", temp_json_file.parent)
+    db = VectorDB()
+    db.build_index()
+
+    encoded = []
+    original_encode = db.model.encode
+
+    def counting_encode(texts, *args, **kwargs):
+        encoded.append(texts)
+        return original_encode(texts, *args, **kwargs)
+
+    monkeypatch.setattr(db.model, "encode", counting_encode)
+    db.query("statistics", top_k=5, chapter_keywords=["Chapter 2: Methods"])
+
+    assert encoded == [["statistics"]]
+
+
+def test_filter_rows_uses_chapter_mapping(temp_json_file, monkeypatch):
+    """Test that chapter filtering resolves to the precomputed row ids."""
+    import src.autonomous_ta.vector_db as vdb_module
+
+    monkeypatch.setattr(vdb_module, "DATA_DIR", temp_json_file.parent)
+    db = VectorDB()
+    db.build_index()
+
+    assert db.filter_rows(["Chapter 1: Introduction"]).tolist() == [0, 1]
+    assert db.filter_rows(["Nonexistent"]) is None
+
+    results = db.query("statistics", top_k=5, chapter_keywords=["Chapter 2"])
+    assert [result["page"] for result in results] == [10]
+
+
+def test_build_index_reuses_cached_embeddings(temp_json_file, monkeypatch):
+    """Test that a second build loads embeddings from disk instead of encoding."""
+    import src.autonomous_ta.vector_db as vdb_module
+
+    monkeypatch.setattr(vdb_module, "DATA_DIR", temp_json_file.parent)
+    VectorDB().build_index()
+
+    db = VectorDB()
+    monkeypatch.setattr(
+        db.model,
+        "encode",
+        lambda *args, **kwargs: pytest.fail("chunks were re-encoded"),
+    )
+    db.build_index()
+
+    assert db.index.ntotal == 3
+    assert db.list_chapters() == [
+        "Chapter 1: Introduction [test_book.pdf.json]",
+        "Chapter 2: Methods [test_book.pdf.json]",
+    ]
+
+
+@pytest.fixture
+def two_book_dir(sample_chunks, tmp_path):
+    """Create two chunk files whose chapter titles overlap."""
+    other_chunks = [
+        {
+            "chapter_title": "Chapter 1: Introduction",
+            "page_num": 3,
+            "chunk_text": "An introduction to probability and random variables.",
+        },
+        {
+            "chapter_title": "Chapter 5: Inference",
+            "page_num": 40,
+            "chunk_text": "Hypothesis tests compare a statistic to a null distribution.",
+        },
+    ]
+    for name, chunks in [("a_book.pdf.json", sample_chunks), ("b_book.pdf.json", other_chunks)]:
+        with open(tmp_path / name, "w", encoding="utf-8") as f:
+            json.dump(chunks, f)
+    return tmp_path
+
+
+def test_build_index_merges_all_books(two_book_dir, monkeypatch):
+    """Test that every book ends up in one index with its own row range."""
+    import src.autonomous_ta.vector_db as vdb_module
+
+    monkeypatch.setattr(vdb_module, "DATA_DIR", two_book_dir)
+    db = VectorDB()
+    db.build_index()
+
+    assert db.index.ntotal == 5
+    assert db.books == {"a_book.pdf.json": (0, 3), "b_book.pdf.json": (3, 5)}
+    assert db.list_books() == ["a_book.pdf.json", "b_book.pdf.json"]
+    assert db.list_chapters(books=["b_book.pdf.json"]) == [
+        "Chapter 1: Introduction [b_book.pdf.json]",
+        "Chapter 5: Inference [b_book.pdf.json]",
+    ]
+
+
+def test_query_scoped_to_books(two_book_dir, monkeypatch):
+    """Test that book scoping keeps same-titled chapters apart."""
+    import src.autonomous_ta.vector_db as vdb_module
+
+    monkeypatch.setattr(vdb_module, "DATA_DIR", two_book_dir)
+    db = VectorDB()
+    db.build_index()
+
+    results = db.query(
+        "introduction",
+        top_k=5,
+        chapter_keywords=["Chapter 1: Introduction"],
+        books=["b_book.pdf.json"],
+    )
+    assert [(r["book"], r["page"]) for r in results] == [("b_book.pdf.json", 3)]
+
+    results = db.query("introduction", top_k=5, chapter_keywords=["Chapter 1"])
+    assert {r["book"] for r in results} == {"a_book.pdf.json", "b_book.pdf.json"}
+
+    assert db.query("introduction", books=["missing.pdf.json"]) == []
+    assert len(db.query("statistics", top_k=10, books=["a_book.pdf.json"])) == 3
+
+
+def test_same_chapter_title_stays_apart_per_book(two_book_dir, monkeypatch):
+    """Test that a title shared by two books is listed, routed and filtered per book."""
+    import src.autonomous_ta.vector_db as vdb_module
+
+    monkeypatch.setattr(vdb_module, "DATA_DIR", two_book_dir)
+    db = VectorDB()
+    db.build_index()
+
+    chapters = db.list_chapters()
+    assert "Chapter 1: Introduction [a_book.pdf.json]" in chapters
+    assert "Chapter 1: Introduction [b_book.pdf.json]" in chapters
+    assert len(chapters) == 4
+
+    rows = db.filter_rows(["Chapter 1: Introduction [b_book.pdf.json]"])
+    assert [db.metadata[row]["book"] for row in rows] == ["b_book.pdf.json"]
+    rows = db.filter_rows(["Chapter 1: Introduction"])
+    assert {db.metadata[row]["book"] for row in rows} == {
+        "a_book.pdf.json",
+        "b_book.pdf.json",
+    }
+
+    q_vec = db.embedder.encode(["An introduction to probability."])
+    routed = [chapter for chapter, _ in db.route_chapters(q_vec, top_n=4)]
+    assert sorted(routed) == chapters
+    results = db.query(
+        "introduction", chapter_keywords=[routed[0]], q_vec=q_vec
+    )
+    assert {f"{r['chapter']} [{r['book']}]" for r in results} == {routed[0]}
+
+
+def test_remove_book_tombstones_until_compaction(two_book_dir, monkeypatch):
+    """Test that removed books disappear from results before and after compaction."""
+    import src.autonomous_ta.vector_db as vdb_module
+
+    monkeypatch.setattr(vdb_module, "DATA_DIR", two_book_dir)
+    db = VectorDB(compact_threshold=1.0)
+    db.build_index()
+
+    db.remove_book("a_book.pdf.json")
+    assert db.index.ntotal == 5
+    assert db.list_books() == ["b_book.pdf.json"]
+    results = db.query("statistics", top_k=10)
+    assert {r["book"] for r in results} == {"b_book.pdf.json"}
+    assert len(results) == 2
+
+    db.compact()
+    assert db.index.ntotal == 2
+    assert db.books == {"b_book.pdf.json": (0, 2)}
+    assert len(db.query("statistics", top_k=10)) == 2
+
+
+def test_add_and_refresh_book_only_encode_the_change(two_book_dir, monkeypatch):
+    """Test that incremental updates encode only the affected book."""
+    import src.autonomous_ta.vector_db as vdb_module
+
+    monkeypatch.setattr(vdb_module, "DATA_DIR", two_book_dir)
+    db = VectorDB(cache_embeddings=False)
+    db.build_index()
+
+    encoded = []
+    original_encode = db.model.encode
+
+    def counting_encode(texts, *args, **kwargs):
+        encoded.append(list(texts))
+        return original_encode(texts, *args, **kwargs)
+
+    monkeypatch.setattr(db.model, "encode", counting_encode)
+
+    new_book = two_book_dir / "c_book.pdf.json"
+    with open(new_book, "w", encoding="utf-8") as f:
+        json.dump(
+            [{"chapter_title": "Chapter 9", "page_num": 1, "chunk_text": "Bayes rule."}], f
+        )
+    db.add_book(new_book)
+    assert encoded == [["Bayes rule."]]
+    assert db.books["c_book.pdf.json"] == (5, 6)
+
+    assert db.refresh_book(new_book) is False
+    with open(new_book, "w", encoding="utf-8") as f:
+        json.dump(
+            [{"chapter_title": "Chapter 9", "page_num": 1, "chunk_text": "Bayes theorem."}], f
+        )
+    db.sync()
+    assert encoded == [["Bayes rule."], ["Bayes theorem."]]
+    results = db.query("Bayes", top_k=10, books=["c_book.pdf.json"])
+    assert [r["chunk_text"] for r in results] == ["Bayes theorem."]
+
+
+def test_build_index_prefers_jsonl_chunks(sample_chunks, tmp_path, monkeypatch):
+    """Test that JSONL chunk files are indexed in place of older JSON output."""
+    import src.autonomous_ta.vector_db as vdb_module
+
+    with open(tmp_path / "book.pdf.json", "w", encoding="utf-8") as f:
+        json.dump(sample_chunks, f)
+    with open(tmp_path / "book.pdf.jsonl", "w", encoding="utf-8") as f:
+        for chunk in sample_chunks[:2]:
+            f.write(json.dumps(chunk) + "\n")
+    monkeypatch.setattr(vdb_module, "DATA_DIR", tmp_path)
+
+    db = VectorDB()
+    db.build_index()
+
+    assert db.books == {"book.pdf.jsonl": (0, 2)}
+
+
+def test_build_index_with_empty_book(temp_json_file, monkeypatch):
+    """Test that a book with no chunks, such as a scanned PDF, is indexed and cached."""
+    import src.autonomous_ta.vector_db as vdb_module
+
+    (temp_json_file.parent / "scanned.pdf.jsonl").write_text("")
+    monkeypatch.setattr(vdb_module, "DATA_DIR", temp_json_file.parent)
+    db = VectorDB()
+    original_encode = db.model.encode
+
+    def sentence_transformers_encode(texts, *args, **kwargs):
+        # SentenceTransformer returns a flat (0,) array for no input
+        if not len(texts):
+            return np.zeros(0, dtype="float32")
+        return original_encode(texts, *args, **kwargs)
+
+    monkeypatch.setattr(db.model, "encode", sentence_transformers_encode)
+    db.build_index()
+    assert db.books == {"scanned.pdf.jsonl": (0, 0), "test_book.pdf.json": (0, 3)}
+
+    db = VectorDB()
+    db.build_index()
+    assert db.books["scanned.pdf.jsonl"] == (0, 0)
+    assert len(db.query("statistics", books=["scanned.pdf.jsonl"])) == 0
+
+
+def test_embedder_preserves_input_order():
+    """Test that length-sorted batching returns embeddings in input order."""
+    db = VectorDB(batch_size=2)
+    texts = ["a", "a much longer sentence about regression", "mid length text"]
+
+    embeddings = db.embedder.encode(texts)
+
+    expected = np.asarray(db.model.encode(texts), dtype="float32")
+    np.testing.assert_allclose(embeddings, expected, rtol=1e-5, atol=1e-6)
+    assert db.embedder.last_throughput > 0
+
+
+@pytest.mark.parametrize("index_type", ["ivf", "hnsw", "ivfpq"])
+def test_approximate_index_types(index_type):
+    """Test that approximate indexes train and find exact matches."""
+    db = VectorDB(index_type=index_type, nprobe=16)
+    dim = db.model.get_sentence_embedding_dimension()
+    rng = np.random.default_rng(0)
+    embeddings = rng.standard_normal((600, dim)).astype("float32")
+    texts = [f"chunk {i}" for i in range(600)]
+    metadata = [
+        {"chapter": f"Chapter {i // 100}", "page": i, "book": "synthetic.pdf.jsonl"}
+        for i in range(600)
+    ]
+
+    db.set_corpus(texts, metadata, embeddings)
+
+    assert db.index.is_trained
+    assert db.index.ntotal == 600
+    distances, indices = db.search(embeddings[:20], top_k=1)
+    assert (indices[:, 0] == np.arange(20)).mean() >= 0.9
+
+    rows = db.filter_rows(["Chapter 3"])
+    _, indices = db.search(embeddings[300:301], top_k=5, rows=rows)
+    assert all(300 <= idx < 400 for idx in indices[0] if idx >= 0)
+
+
+@pytest.mark.parametrize("index_type", ["flat", "ivf", "hnsw"])
+@pytest.mark.parametrize("precision", ["float16", "int8"])
+def test_reduced_precision_index_reranks_exactly(index_type, precision):
+    """Test that quantized indexes are smaller and exact reranking restores flat distances."""
+    rng = np.random.default_rng(0)
+    embeddings = rng.standard_normal((600, 64)).astype("float32")
+    texts = [f"chunk {i}" for i in range(600)]
+    metadata = [
+        {"chapter": f"Chapter {i // 100}", "page": i, "book": "synthetic.pdf.jsonl"}
+        for i in range(600)
+    ]
+    exact = VectorDB()
+    exact.set_corpus(texts, metadata, embeddings)
+    full = VectorDB(index_type=index_type, nprobe=16)
+    full.set_corpus(texts, metadata, embeddings)
+    db = VectorDB(
+        index_type=index_type, precision=precision, nprobe=16, rerank_factor=4
+    )
+    db.set_corpus(texts, metadata, embeddings)
+
+    queries = embeddings[:20] + 0.01
+    expected_distances, expected = exact.search(queries, top_k=5)
+    distances, indices = db.search(queries, top_k=5)
+
+    size = len(faiss.serialize_index(db.index))
+    assert size < len(faiss.serialize_index(full.index))
+    assert (indices == expected).mean() >= 0.9
+    matched = indices == expected
+    assert np.allclose(
+        distances[matched], expected_distances[matched], rtol=1e-4, atol=1e-5
+    )
+
+    rows = db.filter_rows(["Chapter 3"])
+    _, indices = db.search(embeddings[300:301], top_k=5, rows=rows)
+    assert indices[0, 0] == 300
+    assert all(300 <= idx < 400 for idx in indices[0] if idx >= 0)
+
+
+@pytest.mark.filterwarnings("error")
+@pytest.mark.parametrize("rerank_factor", [0, 4])
+def test_float32_vectors_resident_only_for_reranking(rerank_factor):
+    """Test that uncached float32 vectors are memory-mapped unless reranking reads them."""
+    rng = np.random.default_rng(0)
+    embeddings = rng.standard_normal((300, 16)).astype("float32")
+    metadata = [
+        {"chapter": f"Chapter {i // 100}", "page": i, "book": f"{i // 200}.pdf.jsonl"}
+        for i in range(300)
+    ]
+    db = VectorDB(
+        cache_embeddings=False, precision="int8", rerank_factor=rerank_factor
+    )
+    db.set_corpus([f"chunk {i}" for i in range(300)], metadata, embeddings)
+
+    vectors = db.book_vectors["0.pdf.jsonl"]
+    assert isinstance(vectors, np.memmap) == (not rerank_factor)
+    assert np.allclose(vectors, normalize_rows(embeddings[:200]))
+    distances = db.row_distances(embeddings[250], np.array([250, 5]))
+    assert distances[0] == pytest.approx(0, abs=1e-6)
+
+    db.remove_book("1.pdf.jsonl")
+    assert len(db.chunks) == 200
+    assert np.allclose(db.book_vectors["0.pdf.jsonl"], vectors)
+    _, indices = db.search(embeddings[:5], top_k=1)
+    assert (indices[:, 0] == np.arange(5)).mean() >= 0.8
+
+
+@pytest.mark.filterwarnings("error")
+def test_padded_search_slots_do_not_overflow():
+    """Test that slots FAISS pads for a narrow filter come back as misses, without warnings."""
+    rng = np.random.default_rng(0)
+    embeddings = rng.standard_normal((600, 16)).astype("float32")
+    metadata = [
+        {"chapter": "Tiny" if i < 2 else "Rest", "page": i, "book": "synthetic.pdf.jsonl"}
+        for i in range(600)
+    ]
+    db = VectorDB(index_type="ivf", nprobe=1, hybrid=False)
+    db.set_corpus([f"chunk {i}" for i in range(600)], metadata, embeddings)
+
+    rows = db.filter_rows(["Tiny"])
+    distances, indices = db.search(-embeddings[:2], top_k=2, rows=rows)
+
+    assert (indices < 0).any()
+    assert (distances[indices < 0] == np.finfo("float32").max).all()
+    assert ((distances[indices >= 0] >= 0) & (distances[indices >= 0] <= 4)).all()
+    results = db.query("q", q_vec=-embeddings[:1], chapter_keywords=["Tiny"])
+    assert [result["row"] for result in results] == [
+        idx for idx in indices[0] if idx >= 0
+    ]
+
+
+def test_unknown_precision():
+    """Test that unsupported precisions and quantizing ivfpq are rejected."""
+    with pytest.raises(ValueError, match="Unknown precision"):
+        VectorDB(precision="int4")
+    with pytest.raises(ValueError, match="ivfpq"):
+        VectorDB(index_type="ivfpq", precision="int8")
+
+
+def test_unknown_index_type():
+    """Test that an unsupported index type is rejected."""
+    with pytest.raises(ValueError, match="Unknown index type"):
+        VectorDB(index_type="lsh")
+
+
+def test_trained_index_is_persisted(two_book_dir, monkeypatch):
+    """Test that a trained index is saved and reused on the next build."""
+    import src.autonomous_ta.vector_db as vdb_module
+
+    monkeypatch.setattr(vdb_module, "DATA_DIR", two_book_dir)
+    VectorDB(index_type="hnsw").build_index()
+    assert list(two_book_dir.glob("index.*.hnsw.faiss"))
+
+    db = VectorDB(index_type="hnsw")
+    monkeypatch.setattr(
+        db, "make_index", lambda *args: pytest.fail("index was rebuilt")
+    )
+    db.build_index()
+
+    assert db.index.ntotal == 5
+    results = db.query("hypothesis tests", top_k=5, books=["b_book.pdf.json"])
+    assert sorted(result["page"] for result in results) == [3, 40]
+
+
+def test_query_batch_matches_single_queries(two_book_dir, monkeypatch):
+    """Test that batched queries equal one-by-one queries with one encode call."""
+    import src.autonomous_ta.vector_db as vdb_module
+
+    monkeypatch.setattr(vdb_module, "DATA_DIR", two_book_dir)
+    db = VectorDB()
+    db.build_index()
+    questions = ["statistics", "hypothesis tests", "random variables"]
+    keywords = [["Chapter 1"], None, ["Chapter 1"]]
+    expected = [
+        db.query(question, top_k=2, chapter_keywords=kw)
+        for question, kw in zip(questions, keywords)
+    ]
+
+    encoded = []
+    original_encode = db.embedder.encode
+    monkeypatch.setattr(
+        db.embedder,
+        "encode",
+        lambda texts, **kwargs: encoded.append(texts) or original_encode(texts),
+    )
+    results = db.query_batch(questions, top_k=2, chapter_keywords=keywords)
+
+    assert results == expected
+    assert encoded == [questions]
+
+
+def test_route_chapters_ranks_chapter_centroids():
+    """Test that chapters are ranked by centroid similarity and follow removals."""
+    db = VectorDB()
+    metadata = [
+        {"chapter": "1.1 Mean", "page": 1, "book": "a.pdf.jsonl"},
+        {"chapter": "1.1 Mean", "page": 2, "book": "a.pdf.jsonl"},
+        {"chapter": "2.1 Variance", "page": 9, "book": "a.pdf.jsonl"},
+        {"chapter": "3.1 Tests", "page": 4, "book": "b.pdf.jsonl"},
+    ]
+    embeddings = np.array(
+        [[1, 0, 0], [0.8, 0.2, 0], [0, 1, 0], [0, 0, 1]], dtype="float32"
+    )
+    db.set_corpus(["a", "b", "c", "d"], metadata, embeddings)
+
+    routed = db.route_chapters(np.array([[0.9, 0.1, 0]]), top_n=2)
+    assert [chapter for chapter, _ in routed] == [
+        "1.1 Mean [a.pdf.jsonl]",
+        "2.1 Variance [a.pdf.jsonl]",
+    ]
+    assert routed[0][1] > 0.99
+
+    routed = db.route_chapters(np.array([0, 0, 1.0]), books=["a.pdf.jsonl"])
+    assert "3.1 Tests [b.pdf.jsonl]" not in [chapter for chapter, _ in routed]
+
+    db.remove_book("a.pdf.jsonl")
+    assert db.route_chapters(np.array([1.0, 0, 0])) == [
+        ("3.1 Tests [b.pdf.jsonl]", pytest.approx(0.0))
+    ]
+
+
+def test_query_excludes_rows_already_retrieved():
+    """Test that exclude_rows skips earlier results so top_k are all new."""
+    db = VectorDB(hybrid=False)
+    metadata = [
+        {"chapter": "1.1 Mean", "page": page, "book": "a.pdf.jsonl"}
+        for page in range(4)
+    ]
+    embeddings = np.array(
+        [[1, 0], [0.9, 0.1], [0.5, 0.5], [0, 1]], dtype="float32"
+    )
+    db.set_corpus(["a", "b", "c", "d"], metadata, embeddings)
+    q_vec = np.array([[1.0, 0.0]], dtype="float32")
+
+    first = db.query("q", top_k=2, q_vec=q_vec)
+    assert [result["row"] for result in first] == [0, 1]
+
+    second = db.query(
+        "q", top_k=2, q_vec=q_vec, exclude_rows=[r["row"] for r in first]
+    )
+    assert [result["row"] for result in second] == [2, 3]
+
+    filtered = db.query(
+        "q", top_k=2, chapter_keywords=["1.1"], q_vec=q_vec, exclude_rows=[0]
+    )
+    assert [result["row"] for result in filtered] == [1, 2]
+
+
+def test_chapter_filter_matches_whole_section_numbers():
+    """Test that "1.1" selects 1.1 and its subsections but not 1.10."""
+    db = VectorDB()
+    chapters = ["1.1 Mean", "1.1.2 Weighted Mean", "1.10 Ranges", "2.1 Spread"]
+    metadata = [
+        {"chapter": chapter, "level": chapter.count(".") or 1, "page": page, "book": "a.pdf.jsonl"}
+        for page, chapter in enumerate(chapters * 2, start=1)
+    ]
+    embeddings = np.eye(8, 4, dtype="float32")
+    db.set_corpus([str(i) for i in range(8)], metadata, embeddings)
+
+    assert db.filter_rows(["1.1"]).tolist() == [0, 1, 4, 5]
+    assert db.filter_rows(["1.10 ranges"]).tolist() == [2, 6]
+    assert db.filter_rows(["2.1 Spreads"]).tolist() == [3, 7]
+    assert db.filter_rows(["9.9 Missing"]) is None
+    assert db.list_chapters(level=2) == ["1.1.2 Weighted Mean [a.pdf.jsonl]"]
+
+
+def test_chapter_filter_by_toc_level():
+    """Test that a TOC level selects its chapters' rows, alone or with keywords."""
+    db = VectorDB()
+    chapters = ["1 Basics", "1.1 Mean", "1.1.2 Weighted Mean", "2 Spread"]
+    metadata = [
+        {"chapter": chapter, "level": chapter.split()[0].count(".") + 1, "page": page, "book": "a.pdf.jsonl"}
+        for page, chapter in enumerate(chapters * 2, start=1)
+    ]
+    embeddings = np.eye(8, 4, dtype="float32")
+    db.set_corpus([str(i) for i in range(8)], metadata, embeddings)
+
+    assert db.filter_rows(level=1).tolist() == [0, 3, 4, 7]
+    assert db.filter_rows(["1.1"], level=3).tolist() == [2, 6]
+    assert db.filter_rows(level=4).tolist() == []
+    assert db.filter_rows(level=2, books=["b.pdf.jsonl"]).tolist() == []
+
+    q_vec = np.array([[0.0, 0.0, 0.0, 1.0]], dtype="float32")
+    results = db.query("q", top_k=2, q_vec=q_vec, level=1)
+    assert {result["chapter"] for result in results} <= {"1 Basics", "2 Spread"}
+    assert db.query("q", q_vec=q_vec, level=4) == []
+    batched = db.query_batch(["q"], top_k=2, q_vecs=q_vec, level=1)
+    assert batched == [results]
+
+
+def test_rebuild_reads_columnar_chunks_without_parsing(temp_json_file, monkeypatch):
+    """Test that an unchanged book is loaded from its chunk store, not its JSON."""
+    import src.autonomous_ta.vector_db as vdb_module
+
+    monkeypatch.setattr(vdb_module, "DATA_DIR", temp_json_file.parent)
+    VectorDB().build_index()
+
+    db = VectorDB()
+    monkeypatch.setattr(
+        db, "read_chunks", lambda *args: pytest.fail("chunks were re-parsed")
+    )
+    db.build_index()
+
+    assert db.texts[2] == "This chapter discusses various statistical methods."
+    assert db.metadata[2]["chapter"] == "Chapter 2: Methods"
+    assert len(db.chunks.segments) == 1
+
+
+def test_hybrid_query_finds_exact_terms(two_book_dir, monkeypatch):
+    """Test that BM25 postings are persisted and fused into dense results."""
+    import src.autonomous_ta.vector_db as vdb_module
+
+    monkeypatch.setattr(vdb_module, "DATA_DIR", two_book_dir)
+    VectorDB().build_index()
+    assert list(two_book_dir.glob("*.bm25.npz"))
+
+    monkeypatch.setattr(
+        vdb_module.Postings,
+        "from_texts",
+        lambda texts: pytest.fail("postings were rebuilt"),
+    )
+    db = VectorDB()
+    db.build_index()
+    dense = VectorDB(hybrid=False)
+    dense.build_index()
+
+    question = "hypothesis"
+    rows, _ = db.lexical.search(question)
+    fused = db.query(question, top_k=2)
+    assert db.texts[int(rows[0])] in [result["chunk_text"] for result in fused]
+    assert all(isinstance(result["distance"], float) for result in fused)
+    assert len(dense.query(question, top_k=2)) == 2
+
+
+def test_normalized_scores_and_similarity_floor():
+    """Test that normalized search reports cosine scores and drops chunks below the floor."""
+    embeddings = np.array([[3.0, 0.0], [1.0, 1.0], [0.0, 2.0]], dtype="float32")
+    metadata = [
+        {"chapter": "Chapter 1", "page": page, "book": "synthetic.pdf.jsonl"}
+        for page in range(3)
+    ]
+    db = VectorDB(hybrid=False)
+    db.set_corpus(["right", "diagonal", "up"], metadata, embeddings)
+
+    assert db.index.metric_type == faiss.METRIC_INNER_PRODUCT
+    q_vec = np.array([[5.0, 0.0]], dtype="float32")
+    results = db.query("right", top_k=3, q_vec=q_vec)
+    assert [result["chunk_text"] for result in results] == ["right", "diagonal", "up"]
+    assert [round(result["score"], 3) for result in results] == [1.0, 0.707, 0.0]
+    assert [round(result["distance"], 3) for result in results] == [0.0, 0.586, 2.0]
+
+    db.min_score = 0.5
+    assert [r["chunk_text"] for r in db.query("right", top_k=3, q_vec=q_vec)] == [
+        "right",
+        "diagonal",
+    ]
+    q_vecs = np.array([[5.0, 0.0], [-1.0, -1.0], [0.2, 1.0]], dtype="float32")
+    assert db.has_match(q_vecs).tolist() == [True, False, True]
+    assert db.query("left", q_vec=np.array([[-1.0, 0.0]], dtype="float32")) == []
+
+
+def test_embedding_cache_is_keyed_by_normalization(temp_json_file, monkeypatch):
+    """Test that normalized and raw embeddings are cached separately."""
+    import src.autonomous_ta.vector_db as vdb_module
+
+    monkeypatch.setattr(vdb_module, "DATA_DIR", temp_json_file.parent)
+    VectorDB().build_index()
+    db = VectorDB(normalize=False)
+    db.build_index()
+
+    cached = sorted(path.name for path in temp_json_file.parent.glob("*.npy"))
+    assert len([name for name in cached if ".normalized." in name]) == 1
+    assert len([name for name in cached if "all-MiniLM-L6-v2.npy" in name]) == 1
+    assert db.index.metric_type == faiss.METRIC_L2
+    norms = np.linalg.norm(db.book_vectors["test_book.pdf.json"], axis=1)
+    assert np.allclose(
+        norms, np.linalg.norm(db.model.encode(db.texts), axis=1)
+    )